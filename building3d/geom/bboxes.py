@@ -1,8 +1,16 @@
 import numpy as np
 from numba import njit
+from numba import prange
 
 from building3d.config import GEOM_ATOL
 from building3d.geom.types import PointType, FLOAT
+from building3d.geom.types import INT
+from building3d.geom.types import IndexType
+
+# Below this number of boxes, `find_overlapping_bboxes()` compares all pairs with NumPy.
+# It avoids compiling the parallel sort and sweep, which takes longer
+# than the comparison of a few hundred boxes.
+MIN_BBOXES_FOR_SWEEP = 1000
 
 
 @njit
@@ -55,6 +63,116 @@ def are_bboxes_overlapping(
         return True
 
 
+def find_overlapping_bboxes(bbox_min: PointType, bbox_max: PointType) -> IndexType:
+    """Finds all pairs of overlapping bounding boxes.
+
+    Touching boxes are overlapping, like in `are_bboxes_overlapping()`.
+    Small sets of boxes (see `MIN_BBOXES_FOR_SWEEP`) are compared pair by pair
+    with NumPy, larger ones with sort and sweep (see `sweep_overlapping_bboxes()`).
+
+    Args:
+        bbox_min: minimum coordinates of the boxes, shape (num_boxes, 3)
+        bbox_max: maximum coordinates of the boxes, shape (num_boxes, 3)
+
+    Returns:
+        array of index pairs `(i, j)`, where `i < j`, sorted by `i` and `j`,
+        shape (num_pairs, 2)
+    """
+    if bbox_min.shape[0] >= MIN_BBOXES_FOR_SWEEP:
+        return sweep_overlapping_bboxes(bbox_min, bbox_max)
+
+    overlapping = np.ones((bbox_min.shape[0], bbox_min.shape[0]), dtype=bool)
+    for k in range(3):
+        overlapping &= bbox_max[:, np.newaxis, k] >= bbox_min[np.newaxis, :, k]
+        overlapping &= bbox_min[:, np.newaxis, k] <= bbox_max[np.newaxis, :, k]
+    i, j = np.nonzero(np.triu(overlapping, k=1))
+    return np.column_stack((i, j)).astype(INT)
+
+
+@njit(parallel=True)
+def sweep_overlapping_bboxes(bbox_min: PointType, bbox_max: PointType) -> IndexType:
+    """Finds all pairs of overlapping bounding boxes (sort and sweep).
+
+    The boxes are sorted by their minimum coordinate along the axis with the largest
+    spread of box centers. Each box is compared only with the next boxes in this order
+    which start before it ends. The overlap condition is the same as in
+    `are_bboxes_overlapping()`, i.e. touching boxes are overlapping.
+    The pairs are counted in the first pass and stored in the second one,
+    both passes are parallel.
+
+    Args:
+        bbox_min: minimum coordinates of the boxes, shape (num_boxes, 3)
+        bbox_max: maximum coordinates of the boxes, shape (num_boxes, 3)
+
+    Returns:
+        array of index pairs `(i, j)`, where `i < j`, sorted by `i` and `j`,
+        shape (num_pairs, 2)
+    """
+    num_boxes = bbox_min.shape[0]
+
+    # Sweep axis
+    spread = np.zeros(3, dtype=FLOAT)
+    for k in range(3):
+        spread[k] = (bbox_min[:, k] + bbox_max[:, k]).var()
+    axis = np.argmax(spread)
+    order = np.argsort(bbox_min[:, axis])
+
+    # Count pairs of each box
+    num_pairs = np.zeros(num_boxes, dtype=np.int64)
+    no_pairs = np.zeros((0, 2), dtype=INT)
+    for a in prange(num_boxes):
+        num_pairs[a] = sweep_bbox(a, axis, order, bbox_min, bbox_max, no_pairs, 0)
+
+    offset = np.zeros(num_boxes + 1, dtype=np.int64)
+    offset[1:] = np.cumsum(num_pairs)
+
+    # Store pairs
+    pairs = np.zeros((offset[-1], 2), dtype=INT)
+    for a in prange(num_boxes):
+        sweep_bbox(a, axis, order, bbox_min, bbox_max, pairs, offset[a])
+
+    # Sort pairs, so that the output doesn't depend on the sweep order
+    keys = pairs[:, 0].astype(np.int64) * num_boxes + pairs[:, 1]
+    return pairs[np.argsort(keys)]
+
+
+@njit
+def sweep_bbox(
+    a: int,
+    axis: int,
+    order: IndexType,
+    bbox_min: PointType,
+    bbox_max: PointType,
+    pairs: IndexType,
+    start: int,
+) -> int:
+    """Finds boxes overlapping box `order[a]` among the next boxes in the sweep order.
+
+    The pairs are stored in `pairs` starting from the row `start`,
+    unless `pairs` is empty (then they are only counted).
+
+    Returns:
+        number of pairs
+    """
+    i = order[a]
+    count = 0
+    for b in range(a + 1, order.size):
+        j = order[b]
+        if bbox_min[j, axis] > bbox_max[i, axis]:
+            break
+        overlapping = True
+        for k in range(3):
+            if bbox_max[i, k] < bbox_min[j, k] or bbox_min[i, k] > bbox_max[j, k]:
+                overlapping = False
+                break
+        if overlapping:
+            if pairs.shape[0] > 0:
+                pairs[start + count, 0] = min(i, j)
+                pairs[start + count, 1] = max(i, j)
+            count += 1
+    return count
+
+
 @njit
 def cube_edges(
     min_xyz: tuple[FLOAT, FLOAT, FLOAT],
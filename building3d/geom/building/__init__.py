@@ -4,14 +4,25 @@ import logging
 from typing import Sequence
 
 from building3d.random import random_id
+from building3d.geom.cache import get_cached
+from building3d.geom.cache import invalidate_cache
+from building3d.geom.cache import notify_geometry_changed
 from building3d.geom.building.get_mesh import get_mesh_from_zones
-from building3d.geom.building.graph import graph_polygon
-from building3d.geom.building.graph import graph_solid
-from building3d.geom.building.graph import graph_wall
-from building3d.geom.building.graph import graph_zone
+from building3d.geom.building.graph import graph_polygon_csr
+from building3d.geom.building.graph import iter_polygons
+from building3d.geom.building.graph import update_graph_polygon
+from building3d.geom.building.graph_csr import LEVELS
+from building3d.geom.building.graph_csr import GraphCSR
+from building3d.geom.building.graph_csr import get_index_maps
+from building3d.geom.building.graph_csr import get_node_paths
+from building3d.geom.building.graph_csr import graph_csr_to_dict
+from building3d.geom.building.graph_csr import roll_up_to_level
+from building3d.geom.building.solid_index import SolidIndex
+from building3d.geom.building.solid_index import make_building_solid_index
 from building3d.geom.exceptions import GeometryError
 from building3d.geom.paths import PATH_SEP
 from building3d.geom.paths.validate_name import validate_name
+from building3d.geom.polygon import Polygon
 from building3d.geom.bboxes import bounding_box
 from building3d.geom.solid.stitch import stitch_solids
 from building3d.geom.types import IndexType
@@ -48,15 +59,18 @@ class Building:
             self.uid = random_id()
         self.zones: dict[str, Zone] = {}  # {Zone.name: Zone}
         self.adj_solids = {}
+        self._cache: dict = {}  # Cached properties (see `building3d.geom.cache`)
+
+        # Cached graphs (see `get_graph_csr()`)
+        self.graph_params: tuple[bool, bool, bool] | None = None  # (facing, overlapping, touching)
+        self.graph_polygons: list[Polygon] = []  # Polygons numbered as in the polygon graph
+        self.graph_csr: dict[str, GraphCSR] = {}  # {level: graph}
+        self.graph_dict: dict[str, dict[str, list[str]]] = {}  # {level: graph}
+        self.graph_deferred: list[Polygon] | None = None  # Added polygons if updates are deferred
 
         for zn in zones:
             self.add_zone(zn)
 
-        self.graph = {}
-        self.graph_wall = {}
-        self.graph_solid = {}
-        self.graph_zone = {}
-
         logger.info(f"Building created: {self}")
 
     @property
@@ -78,8 +92,17 @@ class Building:
 
         zone.parent = self
         self.zones[zone.name] = zone
+        invalidate_cache(self)
         logger.info(f"Zone {zone.name} added: {self}")
 
+        # Update the cached graph (if any) with the polygons of the new zone
+        notify_geometry_changed(self, [
+            poly
+            for sld in zone.children.values()
+            for wall in sld.children.values()
+            for poly in wall.children.values()
+        ])
+
     def get(self, abspath: str):
         """Get object by the absolute path.
 
@@ -129,6 +152,9 @@ class Building:
 
     def get_polygon_paths(self) -> list[str]:
         """Returns a list of all paths to polygons belonging to this building."""
+        return get_cached(self, "polygon_paths", self._get_polygon_paths, token=self.path)
+
+    def _get_polygon_paths(self) -> list[str]:
         poly_paths = []
         bn = self.name
 
@@ -148,45 +174,145 @@ class Building:
         overlapping: bool = False,
         touching: bool = False,
     ) -> dict[str, list[str]]:
-        """Returns the graph of this building. Uses cached dict or makes new if requested.
+        """Returns the graph of this building as a dict with paths of connected objects.
+
+        The dict is made from the graph returned by `get_graph_csr()` and cached.
+
+        Args:
+            new: if True, recalculates the graph
+            level: "polygon" | "wall" | "solid" | "zone"
+            facing: if True will include polygons which are facing
+            overlapping: if True will include polygons which are overlapping
+            touching: if True will include polygons which are touching
+
+        Returns:
+            dict with connections at a specified level
+        """
+        g = self.get_graph_csr(new, level, facing, overlapping, touching)
+
+        if level not in self.graph_dict:
+            self.graph_dict[level] = graph_csr_to_dict(g, get_node_paths(self, level))
+
+        return self.graph_dict[level]
+
+    def get_graph_csr(
+        self,
+        new: bool = False,
+        level: str = "polygon",
+        facing: bool = True,
+        overlapping: bool = False,
+        touching: bool = False,
+    ) -> GraphCSR:
+        """Returns the graph of this building. Uses cached graph or makes new if requested.
 
         By default, assumes that connections are only when polygons are:
         - facing
         - not overlapping
         - not touching
 
+        The nodes are numbered like in the array format (see `to_array_format()`).
+        The cached graph is updated incrementally when polygons, walls, solids or zones
+        are replaced or added (see `update_graph()`), so it doesn't need to be recalculated.
+
         Args:
             new: if True, recalculates the graph
             level: "polygon" | "wall" | "solid" | "zone"
+            facing: if True will include polygons which are facing
+            overlapping: if True will include polygons which are overlapping
+            touching: if True will include polygons which are touching
 
         Returns:
-            dict with connections at a specified level
+            graph in the CSR format at a specified level
         """
-        if len(self.graph) == 0:
+        if level not in LEVELS:
+            raise ValueError(f"Level not recognized: {level}")
+
+        # The graph is made from scratch if it doesn't exist or has other connection types.
+        # Otherwise it is kept up to date by `update_graph()` after each geometry edit.
+        params = (facing, overlapping, touching)
+        if self.graph_params != params:
             new = True
 
         if new is True:
-            self.graph = graph_polygon(self, facing, overlapping, touching)
-            self.graph_wall = graph_wall(
-                self, facing, overlapping, touching, self.graph
-            )
-            self.graph_solid = graph_solid(
-                self, facing, overlapping, touching, self.graph
-            )
-            self.graph_zone = graph_zone(
-                self, facing, overlapping, touching, self.graph
+            self.graph_params = params
+            self.graph_polygons = list(iter_polygons(self))
+            self.graph_csr = {"polygon": graph_polygon_csr(self, facing, overlapping, touching)}
+            self.graph_dict = {}
+
+        if level not in self.graph_csr:
+            self.graph_csr[level] = roll_up_to_level(
+                self.graph_csr["polygon"], level, get_index_maps(self), len(self.zones)
             )
 
-        if level == "polygon":
-            return self.graph
-        elif level == "wall":
-            return self.graph_wall
-        elif level == "solid":
-            return self.graph_solid
-        elif level == "zone":
-            return self.graph_zone
-        else:
-            raise ValueError(f"Level not recognized: {level}")
+        return self.graph_csr[level]
+
+    def get_solid_index(self) -> SolidIndex:
+        """Returns the solid index used to find solids containing points.
+
+        The index is cached until the geometry changes (see `building3d.geom.cache`).
+        Solids are numbered like in `get_node_paths(bdg, "solid")`.
+        """
+        return get_cached(self, "solid_index", lambda: make_building_solid_index(self))
+
+    def get_solid_paths(self) -> list[str]:
+        """Returns a list of paths of solids, ordered by their numbers in the solid index.
+
+        The list is cached until the geometry or the name of the building changes.
+        It is the inverse of `get_solid_numbers()`.
+        """
+        return get_cached(
+            self, "solid_paths", lambda: get_node_paths(self, "solid"), token=self.path
+        )
+
+    def get_solid_numbers(self) -> dict[str, int]:
+        """Returns a dict mapping paths of solids to their numbers in the solid index.
+
+        The dict is cached until the geometry or the name of the building changes.
+        """
+        return get_cached(self, "solid_numbers", self._get_solid_numbers, token=self.path)
+
+    def _get_solid_numbers(self) -> dict[str, int]:
+        return {path: sn for sn, path in enumerate(self.get_solid_paths())}
+
+    def geometry_changed(self, added: Sequence[Polygon] = ()) -> None:
+        """Updates the cached data after some polygons were removed or added.
+
+        The cached properties are already cleared by `invalidate_cache()`,
+        so only the graph needs to be updated (see `update_graph()`).
+
+        This method is called by `Wall.replace_polygon()`, `Solid.replace_wall()`,
+        `Zone.add_solid()` and `Building.add_zone()` (see `notify_geometry_changed()`).
+
+        Args:
+            added: added polygons (already in the building)
+        """
+        self.update_graph(added)
+
+    def update_graph(self, added: Sequence[Polygon] = ()) -> None:
+        """Updates the cached graph after some polygons were removed or added.
+
+        Only the connections of the added polygons are calculated.
+        The wall, solid and zone graphs are rolled up from the polygon graph
+        next time they are requested. Nothing is done if there is no cached graph.
+        During `stitch_solids()` the added polygons are collected and the graph
+        is updated once at the end.
+
+        Args:
+            added: added polygons (already in the building)
+        """
+        if self.graph_params is None:
+            return
+
+        if self.graph_deferred is not None:
+            self.graph_deferred.extend(added)
+            return
+
+        logger.debug(f"Updating graph: {len(added)} added polygons")
+        g, self.graph_polygons = update_graph_polygon(
+            self, self.graph_csr["polygon"], self.graph_polygons, added, *self.graph_params
+        )
+        self.graph_csr = {"polygon": g}
+        self.graph_dict = {}
 
     def stitch_solids(self):
         """Find adjacent solids and stitch them."""
@@ -194,30 +320,32 @@ class Building:
 
         # Find adjacent solids
         adj_solids = self.get_graph(new=False, level="solid", facing=True, overlapping=True)
-        done = []
-
-        for s_path in adj_solids.keys():
-            for adj_s_path in adj_solids[s_path]:
-                _, z1_name, s_name = s_path.split(PATH_SEP)
-                _, z2_name, adj_s_name = adj_s_path.split(PATH_SEP)
-
-                if set([s_name, adj_s_name]) not in done:
-                    stitch_solids(
-                        s1=self.zones[z1_name].solids[s_name],
-                        s2=self.zones[z2_name].solids[adj_s_name],
-                    )
-                    done.append(set([s_name, adj_s_name]))
+        done = set()
+
+        # The graph is updated once after all solids are stitched
+        self.graph_deferred = []
+        try:
+            for s_path in adj_solids.keys():
+                for adj_s_path in adj_solids[s_path]:
+                    _, z1_name, s_name = s_path.split(PATH_SEP)
+                    _, z2_name, adj_s_name = adj_s_path.split(PATH_SEP)
+
+                    if frozenset([s_name, adj_s_name]) not in done:
+                        stitch_solids(
+                            s1=self.zones[z1_name].solids[s_name],
+                            s2=self.zones[z2_name].solids[adj_s_name],
+                        )
+                        done.add(frozenset([s_name, adj_s_name]))
+        finally:
+            added, self.graph_deferred = self.graph_deferred, None
+            self.update_graph(added)
 
     def volume(self) -> float:
         """Calculate building volume as the sum of zone volumes."""
-        volume = 0.0
-        for z in self.children.values():
-            volume += z.volume()
-        return volume
+        return get_cached(self, "volume", lambda: sum(z.volume() for z in self.zones.values()))
 
     def bbox(self) -> tuple[PointType, PointType]:
-        pts, _ = self.get_mesh()
-        return bounding_box(pts)
+        return get_cached(self, "bbox", lambda: bounding_box(self.get_mesh()[0]))
 
     def get_mesh(self) -> tuple[PointType, IndexType]:
         """Get vertices and faces of this building's polygons.
@@ -227,7 +355,9 @@ class Building:
         Return:
             tuple of vertices and faces
         """
-        return get_mesh_from_zones(list(self.children.values()))
+        return get_cached(
+            self, "mesh", lambda: get_mesh_from_zones(list(self.children.values()))
+        )
 
     def __str__(self):
         s = f"Building(name={self.name}, "
@@ -1,5 +1,10 @@
+import numpy as np
+
 from building3d.geom.building import Building
+from building3d.geom.building.solid_index import find_solids
+from building3d.geom.building.solid_index import is_point_inside_solid
 from building3d.geom.solid import Solid
+from building3d.geom.types import FLOAT
 from building3d.geom.types import PointType
 
 
@@ -14,31 +19,42 @@ def find_location(p: PointType, building: Building, *first_look_at: str) -> str:
     Return:
         path to current solid, e.g. "zone_name/solid_name"
     """
-    solids_to_search = list(first_look_at)
-
-    for z in building.children.values():
-        for s in z.children.values():
-            solids_to_search.append(s.path)
-
-    location = ""
-
-    found = False
+    index = building.get_solid_index()
+    solid_numbers = building.get_solid_numbers()
+    p = np.asarray(p, dtype=FLOAT)
 
-    for path_to_solid in solids_to_search:
+    for path_to_solid in first_look_at:
         s = building.get(path_to_solid)
 
         if isinstance(s, Solid):
-            if s.is_point_inside(p):
-                location = path_to_solid
-
-                found = True
-                break
+            if is_point_inside_solid(p, index, solid_numbers[s.path]):
+                return path_to_solid
         else:
             raise TypeError(f"Incorrect solid type: {s}")
 
-    if not found:
+    sn = find_solids(p.reshape((1, 3)), index)[0]
+
+    if sn < 0:
         raise RuntimeError(f"Point ({p}) not found in any of the solids of {building}")
 
-    assert len(location) > 0
+    return building.get_solid_paths()[sn]
+
+
+def find_locations(points: PointType, building: Building) -> list[str | None]:
+    """Return paths to solids containing the points.
+
+    All points are checked at once using the solid index of the building
+    (see `Building.get_solid_index()`).
+
+    Args:
+        points: considered points, shape `(num_points, 3)`
+        building: considered building
+
+    Return:
+        list of paths to solids (None if a point is not inside any solid)
+    """
+    index = building.get_solid_index()
+    solid_paths = building.get_solid_paths()
+    points = np.asarray(points, dtype=FLOAT).reshape((-1, 3))
 
-    return location
+    return [solid_paths[sn] if sn >= 0 else None for sn in find_solids(points, index).tolist()]
@@ -2,11 +2,29 @@ import logging
 from typing import Iterable
 
 import numpy as np
-
+from numba import njit
+from numba import prange
+from scipy.spatial import KDTree
+
+from building3d.config import GEOM_RTOL
+from building3d.geom.building.graph_csr import GraphCSR
+from building3d.geom.building.graph_csr import get_edges
+from building3d.geom.building.graph_csr import get_index_maps
+from building3d.geom.building.graph_csr import get_node_paths
+from building3d.geom.building.graph_csr import graph_csr_to_dict
+from building3d.geom.building.graph_csr import make_graph_csr
+from building3d.geom.building.graph_csr import roll_up_to_level
 from building3d.geom.paths import PATH_SEP
 from building3d.geom.polygon import Polygon
-from building3d.geom.bboxes import bounding_box
-from building3d.geom.bboxes import are_bboxes_overlapping
+from building3d.geom.bboxes import find_overlapping_bboxes
+from building3d.geom.polygon.crossing import are_polygons_crossing
+from building3d.geom.polygon.facing import are_polygons_facing
+from building3d.geom.polygon.touching import are_polygons_touching
+from building3d.geom.types import BoolDataType
+from building3d.geom.types import INT
+from building3d.geom.types import IndexType
+from building3d.geom.types import PointType
+from building3d.geom.types import VectorType
 from building3d.geom.solid import Solid
 from building3d.geom.wall import Wall
 from building3d.geom.zone import Zone
@@ -14,6 +32,14 @@ from building3d.geom.zone import Zone
 
 logger = logging.getLogger(__name__)
 
+# If more than 1/UPDATE_SWEEP_RATIO of the polygons were added, `update_graph_polygon()`
+# finds the candidate pairs with sort and sweep instead of checking each added polygon
+UPDATE_SWEEP_RATIO = 32
+
+# Below this number of candidate pairs, `check_polygon_pairs()` checks the pairs one by one.
+# It avoids compiling the parallel loop (about 50 s), which is not worth it for small buildings.
+MIN_PAIRS_FOR_PARALLEL_CHECK = 20000
+
 
 def graph_polygon(
     bdg,  # Can't declare type Building due to circular import
@@ -23,6 +49,8 @@ def graph_polygon(
 ) -> dict[str, list[str]]:
     """Makes a building graph based on polygon connections.
 
+    The graph is made with `graph_polygon_csr()` and converted to a dict.
+
     Args:
         bdg: building instance
         facing: if True will include polygons which are facing
@@ -32,51 +60,275 @@ def graph_polygon(
     Retruns:
         graph dictionary
     """
+    g = graph_polygon_csr(bdg, facing, overlapping, touching)
+    return graph_csr_to_dict(g, get_node_paths(bdg, "polygon"))
+
+
+def graph_polygon_csr(
+    bdg,  # Can't declare type Building due to circular import
+    facing=True,
+    overlapping=True,
+    touching=False,
+) -> GraphCSR:
+    """Makes a building graph based on polygon connections in the CSR format.
+
+    Polygons are numbered like in the array format (see `graph_csr.py`).
+    Only the pairs of polygons with overlapping bounding boxes can be connected.
+    These pairs are found with sort and sweep (see `find_overlapping_bboxes()`)
+    and then checked, in parallel if there are many (see `check_polygon_pairs()`).
+
+    Args:
+        bdg: building instance
+        facing: if True will include polygons which are facing
+        overlapping: if True will include polygons which are overlapping
+        touching: if True will include polygons which are touching
+
+    Retruns:
+        polygon graph
+    """
     logger.debug("Creating a building graph based on polygon connections.")
 
-    g = {}
-    checked = set()
+    polygons = list(iter_polygons(bdg))
+    if len(polygons) < 2:
+        return make_graph_csr(np.zeros((0, 2), dtype=INT), len(polygons))
 
-    num_checked = 0
-    for pl1 in iter_polygons(bdg):
-        for pl2 in iter_polygons(bdg):
+    # Broad phase: pairs of polygons with overlapping bounding boxes
+    bbox_min = np.array([poly.pts.min(axis=0) for poly in polygons])
+    bbox_max = np.array([poly.pts.max(axis=0) for poly in polygons])
+    candidates = find_overlapping_bboxes(bbox_min, bbox_max)
+    logger.debug(f"Number of polygon pairs with overlapping bounding boxes = {len(candidates)}")
 
-            num_checked += 1
-            if num_checked % 10000 == 0:
-                logger.debug(f"Number of checked polygon pairs = {num_checked}")
+    # Narrow phase: checking for specific types of connections
+    pts, pts_offset = stack_arrays([poly.pts for poly in polygons])
+    tri, tri_offset = stack_arrays([poly.tri for poly in polygons])
+    vn = np.array([poly.vn for poly in polygons])
+    connected = check_polygon_pairs(
+        candidates, pts, pts_offset, tri, tri_offset, vn, facing, overlapping, touching
+    )
 
-            if pl1 is pl2:
-                continue
+    return make_graph_csr(candidates[connected], len(polygons))
 
-            if (pl1.path, pl2.path) not in checked:
-                if pl1.path not in g:
-                    g[pl1.path] = []
-                if pl2.path not in g:
-                    g[pl2.path] = []
 
-                # Pre-check based on are_bboxes_overlapping()
-                # If they are not overlapping, they are totally disconnected
-                bbox1 = bounding_box(pl1.pts)
-                bbox2 = bounding_box(pl2.pts)
-                if not are_bboxes_overlapping(bbox1, bbox2):
-                    continue
+def update_graph_polygon(
+    bdg,  # Can't declare type Building due to circular import
+    g: GraphCSR,
+    old_polygons: list[Polygon],
+    added: Iterable[Polygon],
+    facing=True,
+    overlapping=True,
+    touching=False,
+) -> tuple[GraphCSR, list[Polygon]]:
+    """Updates the polygon graph after some polygons were removed or added.
 
-                # Checking for specific types of connections
-                cond = []
-                if facing:
-                    cond.append(pl1.is_facing_polygon(pl2))
-                if overlapping:
-                    cond.append(pl1.is_crossing_polygon(pl2))
-                if touching:
-                    cond.append(pl1.is_touching_polygon(pl2))
+    Polygons are renumbered after each edit, so the connections of the polygons
+    which are still in the building are moved to their new numbers.
+    The connections of the removed polygons are dropped and only the added polygons
+    are checked for new connections. The added polygons must already be in the building.
+    The connection types must be the same as those used to make the graph.
 
-                if np.array(cond).any():
-                    g[pl1.path].append(pl2.path)
-                    g[pl2.path].append(pl1.path)
-                    checked.add((pl1.path, pl2.path))
-                    checked.add((pl2.path, pl1.path))
+    Args:
+        bdg: building instance
+        g: polygon graph made with `graph_polygon_csr()`
+        old_polygons: polygons numbered as in `g`
+        added: added polygons
+        facing: if True will include polygons which are facing
+        overlapping: if True will include polygons which are overlapping
+        touching: if True will include polygons which are touching
 
-    return g
+    Returns:
+        tuple of the updated polygon graph and the polygons numbered as in this graph
+    """
+    polygons = list(iter_polygons(bdg))
+    new_num = {id(poly): i for i, poly in enumerate(polygons)}
+    is_added = np.zeros(len(polygons), dtype=np.bool_)
+    for poly in added:
+        if id(poly) in new_num:  # Polygons added and removed since the last update are skipped
+            is_added[new_num[id(poly)]] = True
+
+    # Renumber the old connections (-1 for the removed polygons)
+    renumber = np.array([new_num.get(id(poly), -1) for poly in old_polygons], dtype=INT)
+    edges = renumber[get_edges(g)].reshape((-1, 2))
+    keep = (edges >= 0).all(axis=1)
+    keep[keep] = ~is_added[edges[keep]].any(axis=1)
+    edges = edges[keep]
+
+    if not is_added.any() or len(polygons) < 2:
+        return make_graph_csr(edges, len(polygons)), polygons
+
+    # Broad phase: pairs of an added polygon and any other polygon with overlapping bboxes
+    bbox_min = np.array([poly.pts.min(axis=0) for poly in polygons])
+    bbox_max = np.array([poly.pts.max(axis=0) for poly in polygons])
+    if is_added.sum() * UPDATE_SWEEP_RATIO > len(polygons):
+        # Many polygons added (e.g. after stitching): sort and sweep over all polygons
+        candidates = find_overlapping_bboxes(bbox_min, bbox_max)
+        candidates = candidates[is_added[candidates].any(axis=1)]
+    else:
+        pairs = set()
+        for i in np.nonzero(is_added)[0]:
+            overlapping_bbox = (bbox_max >= bbox_min[i]).all(axis=1)
+            overlapping_bbox &= (bbox_min <= bbox_max[i]).all(axis=1)
+            for j in np.nonzero(overlapping_bbox)[0]:
+                if j != i:
+                    pairs.add((min(i, j), max(i, j)))
+        candidates = np.array(sorted(pairs), dtype=INT).reshape(-1, 2)
+    logger.debug(f"Number of polygon pairs to check after the update = {len(candidates)}")
+
+    # Narrow phase (only the polygons from the candidate pairs are stacked)
+    if len(candidates) > 0:
+        involved, local = np.unique(candidates, return_inverse=True)
+        local = local.reshape(-1, 2).astype(INT)
+        pts, pts_offset = stack_arrays([polygons[i].pts for i in involved])
+        tri, tri_offset = stack_arrays([polygons[i].tri for i in involved])
+        vn = np.array([polygons[i].vn for i in involved])
+        connected = check_polygon_pairs(
+            local, pts, pts_offset, tri, tri_offset, vn, facing, overlapping, touching
+        )
+        edges = np.concatenate((edges, candidates[connected]))
+
+    return make_graph_csr(edges, len(polygons)), polygons
+
+
+def stack_arrays(arrays: list[np.ndarray]) -> tuple[np.ndarray, IndexType]:
+    """Stacks arrays along the first axis and returns the offset of each one."""
+    offset = np.zeros(len(arrays) + 1, dtype=np.int64)
+    offset[1:] = np.cumsum([arr.shape[0] for arr in arrays])
+    return np.concatenate(arrays), offset
+
+
+def check_polygon_pairs(
+    pairs: IndexType,
+    pts: PointType,
+    pts_offset: IndexType,
+    tri: IndexType,
+    tri_offset: IndexType,
+    vn: VectorType,
+    facing: bool,
+    overlapping: bool,
+    touching: bool,
+) -> BoolDataType:
+    """Checks which pairs of polygons are connected (facing, overlapping or touching).
+
+    A pair `(i, j)` is connected if any of the chosen connections is found
+    when polygon `i` is compared with polygon `j` or `j` is compared with `i`.
+    Many pairs (see `MIN_PAIRS_FOR_PARALLEL_CHECK`) are checked in parallel
+    (see `check_polygon_pairs_parallel()`), a few pairs one by one.
+
+    Args:
+        pairs: polygon index pairs, shape (num_pairs, 2)
+        pts: stacked points of all polygons
+        pts_offset: index of the first point of each polygon, shape (num_polygons + 1, )
+        tri: stacked triangles of all polygons (indices local to each polygon)
+        tri_offset: index of the first triangle of each polygon, shape (num_polygons + 1, )
+        vn: normal vectors of all polygons
+        facing: if True will include polygons which are facing
+        overlapping: if True will include polygons which are overlapping
+        touching: if True will include polygons which are touching
+
+    Returns:
+        boolean mask of connected pairs, shape (num_pairs, )
+    """
+    args = (pts, pts_offset, tri, tri_offset, vn, facing, overlapping, touching)
+    if pairs.shape[0] >= MIN_PAIRS_FOR_PARALLEL_CHECK:
+        return check_polygon_pairs_parallel(pairs, *args)
+
+    connected = np.zeros(pairs.shape[0], dtype=np.bool_)
+    for n in range(pairs.shape[0]):
+        connected[n] = is_pair_connected(pairs[n, 0], pairs[n, 1], *args)
+    return connected
+
+
+@njit(parallel=True)
+def check_polygon_pairs_parallel(
+    pairs: IndexType,
+    pts: PointType,
+    pts_offset: IndexType,
+    tri: IndexType,
+    tri_offset: IndexType,
+    vn: VectorType,
+    facing: bool,
+    overlapping: bool,
+    touching: bool,
+) -> BoolDataType:
+    """Checks which pairs of polygons are connected in parallel (see `check_polygon_pairs()`)."""
+    connected = np.zeros(pairs.shape[0], dtype=np.bool_)
+    for n in prange(pairs.shape[0]):
+        connected[n] = is_pair_connected_jit(
+            pairs[n, 0], pairs[n, 1], pts, pts_offset, tri, tri_offset, vn,
+            facing, overlapping, touching,
+        )
+    return connected
+
+
+def is_pair_connected(
+    i: int,
+    j: int,
+    pts: PointType,
+    pts_offset: IndexType,
+    tri: IndexType,
+    tri_offset: IndexType,
+    vn: VectorType,
+    facing: bool,
+    overlapping: bool,
+    touching: bool,
+) -> bool:
+    """Checks if polygons `i` and `j` are connected (in any order, see `check_polygon_pairs()`).
+
+    This is a Python function, so the polygon kernels get C-contiguous slices
+    and are not compiled again for non-contiguous arrays.
+    The parallel loop uses its compiled version `is_pair_connected_jit()`.
+    """
+    for a, b in ((i, j), (j, i)):
+        pts1 = pts[pts_offset[a]:pts_offset[a + 1]]
+        pts2 = pts[pts_offset[b]:pts_offset[b + 1]]
+        tri1 = tri[tri_offset[a]:tri_offset[a + 1]]
+        tri2 = tri[tri_offset[b]:tri_offset[b + 1]]
+        if (
+            (facing and are_polygons_facing(pts1, vn[a], pts2, vn[b]))
+            or (overlapping and are_polygons_crossing(pts1, tri1, pts2, tri2))
+            or (touching and are_polygons_touching(pts1, tri1, pts2, tri2))
+        ):
+            return True
+    return False
+
+
+is_pair_connected_jit = njit(is_pair_connected)
+
+
+def find_facing_polygons(bdg) -> list[tuple[str, str]]:
+    """Finds all pairs of facing polygons in the building.
+
+    Facing polygons have the same vertices, so their centroids are (almost) equal.
+    Candidate pairs are found with a KD-tree of polygon centroids
+    and only these pairs are checked with `is_facing_polygon()`.
+    The complexity is O(n log n) instead of O(n^2) in `graph_polygon()`,
+    where n is the number of polygons.
+
+    Args:
+        bdg: building instance
+
+    Returns:
+        list of pairs of polygon paths, sorted by the order of polygons in the building
+    """
+    logger.debug("Finding facing polygons in the building.")
+
+    polygons = list(iter_polygons(bdg))
+    if len(polygons) < 2:
+        return []
+
+    # Centroids of facing polygons may differ due to different triangulations,
+    # so the search radius is relative to the size of the building
+    centroids = np.array([poly.ctr for poly in polygons])
+    radius = GEOM_RTOL * max(np.ptp(centroids, axis=0).max(), 1.0)
+    candidates = KDTree(centroids).query_pairs(radius, output_type="ndarray")
+    candidates = candidates[np.lexsort((candidates[:, 1], candidates[:, 0]))]
+    logger.debug(f"Number of candidate polygon pairs = {len(candidates)}")
+
+    pairs = []
+    for i, j in candidates:
+        if polygons[i].is_facing_polygon(polygons[j]):
+            pairs.append((polygons[i].path, polygons[j].path))
+
+    return pairs
 
 
 def graph_wall(
@@ -97,7 +349,7 @@ def graph_wall(
         graph dictionary
     """
     if g is None or len(g) == 0:
-        g = graph_polygon(bdg, facing, overlapping, touching)
+        return graph_level(bdg, "wall", facing, overlapping, touching)
     return strip_graph(g, n=1)
 
 
@@ -119,7 +371,7 @@ def graph_solid(
         graph dictionary
     """
     if g is None or len(g) == 0:
-        g = graph_polygon(bdg, facing, overlapping, touching)
+        return graph_level(bdg, "solid", facing, overlapping, touching)
     return strip_graph(g, n=2)
 
 
@@ -141,10 +393,30 @@ def graph_zone(
         graph dictionary
     """
     if g is None or len(g) == 0:
-        g = graph_polygon(bdg, facing, overlapping, touching)
+        return graph_level(bdg, "zone", facing, overlapping, touching)
     return strip_graph(g, n=3)
 
 
+def graph_level(
+    bdg, level: str, facing=True, overlapping=True, touching=False
+) -> dict[str, list[str]]:
+    """Makes a building graph at the chosen level by rolling up the polygon graph.
+
+    Args:
+        bdg: building instance
+        level: "polygon" | "wall" | "solid" | "zone"
+        facing: if True will include polygons which are facing
+        overlapping: if True will include polygons which are overlapping
+        touching: if True will include polygons which are touching
+
+    Retruns:
+        graph dictionary
+    """
+    g = graph_polygon_csr(bdg, facing, overlapping, touching)
+    g = roll_up_to_level(g, level, get_index_maps(bdg), len(bdg.zones))
+    return graph_csr_to_dict(g, get_node_paths(bdg, level))
+
+
 def strip_graph(
     g: dict[str, list[str]],
     n: int,
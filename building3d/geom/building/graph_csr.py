@@ -0,0 +1,198 @@
+"""Building graphs in the compressed sparse row (CSR) format.
+
+Nodes are numbered like in the array format (see `to_array_format()`):
+polygons, walls, solids and zones are counted in the order of iteration over the building.
+The neighbors of node `i` are `indices[indptr[i]:indptr[i + 1]]` (sorted).
+Paths of the nodes are only needed to convert a graph to a dict (see `graph_csr_to_dict()`).
+"""
+import logging
+from typing import NamedTuple
+
+import numpy as np
+
+from building3d.geom.paths import PATH_SEP
+from building3d.geom.types import INT
+from building3d.geom.types import IndexType
+
+logger = logging.getLogger(__name__)
+
+LEVELS = ("zone", "solid", "wall", "polygon")
+
+
+class GraphCSR(NamedTuple):
+    indptr: IndexType  # shape (num_nodes + 1, )
+    indices: IndexType  # shape (2 * num_edges, )
+
+
+def make_graph_csr(pairs: IndexType, num_nodes: int) -> GraphCSR:
+    """Makes an undirected graph from pairs of connected nodes.
+
+    Duplicate pairs are merged. Both `(i, j)` and `(j, i)` mean the same edge.
+
+    Args:
+        pairs: node index pairs, shape (num_pairs, 2)
+        num_nodes: number of nodes in the graph
+
+    Returns:
+        graph in the CSR format
+    """
+    pairs = np.asarray(pairs, dtype=np.int64).reshape((-1, 2))
+    src = np.concatenate((pairs[:, 0], pairs[:, 1]))
+    dst = np.concatenate((pairs[:, 1], pairs[:, 0]))
+
+    keys = np.unique(src * num_nodes + dst)  # Sorted by source, then by destination
+    src = keys // num_nodes
+
+    indptr = np.zeros(num_nodes + 1, dtype=INT)
+    indptr[1:] = np.cumsum(np.bincount(src, minlength=num_nodes))
+    indices = (keys % num_nodes).astype(INT)
+
+    return GraphCSR(indptr, indices)
+
+
+def get_edges(g: GraphCSR) -> IndexType:
+    """Returns all edges `(i, j)` with `i < j`, shape (num_edges, 2)."""
+    num_nodes = g.indptr.shape[0] - 1
+    src = np.repeat(np.arange(num_nodes, dtype=INT), np.diff(g.indptr))
+    mask = src < g.indices
+    return np.stack((src[mask], g.indices[mask]), axis=1)
+
+
+def roll_up(g: GraphCSR, mapping: IndexType, num_groups: int) -> GraphCSR:
+    """Makes a graph of node groups, e.g. a wall graph from a polygon graph.
+
+    Two groups are connected if any of their nodes are connected.
+    Connections within a group are omitted.
+
+    Args:
+        g: graph of nodes
+        mapping: group number of each node, shape (num_nodes, )
+        num_groups: number of groups
+
+    Returns:
+        graph of groups in the CSR format
+    """
+    edges = get_edges(g)
+    src = mapping[edges[:, 0]]
+    dst = mapping[edges[:, 1]]
+    mask = src != dst
+    return make_graph_csr(np.stack((src[mask], dst[mask]), axis=1), num_groups)
+
+
+def get_index_maps(bdg) -> tuple[IndexType, IndexType, IndexType]:
+    """Returns arrays mapping polygons to walls, walls to solids and solids to zones.
+
+    The arrays are the same as `walls`, `solids` and `zones` in the array format.
+
+    Args:
+        bdg: building instance
+
+    Returns:
+        tuple of arrays shaped (num_polygons, ), (num_walls, ) and (num_solids, )
+    """
+    walls = []
+    solids = []
+    zones = []
+
+    for zn, z in enumerate(bdg.zones.values()):
+        for s in z.solids.values():
+            sn = len(zones)
+            zones.append(zn)
+            for w in s.walls.values():
+                wn = len(solids)
+                solids.append(sn)
+                walls.extend([wn] * len(w.polygons))
+
+    return np.array(walls, dtype=INT), np.array(solids, dtype=INT), np.array(zones, dtype=INT)
+
+
+def roll_up_to_level(
+    g: GraphCSR,
+    level: str,
+    index_maps: tuple[IndexType, IndexType, IndexType],
+    num_zones: int,
+) -> GraphCSR:
+    """Makes a wall, solid or zone graph from a polygon graph.
+
+    Args:
+        g: polygon graph
+        level: "polygon" | "wall" | "solid" | "zone"
+        index_maps: arrays returned by `get_index_maps()`
+        num_zones: number of zones in the building
+
+    Returns:
+        graph at the chosen level
+    """
+    if level not in LEVELS:
+        raise ValueError(f"Level not recognized: {level}")
+
+    if level == "polygon":
+        return g
+
+    # Compose the mappings from polygons up to the chosen level
+    walls, solids, zones = index_maps
+    mapping = walls
+    num_groups = solids.shape[0]
+    if level in ("solid", "zone"):
+        mapping = solids[mapping]
+        num_groups = zones.shape[0]
+    if level == "zone":
+        mapping = zones[mapping]
+        num_groups = num_zones
+
+    return roll_up(g, mapping, num_groups)
+
+
+def get_node_paths(bdg, level: str) -> list[str]:
+    """Returns paths of all polygons, walls, solids or zones, ordered by their numbers.
+
+    Args:
+        bdg: building instance
+        level: "polygon" | "wall" | "solid" | "zone"
+
+    Returns:
+        list of paths
+    """
+    if level not in LEVELS:
+        raise ValueError(f"Level not recognized: {level}")
+
+    depth = LEVELS.index(level)
+    paths = []
+
+    for zn, z in bdg.zones.items():
+        if depth == 0:
+            paths.append(PATH_SEP.join([bdg.name, zn]))
+            continue
+        for sn, s in z.solids.items():
+            if depth == 1:
+                paths.append(PATH_SEP.join([bdg.name, zn, sn]))
+                continue
+            for wn, w in s.walls.items():
+                if depth == 2:
+                    paths.append(PATH_SEP.join([bdg.name, zn, sn, wn]))
+                    continue
+                for pn in w.polygons.keys():
+                    paths.append(PATH_SEP.join([bdg.name, zn, sn, wn, pn]))
+
+    return paths
+
+
+def graph_csr_to_dict(g: GraphCSR, paths: list[str]) -> dict[str, list[str]]:
+    """Converts a graph to a dict `{path: [paths of neighbors]}`.
+
+    Args:
+        g: graph in the CSR format
+        paths: paths of the nodes (see `get_node_paths()`)
+
+    Returns:
+        graph dictionary
+    """
+    assert len(paths) == g.indptr.shape[0] - 1, "Number of paths must match the number of nodes"
+
+    indptr = g.indptr.tolist()
+    indices = g.indices.tolist()
+
+    return {
+        paths[i]: [paths[j] for j in indices[indptr[i]:indptr[i + 1]]]
+        for i in range(len(paths))
+    }
@@ -0,0 +1,356 @@
+"""Compiled index of solids used to find which solids contain given points.
+
+The index is a named tuple of arrays:
+- pts:               points of all polygons, shape `(num_points, 3)`
+- tri:               triangles of all polygons (indices in `pts`), shape `(num_faces, 3)`
+- poly_tri_offset:   offsets of polygon triangles in `tri`, shape `(num_polygons + 1, )`
+- poly_plane:        plane coefficients (a, b, c, d) of each polygon, with a unit normal,
+                     shape `(num_polygons, 4)`
+- solid_poly_offset: offsets of solid polygons, shape `(num_solids + 1, )`
+- solid_bbox:        bounding box (min, max) of each solid, shape `(num_solids, 2, 3)`
+- grid_min:          minimum corner of the grid, shape `(3, )`
+- grid_shape:        number of cells along x, y, z, shape `(3, )`
+- cell_size:         size of the grid cells
+- cell_offset:       offsets of cell solids in `cell_solids`, shape `(num_cells + 1, )`
+- cell_solids:       solids with bounding boxes overlapping each cell (sorted within cells)
+
+Polygons and solids are numbered like in the array format (see `to_array_format()`),
+so the polygons of each solid are contiguous. A point is tested only against the solids
+listed in its grid cell. The test uses the same ray casting as `Solid.is_point_inside()`:
+points on the boundary are inside, otherwise the number of polygons crossed
+by a ray cast from the point must be odd.
+"""
+from typing import NamedTuple
+
+import numpy as np
+from numba import njit
+from numba import prange
+
+from building3d.config import GEOM_ATOL
+from building3d.geom.building.graph import iter_polygons
+from building3d.geom.building.graph import stack_arrays
+from building3d.geom.building.graph_csr import get_index_maps
+from building3d.geom.triangles import is_point_inside_triangles
+from building3d.geom.types import FLOAT
+from building3d.geom.types import INT
+from building3d.geom.types import FloatDataType
+from building3d.geom.types import IndexType
+from building3d.geom.types import PointType
+
+# Same direction as in `Solid.is_point_inside()`
+RAY_DIRECTION = np.array([0.739, 0.239, 0.113]) / np.linalg.norm([0.739, 0.239, 0.113])
+
+# Average number of grid cells per solid and the max. number of cells along each axis
+CELLS_PER_SOLID = 4
+MAX_GRID_SHAPE = 256
+
+
+class SolidIndex(NamedTuple):
+    pts: PointType
+    tri: IndexType
+    poly_tri_offset: IndexType
+    poly_plane: FloatDataType
+    solid_poly_offset: IndexType
+    solid_bbox: PointType
+    grid_min: PointType
+    grid_shape: IndexType
+    cell_size: float
+    cell_offset: IndexType
+    cell_solids: IndexType
+
+
+def make_solid_index(
+    points: PointType,
+    faces: IndexType,
+    polygons: IndexType,
+    poly_solid: IndexType,
+    num_solids: int,
+) -> SolidIndex:
+    """Makes a solid index from arrays like in the array format.
+
+    Args:
+        points: array of points, shape `(num_points, 3)`
+        faces: array mapping points to faces, shape `(num_faces, 3)`
+        polygons: array mapping faces to polygons (sorted), shape `(num_faces, )`
+        poly_solid: array mapping polygons to solids (sorted), shape `(num_polygons, )`
+        num_solids: number of solids
+
+    Returns:
+        solid index
+    """
+    points = np.ascontiguousarray(points, dtype=FLOAT)
+    faces = np.ascontiguousarray(faces, dtype=INT)
+    num_polys = poly_solid.shape[0]
+
+    poly_tri_offset = np.zeros(num_polys + 1, dtype=INT)
+    poly_tri_offset[1:] = np.cumsum(np.bincount(polygons, minlength=num_polys))
+    solid_poly_offset = np.zeros(num_solids + 1, dtype=INT)
+    solid_poly_offset[1:] = np.cumsum(np.bincount(poly_solid, minlength=num_solids))
+
+    poly_plane = get_polygon_planes(points, faces, poly_tri_offset)
+
+    # Bounding boxes of solids (the points of a solid are referenced by its faces)
+    solid_bbox = np.zeros((num_solids, 2, 3), dtype=FLOAT)
+    face_solid = poly_solid[polygons]
+    for k in range(3):
+        coords = points[faces, k].reshape(-1, 3)
+        solid_bbox[:, 0, k] = np.inf
+        solid_bbox[:, 1, k] = -np.inf
+        np.minimum.at(solid_bbox[:, 0, k], face_solid, coords.min(axis=1))
+        np.maximum.at(solid_bbox[:, 1, k], face_solid, coords.max(axis=1))
+
+    # Grid with approx. `CELLS_PER_SOLID` cells per solid
+    if num_solids > 0:
+        grid_min = solid_bbox[:, 0].min(axis=0)
+        extent = np.maximum(solid_bbox[:, 1].max(axis=0) - grid_min, GEOM_ATOL)
+    else:
+        grid_min = np.zeros(3, dtype=FLOAT)
+        extent = np.ones(3, dtype=FLOAT)
+    cell_size = (np.prod(extent) / max(num_solids * CELLS_PER_SOLID, 1)) ** (1 / 3)
+    cell_size = max(cell_size, extent.max() / MAX_GRID_SHAPE)
+    grid_shape = np.clip(np.ceil(extent / cell_size), 1, MAX_GRID_SHAPE).astype(INT)
+
+    cell_offset, cell_solids = make_grid_cells(solid_bbox, grid_min, grid_shape, cell_size)
+
+    return SolidIndex(
+        pts=points,
+        tri=faces,
+        poly_tri_offset=poly_tri_offset,
+        poly_plane=poly_plane,
+        solid_poly_offset=solid_poly_offset,
+        solid_bbox=solid_bbox,
+        grid_min=grid_min.astype(FLOAT),
+        grid_shape=grid_shape,
+        cell_size=float(cell_size),
+        cell_offset=cell_offset,
+        cell_solids=cell_solids,
+    )
+
+
+def make_building_solid_index(bdg) -> SolidIndex:
+    """Makes a solid index of all solids of the building.
+
+    Args:
+        bdg: building instance
+
+    Returns:
+        solid index
+    """
+    polygons = list(iter_polygons(bdg))
+    walls, solids, zones = get_index_maps(bdg)
+
+    if len(polygons) == 0:
+        pts = np.zeros((0, 3), dtype=FLOAT)
+        tri = np.zeros((0, 3), dtype=INT)
+    else:
+        pts, pts_offset = stack_arrays([poly.pts for poly in polygons])
+        tri, tri_offset = stack_arrays([poly.tri for poly in polygons])
+        # Triangle indices are local to each polygon
+        tri = tri + np.repeat(pts_offset[:-1], np.diff(tri_offset))[:, np.newaxis]
+
+    face_poly = np.repeat(
+        np.arange(len(polygons), dtype=INT), [poly.tri.shape[0] for poly in polygons]
+    )
+    return make_solid_index(pts, tri, face_poly, solids[walls], zones.shape[0])
+
+
+@njit
+def get_polygon_planes(
+    pts: PointType,
+    tri: IndexType,
+    poly_tri_offset: IndexType,
+) -> FloatDataType:
+    """Returns plane coefficients (a, b, c, d) of polygons, with unit normal vectors.
+
+    The normal is the sum of the cross products of all triangles of a polygon,
+    so it doesn't depend on the choice of a single (e.g. very thin) triangle.
+    All triangles of a polygon must be oriented the same way.
+    """
+    num_polys = poly_tri_offset.shape[0] - 1
+    planes = np.zeros((num_polys, 4), dtype=FLOAT)
+
+    for pn in range(num_polys):
+        vn = np.zeros(3, dtype=FLOAT)
+        for ti in range(poly_tri_offset[pn], poly_tri_offset[pn + 1]):
+            vn += np.cross(pts[tri[ti, 1]] - pts[tri[ti, 0]], pts[tri[ti, 2]] - pts[tri[ti, 0]])
+        vn /= np.linalg.norm(vn)
+        pt = pts[tri[poly_tri_offset[pn], 0]]
+        planes[pn, :3] = vn
+        planes[pn, 3] = -(vn[0] * pt[0] + vn[1] * pt[1] + vn[2] * pt[2])
+
+    return planes
+
+
+@njit
+def make_grid_cells(
+    solid_bbox: PointType,
+    grid_min: PointType,
+    grid_shape: IndexType,
+    cell_size: float,
+) -> tuple[IndexType, IndexType]:
+    """Returns the CSR arrays (offsets, solids) of grid cells.
+
+    Each solid is added to all cells overlapping with its bounding box.
+    """
+    num_solids = solid_bbox.shape[0]
+    num_cells = grid_shape[0] * grid_shape[1] * grid_shape[2]
+
+    lo = np.zeros((num_solids, 3), dtype=INT)
+    hi = np.zeros((num_solids, 3), dtype=INT)
+    counts = np.zeros(num_cells + 1, dtype=INT)
+    for sn in range(num_solids):
+        for k in range(3):
+            lo[sn, k] = get_cell_coord(
+                solid_bbox[sn, 0, k] - GEOM_ATOL,
+                grid_min,
+                grid_shape,
+                cell_size,
+                k,
+            )
+            hi[sn, k] = get_cell_coord(
+                solid_bbox[sn, 1, k] + GEOM_ATOL,
+                grid_min,
+                grid_shape,
+                cell_size,
+                k,
+            )
+        for i in range(lo[sn, 0], hi[sn, 0] + 1):
+            for j in range(lo[sn, 1], hi[sn, 1] + 1):
+                for m in range(lo[sn, 2], hi[sn, 2] + 1):
+                    counts[(i * grid_shape[1] + j) * grid_shape[2] + m + 1] += 1
+
+    cell_offset = np.cumsum(counts).astype(INT)
+    cell_solids = np.zeros(cell_offset[-1], dtype=INT)
+    fill = cell_offset[:-1].copy()
+    for sn in range(num_solids):  # Solids are sorted within cells
+        for i in range(lo[sn, 0], hi[sn, 0] + 1):
+            for j in range(lo[sn, 1], hi[sn, 1] + 1):
+                for m in range(lo[sn, 2], hi[sn, 2] + 1):
+                    cell = (i * grid_shape[1] + j) * grid_shape[2] + m
+                    cell_solids[fill[cell]] = sn
+                    fill[cell] += 1
+
+    return cell_offset, cell_solids
+
+
+@njit
+def get_cell_coord(
+    x: float,
+    grid_min: PointType,
+    grid_shape: IndexType,
+    cell_size: float,
+    k: int,
+) -> int:
+    """Returns the cell coordinate of `x` along the axis `k` (clipped to the grid)."""
+    c = int(np.floor((x - grid_min[k]) / cell_size))
+    if c < 0:
+        return 0
+    elif c >= grid_shape[k]:
+        return grid_shape[k] - 1
+    return c
+
+
+@njit(parallel=True)
+def find_solids(ptest: PointType, index: SolidIndex, atol: float = GEOM_ATOL) -> IndexType:
+    """Finds the solids containing the points.
+
+    If a point is inside multiple solids (e.g. on a shared boundary),
+    the solid with the lowest number is returned.
+
+    Args:
+        ptest: points, shape `(num_points, 3)`
+        index: solid index (see `make_solid_index()`)
+        atol: absolute tolerance
+
+    Returns:
+        solid number of each point (-1 if the point is not inside any solid),
+        shape `(num_points, )`
+    """
+    num_pts = ptest.shape[0]
+    found = np.full(num_pts, -1, dtype=INT)
+
+    for i in prange(num_pts):
+        pt = ptest[i]
+
+        # Points outside the grid are outside all solids
+        cell = 0
+        outside = False
+        for k in range(3):
+            x = (pt[k] - index.grid_min[k]) / index.cell_size
+            if x < -atol / index.cell_size or x > index.grid_shape[k] + atol / index.cell_size:
+                outside = True
+                break
+            c = min(max(int(np.floor(x)), 0), index.grid_shape[k] - 1)
+            cell = cell * index.grid_shape[k] + c
+        if outside:
+            continue
+
+        for ci in range(index.cell_offset[cell], index.cell_offset[cell + 1]):
+            sn = index.cell_solids[ci]
+            if is_point_inside_solid(pt, index, sn, atol):
+                found[i] = sn
+                break
+
+    return found
+
+
+@njit
+def is_point_inside_solid(
+    ptest: PointType,
+    index: SolidIndex,
+    sn: int,
+    atol: float = GEOM_ATOL,
+) -> bool:
+    """Checks whether the point is inside the solid `sn` (the boundary is inside).
+
+    Equivalent to `Solid.is_point_inside()`, but uses the arrays of the solid index.
+    """
+    bbox = index.solid_bbox[sn]
+    for k in range(3):
+        if ptest[k] < bbox[0, k] - atol or ptest[k] > bbox[1, k] + atol:
+            return False
+
+    vx = RAY_DIRECTION[0]
+    vy = RAY_DIRECTION[1]
+    vz = RAY_DIRECTION[2]
+
+    num_crossings = 0
+    hit = np.zeros(3, dtype=FLOAT)
+    for pn in range(index.solid_poly_offset[sn], index.solid_poly_offset[sn + 1]):
+        a, b, c, d = index.poly_plane[pn]
+        dist = a * ptest[0] + b * ptest[1] + c * ptest[2] + d
+
+        # Point at the boundary
+        if np.abs(dist) < atol and is_point_inside_polygon(ptest, index, pn, atol):
+            return True
+
+        # Projection of the point along the ray onto the plane of the polygon
+        denom = a * vx + b * vy + c * vz
+        if np.abs(denom) < atol:
+            continue  # Parallel
+        s = -dist / denom
+        if s < 0:
+            continue
+        hit[0] = ptest[0] + s * vx
+        hit[1] = ptest[1] + s * vy
+        hit[2] = ptest[2] + s * vz
+        if is_point_inside_polygon(hit, index, pn, atol):
+            num_crossings += 1
+
+    return num_crossings % 2 == 1
+
+
+@njit
+def is_point_inside_polygon(
+    ptest: PointType,
+    index: SolidIndex,
+    pn: int,
+    atol: float = GEOM_ATOL,
+) -> bool:
+    """Checks whether a point laying on the polygon's plane is inside any of its triangles.
+
+    Points closer than `atol` to the edges of a triangle are assumed to be inside.
+    """
+    # Triangles index the points of the whole index
+    tri = index.tri[index.poly_tri_offset[pn]:index.poly_tri_offset[pn + 1]]
+    return is_point_inside_triangles(ptest, index.pts, tri, index.poly_plane[pn, :3], atol)
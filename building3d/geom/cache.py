@@ -0,0 +1,89 @@
+"""Cache of geometry-derived properties of walls, solids, zones and buildings.
+
+Each object keeps a dict `_cache` with its computed properties (mesh, bbox, volume, ...).
+The cache is cleared by `invalidate_cache()`, which is called by the methods modifying
+the geometry (`add_*()`, `replace_*()`). Since the properties of an object depend
+on its children, the caches of all its ancestors are cleared too.
+
+Adding or replacing polygons also changes the connections between them.
+`notify_geometry_changed()` passes such changes to the root object (the building),
+which updates its cached graph.
+
+Some properties, e.g. polygon paths, depend also on the names of the ancestors.
+They are cached with a token (the path of the object) and recomputed
+if the token has changed, e.g. after the object was added to another parent.
+
+Cached arrays are shared between callers and must not be modified in place.
+The numbers of cache hits and misses are counted for each property (see `cache_info()`).
+"""
+from collections import Counter
+from typing import Any
+from typing import Callable
+from typing import NamedTuple
+from typing import Sequence
+
+HITS: Counter[str] = Counter()  # {property: number of hits}
+MISSES: Counter[str] = Counter()  # {property: number of misses}
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+
+
+def get_cached(obj, key: str, func: Callable[[], Any], token: Any = None) -> Any:
+    """Returns the cached property of the object, computing it with `func()` if needed.
+
+    Args:
+        obj: object with the `_cache` dict (wall, solid, zone or building)
+        key: name of the property
+        func: function computing the property
+        token: the value is recomputed if the token differs from the cached one
+
+    Returns:
+        value of the property
+    """
+    entry = obj._cache.get(key)
+    if entry is not None and entry[0] == token:
+        HITS[key] += 1
+        return entry[1]
+
+    MISSES[key] += 1
+    value = func()
+    obj._cache[key] = (token, value)
+    return value
+
+
+def invalidate_cache(obj) -> None:
+    """Clears the cache of the object and all its ancestors."""
+    while obj is not None:
+        obj._cache.clear()
+        obj = obj.parent
+
+
+def notify_geometry_changed(obj, added: Sequence = ()) -> None:
+    """Calls `geometry_changed()` of the root of the object (if it has one).
+
+    The root is the building if the object was added to it. Otherwise nothing is done.
+
+    Args:
+        obj: changed object (wall, solid, zone or building)
+        added: added polygons
+    """
+    while obj.parent is not None:
+        obj = obj.parent
+    if hasattr(obj, "geometry_changed"):
+        obj.geometry_changed(added)
+
+
+def cache_info(key: str | None = None) -> CacheInfo:
+    """Returns the numbers of cache hits and misses of a property (or of all properties)."""
+    if key is None:
+        return CacheInfo(sum(HITS.values()), sum(MISSES.values()))
+    return CacheInfo(HITS[key], MISSES[key])
+
+
+def reset_cache_info() -> None:
+    """Resets the counters of cache hits and misses."""
+    HITS.clear()
+    MISSES.clear()
@@ -1,52 +1,84 @@
 import numpy as np
-from numba import njit
 
+from building3d.config import POINT_NUM_DEC
 from building3d.geom.types import FLOAT
 from building3d.geom.types import INT
 from building3d.geom.types import IndexType
 from building3d.geom.types import PointType
 
 
-# @njit  # TODO: Fails with tuples of len > 1000
 def vstack_mesh(
     t_pts: tuple[PointType, ...],
     t_tri: tuple[IndexType, ...],
+    merge_points: bool = False,
 ) -> tuple[PointType, IndexType]:
-    """Takes tuples of points and triangles and stacks them vertically."""
+    """Takes tuples of points and triangles and stacks them vertically.
+
+    The triangles of each object are shifted by the number of points of the previous objects,
+    so the time is linear in the total number of points and triangles.
+
+    Args:
+        t_pts: tuple of point arrays, each shaped (num_pts, 3)
+        t_tri: tuple of triangle arrays, each shaped (num_tri, 3)
+        merge_points: if True, points equal after rounding to `POINT_NUM_DEC` decimals
+            are merged (see `merge_mesh_points()`)
+
+    Return:
+        tuple of vertices, shaped (num_pts_tot, 3), and faces, shaped (num_tri_tot, 3)
+    """
     num_objects = len(t_pts)
     assert num_objects == len(t_tri)
 
-    num_pts_tot = 0
-    num_tri_tot = 0
-    num_pts_per_obj = {}
-    num_tri_per_obj = {}
-
-    # Allocate empty arrays for verts and faces
-    for i in range(num_objects):
-        num_pts_tot += t_pts[i].shape[0]
-        num_tri_tot += t_tri[i].shape[0]
-        num_pts_per_obj[i] = t_pts[i].shape[0]
-        num_tri_per_obj[i] = t_tri[i].shape[0]
-
-    verts = np.zeros((num_pts_tot, 3), dtype=FLOAT)
-    faces = np.zeros((num_tri_tot, 3), dtype=INT)
-
-    # Fill the arrays (vstack)
-    num_pts_added = 0
-    tri_offset = 0
-    pts_offset = 0
-    for i in range(num_objects):
-        for j in range(t_tri[i].shape[0]):
-            if j == 0 and i > 0:
-                tri_offset += num_tri_per_obj[i - 1]
-            faces[j + tri_offset] = t_tri[i][j] + num_pts_added
-        for j in range(t_pts[i].shape[0]):
-            if j == 0 and i > 0:
-                pts_offset += num_pts_per_obj[i - 1]
-            verts[j + pts_offset] = t_pts[i][j]
-            num_pts_added += 1
-
-    # TODO: Equal points should be merged. Look at building3d/mesh/quality/purge_mesh.py
-    ...
+    if num_objects == 0:
+        return np.zeros((0, 3), dtype=FLOAT), np.zeros((0, 3), dtype=INT)
+
+    num_pts = np.array([pts.shape[0] for pts in t_pts], dtype=INT)
+    num_tri = np.array([tri.shape[0] for tri in t_tri], dtype=INT)
+    pts_offset = np.zeros(num_objects, dtype=INT)
+    pts_offset[1:] = np.cumsum(num_pts[:-1])
+
+    verts = np.concatenate(t_pts).astype(FLOAT, copy=False).reshape((-1, 3))
+    faces = np.concatenate(t_tri).astype(INT, copy=False).reshape((-1, 3))
+    faces = faces + np.repeat(pts_offset, num_tri)[:, np.newaxis]
+
+    if merge_points:
+        verts, faces = merge_mesh_points(verts, faces)
 
     return verts, faces
+
+
+def merge_mesh_points(
+    verts: PointType,
+    faces: IndexType,
+    num_dec: int = POINT_NUM_DEC,
+) -> tuple[PointType, IndexType]:
+    """Merges points which are equal after rounding to `num_dec` decimals.
+
+    The first occurrence of each point is kept. Triangles are renumbered,
+    but not removed (even if they become degenerate).
+
+    Args:
+        verts: vertices, shaped (num_pts, 3)
+        faces: faces, shaped (num_tri, 3)
+        num_dec: number of decimal digits compared
+
+    Return:
+        tuple of unique vertices and renumbered faces
+    """
+    rounded = np.round(verts, num_dec)
+
+    # Sort the points and mark the first point of each group of equal points
+    order = np.lexsort((rounded[:, 2], rounded[:, 1], rounded[:, 0]))
+    is_new = np.ones(order.shape[0], dtype=np.bool_)
+    is_new[1:] = np.any(rounded[order[1:]] != rounded[order[:-1]], axis=1)
+    group = np.cumsum(is_new) - 1
+
+    # Number the groups in the order of their first occurrences
+    # (the sort is stable, so the first point of each group is its first occurrence)
+    first = order[is_new]
+    new_num = np.empty(first.shape[0], dtype=INT)
+    new_num[np.argsort(first)] = np.arange(first.shape[0], dtype=INT)
+    point_num = np.empty(order.shape[0], dtype=INT)
+    point_num[order] = new_num[group]
+
+    return verts[np.sort(first)], point_num[faces]
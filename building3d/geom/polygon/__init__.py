@@ -3,6 +3,8 @@ import logging
 import numpy as np
 
 from building3d.random import random_id
+from building3d.random import random_ids
+from building3d.config import EPSILON
 from building3d.config import GEOM_ATOL
 from building3d.geom.paths import PATH_SEP
 from building3d.geom.paths.validate_name import validate_name
@@ -19,6 +21,7 @@ from building3d.geom.polygon.touching import are_polygons_touching
 from building3d.geom.triangles import triangle_centroid
 from building3d.geom.triangles import triangulate
 from building3d.geom.types import FLOAT
+from building3d.geom.types import INT
 from building3d.geom.types import IndexType
 from building3d.geom.types import PointType
 from building3d.geom.types import VectorType
@@ -89,6 +92,83 @@ class Polygon:
             self.pts
         )
 
+    @classmethod
+    def from_triangles(
+        cls,
+        vertices: PointType,
+        vn: VectorType | None = None,
+        names: list[str] | None = None,
+    ) -> list["Polygon"]:
+        """Creates triangular polygons in bulk, e.g. from the facets of an STL file.
+
+        Normals, areas, centroids and plane coefficients are calculated for all triangles
+        at once, so the coplanarity check and triangulation of `__init__()` are skipped.
+        They are calculated with the same formulas as in `Polygon(pts)` (e.g. the centroid
+        weighted by the Heron's area, see `polygon_centroid()`), so the attributes are
+        the same up to floating-point round-off. If `vn` is given, it is used as is.
+
+        Args:
+            vertices: vertices of the triangles, shape `(num_triangles, 3, 3)`
+            vn: unit normal vectors, shape `(num_triangles, 3)`, calculated if None
+            names: names of the polygons, random if None
+
+        Returns:
+            list of polygons
+        """
+        vertices = np.asarray(vertices, dtype=FLOAT).reshape((-1, 3, 3))
+        num_tri = vertices.shape[0]
+        assert names is None or len(names) == num_tri, "Incorrect number of names"
+
+        pt0 = vertices[:, 0]
+        pt1 = vertices[:, 1]
+        pt2 = vertices[:, 2]
+        if vn is None:
+            # Normal of the first corner, like `normal(pts[-1], pts[0], pts[1])`
+            cross = np.cross(pt0 - pt2, pt1 - pt2)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                vn = cross / np.linalg.norm(cross, axis=1)[:, np.newaxis]
+        vn = np.asarray(vn, dtype=FLOAT)
+
+        # Area like in `polygon_area()`
+        total = np.cross(pt0, pt1) + np.cross(pt1, pt2) + np.cross(pt2, pt0)
+        area = np.abs(np.einsum("ij,ij->i", total, vn) / 2.0)
+
+        # Centroids weighted by the Heron's area of the triangle (2, 0, 1) made
+        # by `triangulate()`, like in `polygon_centroid()` and `triangle_area()`
+        a = np.linalg.norm(pt0 - pt2, axis=1)
+        b = np.linalg.norm(pt1 - pt0, axis=1)
+        c = np.linalg.norm(pt1 - pt2, axis=1)
+        s = 0.5 * (a + b + c)
+        weights = np.sqrt(s * (s - a) * (s - b) * (s - c) + EPSILON)
+        ctr = ((pt2 + pt0 + pt1) / 3.0) * weights[:, np.newaxis]
+        d = -np.einsum("ij,ij->i", vn, pt0)
+
+        tri = np.array([[2, 0, 1]], dtype=INT)
+        area_list = area.tolist()
+        plane_list = np.column_stack((vn, d)).tolist()
+        uids = random_ids(num_tri)
+        if names is None:
+            names = random_ids(num_tri)
+        else:
+            names = [validate_name(name) for name in names]
+
+        polygons = []
+        for i in range(num_tri):
+            poly = cls.__new__(cls)
+            poly._parent = None
+            poly.num = None
+            poly.name = names[i]
+            poly.uid = uids[i]
+            poly.pts = vertices[i]
+            poly.vn = vn[i]
+            poly.tri = tri
+            poly.ctr = ctr[i]
+            poly.area = area_list[i]
+            poly.plane_coefficients = tuple(plane_list[i])
+            polygons.append(poly)
+
+        return polygons
+
     @property
     def children(self) -> PointType:
         return self.pts
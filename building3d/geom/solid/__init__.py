@@ -4,6 +4,9 @@ from typing import Sequence
 import numpy as np
 
 from building3d.random import random_id
+from building3d.geom.cache import get_cached
+from building3d.geom.cache import invalidate_cache
+from building3d.geom.cache import notify_geometry_changed
 from building3d.geom.exceptions import GeometryError
 from building3d.geom.paths import PATH_SEP
 from building3d.geom.paths.validate_name import validate_name
@@ -40,6 +43,7 @@ class Solid:
         """
         self._parent = parent
         self.num: None | int = None  # Used as a counter in the array format
+        self._cache: dict = {}  # Cached properties (see `building3d.geom.cache`)
 
         if name is None:
             name = random_id()
@@ -79,11 +83,15 @@ class Solid:
 
         wall.parent = self
         self.walls[wall.name] = wall
+        invalidate_cache(self)
 
     def replace_wall(self, old_name: str, new_wall: Wall):
         del self.walls[old_name]
         self.add_wall(new_wall)
 
+        # Update the cached data of the building (if any)
+        notify_geometry_changed(self, list(new_wall.children.values()))
+
     def get(self, abspath: str):
         """Get object by the absolute path."""
         obj = self
@@ -94,6 +102,9 @@ class Solid:
 
     def get_polygon_paths(self) -> list[str]:
         """Returns a list of all paths to polygons belonging to this solid."""
+        return get_cached(self, "polygon_paths", self._get_polygon_paths, token=self.path)
+
+    def _get_polygon_paths(self) -> list[str]:
         poly_paths = []
         assert self.parent is not None  # Zone
         assert self.parent.parent is not None  # Building
@@ -116,11 +127,16 @@ class Solid:
         Return:
             tuple of vertices, shaped (num_pts, 3), and faces, shaped (num_tri, 3)
         """
-        return get_mesh_from_walls(list(self.children.values()))
+        return get_cached(
+            self, "mesh", lambda: get_mesh_from_walls(list(self.children.values()))
+        )
 
     def bbox(self) -> tuple[PointType, PointType]:
-        pts, _ = self.get_mesh()
-        return bounding_box(pts)
+        return get_cached(self, "bbox", lambda: bounding_box(self.get_mesh()[0]))
+
+    def area(self) -> float:
+        """Calculate solid surface area as the sum of wall areas."""
+        return get_cached(self, "area", lambda: sum(w.area() for w in self.walls.values()))
 
     def is_point_inside(self, pt: PointType) -> bool:  # TODO: use numba
         """Checks whether the point p is inside the solid.
@@ -231,6 +247,9 @@ class Solid:
     @property
     def volume(self) -> float:
         """Based on: http://chenlab.ece.cornell.edu/Publication/Cha/icip01_Cha.pdf"""
+        return get_cached(self, "volume", self._get_volume)
+
+    def _get_volume(self) -> float:
         total_volume = 0.0
         all_polys = [p for w in self.children.values() for p in w.children.values()]
         for poly in all_polys:
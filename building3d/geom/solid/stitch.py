@@ -1,3 +1,6 @@
+import logging
+from collections import deque
+
 import numpy as np
 from numba import njit
 
@@ -12,35 +15,151 @@ from building3d.geom.types import FLOAT
 from building3d.geom.types import PointType
 from building3d.geom.wall import Wall
 
+logger = logging.getLogger(__name__)
+
+# Size of the plane hash buckets and the tolerance of the plane coefficients.
+# Polygons closer to the bucket boundary than the tolerance are put in both buckets.
+# The tolerance is also used when comparing bounding boxes.
+PLANE_HASH_STEP = 1e-4
+PLANE_HASH_TOL = 1e-6
+
 
 def stitch_solids(s1: Solid, s2: Solid) -> None:
-    """Recursively slices adjacent polygons of two solids so that they share vertices and edges."""
-    # Find next tuple of adjacent polygons
-    adj = next_adjacent_polygons(s1, s2)
+    """Slices adjacent polygons of two solids so that they share vertices and edges.
+
+    Candidate pairs of polygons (coplanar, with overlapping bounding boxes) are kept
+    in a work queue (see `find_candidate_pairs()`). The pairs are checked one by one.
+    Adjacent polygons are sliced and only the new polygons are paired
+    with the polygons of the other solid and added to the queue.
+    """
+    polys1 = {id(p): p for _, p in get_walls_and_polygons(s1)}
+    polys2 = {id(p): p for _, p in get_walls_and_polygons(s2)}
+    queue = deque(find_candidate_pairs(list(polys1.values()), list(polys2.values())))
+
+    while len(queue) > 0:
+        p1, p2 = queue.popleft()
+        if id(p1) not in polys1 or id(p2) not in polys2:
+            continue  # Already replaced
+
+        if not are_polygons_adjacent(p1, p2):
+            continue
 
-    if adj is not None:
-        # Process next pair of adjacent polygons
-        p1, p2 = adj
         slice_both_and_replace(s1, p1, s2, p2)
-        return stitch_solids(s1, s2)
 
-    else:
-        return None
+        old1, old2 = polys1, polys2
+        polys1 = {id(p): p for _, p in get_walls_and_polygons(s1)}
+        polys2 = {id(p): p for _, p in get_walls_and_polygons(s2)}
+        new1 = [p for k, p in polys1.items() if k not in old1]
+        new2 = [p for k, p in polys2.items() if k not in old2]
+
+        if len(new1) == 0 and len(new2) == 0:
+            logger.warning(f"Could not slice adjacent polygons {p1.path} and {p2.path}")
+            continue
+
+        queue.extend(find_candidate_pairs(new1, list(polys2.values())))
+        queue.extend(find_candidate_pairs([p for k, p in polys1.items() if k in old1], new2))
+
+
+def are_polygons_adjacent(p1: Polygon, p2: Polygon) -> bool:
+    """Checks if the polygons need to be sliced (crossing or one inside the other)."""
+    overlapping = p1.is_crossing_polygon(p2)
+    within = p1.contains_polygon(p2) or p2.contains_polygon(p1)
+    return overlapping or within
 
 
 def next_adjacent_polygons(s1: Solid, s2: Solid) -> tuple[Polygon, Polygon] | None:
     """Returns a pair of adjacent polygons. Those matching exactly are omitted."""
-    for _, p1 in get_walls_and_polygons(s1):
-        for _, p2 in get_walls_and_polygons(s2):
-            overlapping = p1.is_crossing_polygon(p2)
-            within = p1.contains_polygon(p2) or p2.contains_polygon(p1)
-            if overlapping or within:
-                # These can be sliced
-                return p1, p2
+    polys1 = [p for _, p in get_walls_and_polygons(s1)]
+    polys2 = [p for _, p in get_walls_and_polygons(s2)]
+    for p1, p2 in find_candidate_pairs(polys1, polys2):
+        if are_polygons_adjacent(p1, p2):
+            # These can be sliced
+            return p1, p2
     # There are no adjacent polygons anymore
     return None
 
 
+def find_candidate_pairs(
+    polys1: list[Polygon], polys2: list[Polygon]
+) -> list[tuple[Polygon, Polygon]]:
+    """Returns pairs of polygons which may be adjacent.
+
+    Pairs are made of coplanar polygons, found by hashing their planes,
+    whose bounding boxes overlap (not only touch). The pairs are sorted by the order
+    of polygons in `polys1` and then in `polys2`.
+
+    Args:
+        polys1: polygons of the first solid
+        polys2: polygons of the second solid
+
+    Returns:
+        list of polygon pairs
+    """
+    if len(polys1) == 0 or len(polys2) == 0:
+        return []
+
+    buckets = {}
+    for j, p2 in enumerate(polys2):
+        for key in plane_hash_keys(p2, both_sides=True):
+            buckets.setdefault(key, []).append(j)
+
+    bbox2 = [(p.pts.min(axis=0), p.pts.max(axis=0)) for p in polys2]
+    pairs = []
+    for p1 in polys1:
+        candidates = buckets.get(plane_hash_keys(p1, both_sides=False)[0], [])
+        if len(candidates) == 0:
+            continue
+        min1 = p1.pts.min(axis=0)
+        max1 = p1.pts.max(axis=0)
+        for j in sorted(candidates):
+            min2, max2 = bbox2[j]
+            # Coplanar polygons can overlap only if the intersection of their bounding boxes
+            # has a non-zero size in at least 2 dimensions (otherwise they touch at most)
+            overlap = np.minimum(max1, max2) - np.maximum(min1, min2)
+            if (overlap >= -PLANE_HASH_TOL).all() and (overlap > PLANE_HASH_TOL).sum() >= 2:
+                pairs.append((p1, polys2[j]))
+
+    return pairs
+
+
+def plane_hash_keys(poly: Polygon, both_sides: bool) -> list[tuple[int, ...]]:
+    """Returns the hash keys of the polygon's plane.
+
+    The key doesn't depend on the orientation of the polygon. It is based on
+    the products of the normal vector components `n_i * n_j` and the offset `d * n_i`
+    (from the plane equation `n . x + d = 0`), which don't change when `n` and `d` are negated.
+
+    Args:
+        poly: polygon
+        both_sides: if True, the values closer than `PLANE_HASH_TOL`
+            to the boundary of a bucket are also put in the neighboring bucket
+
+    Returns:
+        list of keys (one key if `both_sides` is False)
+    """
+    # Python floats are faster than small arrays here
+    nx, ny, nz = poly.vn.tolist()
+    x, y, z = poly.pts[0].tolist()
+    d = -(nx * x + ny * y + nz * z)
+    values = (nx * nx, nx * ny, nx * nz, ny * ny, ny * nz, nz * nz, d * nx, d * ny, d * nz)
+
+    # Values are rounded, so the bucket boundaries are halfway between the multiples
+    # of `PLANE_HASH_STEP` (and typical values like 0 or 1 are far from them)
+    keys = [()]
+    for v in values:
+        v /= PLANE_HASH_STEP
+        bucket = round(v)
+        options = [bucket]
+        if both_sides:
+            if v - bucket > 0.5 - PLANE_HASH_TOL / PLANE_HASH_STEP:
+                options.append(bucket + 1)
+            elif v - bucket < -0.5 + PLANE_HASH_TOL / PLANE_HASH_STEP:
+                options.append(bucket - 1)
+        keys = [k + (opt, ) for k in keys for opt in options]
+
+    return keys
+
+
 def slice_both_and_replace(s1: Solid, p1: Polygon, s2: Solid, p2: Polygon) -> None:
     """Slices polygons `p1` and `p2` and replaces them in solids `s1` and `s2` (in-place)."""
     p2_in_p1 = p1.contains_polygon(p2)
@@ -40,6 +40,69 @@ def triangle_centroid(pt1: PointType, pt2: PointType, pt3: PointType) -> PointTy
     return (pt1 + pt2 + pt3) / 3.0
 
 
+@njit
+def signed_distance_to_edge_line(
+    ptest: PointType,
+    pt1: PointType,
+    pt2: PointType,
+    vn: VectorType,
+) -> float:
+    """Returns the signed distance of `ptest` to the line pt1->pt2 in the plane normal to `vn`.
+
+    It is equal to `np.dot(vn, np.cross(pt2 - pt1, ptest - pt1)) / |pt2 - pt1|`,
+    but does not allocate any arrays.
+    """
+    ex = pt2[0] - pt1[0]
+    ey = pt2[1] - pt1[1]
+    ez = pt2[2] - pt1[2]
+    px = ptest[0] - pt1[0]
+    py = ptest[1] - pt1[1]
+    pz = ptest[2] - pt1[2]
+    cx = ey * pz - ez * py
+    cy = ez * px - ex * pz
+    cz = ex * py - ey * px
+    len_e = np.sqrt(ex * ex + ey * ey + ez * ez)
+    return (vn[0] * cx + vn[1] * cy + vn[2] * cz) / len_e
+
+
+@njit
+def is_point_inside_triangles(
+    ptest: PointType,
+    pts: PointType,
+    tri: IndexType,
+    vn: VectorType,
+    atol: float = GEOM_ATOL,
+) -> bool:
+    """Checks whether a point laying on the plane normal to `vn` is inside any of the triangles.
+
+    Points closer than `atol` to the edges of a triangle are assumed to be inside.
+    The point is not tested for coplanarity with the triangles.
+    Triangles can be oriented both ways with respect to `vn`.
+
+    Args:
+        ptest: tested point
+        pts: vertices, shape (num_pts, 3)
+        tri: triangles (indices of `pts`), shape (num_tri, 3)
+        vn: unit normal vector of the plane
+        atol: absolute tolerance
+
+    Returns:
+        True if the point is inside (or at the boundary of) some triangle
+    """
+    for i in range(tri.shape[0]):
+        pt1 = pts[tri[i, 0]]
+        pt2 = pts[tri[i, 1]]
+        pt3 = pts[tri[i, 2]]
+        s1 = signed_distance_to_edge_line(ptest, pt1, pt2, vn)
+        s2 = signed_distance_to_edge_line(ptest, pt2, pt3, vn)
+        s3 = signed_distance_to_edge_line(ptest, pt3, pt1, vn)
+        if (s1 >= -atol and s2 >= -atol and s3 >= -atol) or (
+            s1 <= atol and s2 <= atol and s3 <= atol
+        ):
+            return True
+    return False
+
+
 @njit
 def is_point_on_same_side(
     pt1: PointType,
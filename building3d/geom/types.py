@@ -13,6 +13,7 @@ VectorType = NDArray[FLOAT]  # Shape (num_vectors, 3), or (3, )
 IndexType = NDArray[INT]  # Same shape as referenced array
 FloatDataType = NDArray[FLOAT]  # General data array containing floats, arbitrary shape
 IntDataType = NDArray[INT]  # General data array containing floats, arbitrary shape
+BoolDataType = NDArray[np.bool_]  # General data array containing booleans, arbitrary shape
 
 # Constants
 INVALID_PT = np.full(3, np.nan, dtype=FLOAT)
@@ -1,6 +1,9 @@
 from typing import Sequence
 
 from building3d.random import random_id
+from building3d.geom.cache import get_cached
+from building3d.geom.cache import invalidate_cache
+from building3d.geom.cache import notify_geometry_changed
 from building3d.geom.exceptions import GeometryError
 from building3d.geom.paths import PATH_SEP
 from building3d.geom.paths.validate_name import validate_name
@@ -33,6 +36,7 @@ class Wall:
         """
         self._parent = parent
         self.num: None | int = None  # Used as a counter in the array format
+        self._cache: dict = {}  # Cached properties (see `building3d.geom.cache`)
 
         if name is None:
             name = random_id()
@@ -79,12 +83,17 @@ class Wall:
 
         poly.parent = self
         self.polygons[poly.name] = poly
+        invalidate_cache(self)
 
     def replace_polygon(self, old_name: str, *new_poly: Polygon):
         del self.polygons[old_name]
+        invalidate_cache(self)
         for np in new_poly:
             self.add_polygon(np)
 
+        # Update the cached data of the building (if any)
+        notify_geometry_changed(self, new_poly)
+
     def get(self, abspath: str):
         """Get object by the absolute path."""
         obj = self
@@ -95,6 +104,9 @@ class Wall:
 
     def get_polygon_paths(self) -> list[str]:
         """Returns a list of all paths to polygons belonging to this wall."""
+        return get_cached(self, "polygon_paths", self._get_polygon_paths, token=self.path)
+
+    def _get_polygon_paths(self) -> list[str]:
         poly_paths = []
         assert self.parent is not None  # Solid
         assert self.parent.parent is not None  # Zone
@@ -111,8 +123,11 @@ class Wall:
         return poly_paths
 
     def bbox(self) -> tuple[PointType, PointType]:
-        pts, _ = self.get_mesh()
-        return bounding_box(pts)
+        return get_cached(self, "bbox", lambda: bounding_box(self.get_mesh()[0]))
+
+    def area(self) -> float:
+        """Calculate wall area as the sum of polygon areas."""
+        return get_cached(self, "area", lambda: sum(poly.area for poly in self.polygons.values()))
 
     def get_mesh(self) -> tuple[PointType, IndexType]:
         """Get vertices and faces of this wall's polygons.
@@ -122,7 +137,9 @@ class Wall:
         Return:
             tuple of vertices, shaped (num_pts, 3), and faces, shaped (num_tri, 3)
         """
-        return get_mesh_from_polygons(list(self.children.values()))
+        return get_cached(
+            self, "mesh", lambda: get_mesh_from_polygons(list(self.children.values()))
+        )
 
     def __str__(self):
         return f"Wall(name={self.name}, polygons={list(self.children.keys())}, id={hex(id(self))})"
@@ -2,6 +2,9 @@ import logging
 from typing import Sequence
 
 from building3d.random import random_id
+from building3d.geom.cache import get_cached
+from building3d.geom.cache import invalidate_cache
+from building3d.geom.cache import notify_geometry_changed
 from building3d.geom.exceptions import GeometryError
 from building3d.geom.paths import PATH_SEP
 from building3d.geom.paths.validate_name import validate_name
@@ -36,6 +39,7 @@ class Zone:
         """
         self._parent = parent
         self.num: None | int = None  # Used as a counter in the array format
+        self._cache: dict = {}  # Cached properties (see `building3d.geom.cache`)
 
         if name is None:
             name = random_id()
@@ -83,8 +87,14 @@ class Zone:
         # Add solid
         sld.parent = self
         self.solids[sld.name] = sld
+        invalidate_cache(self)
         logger.info(f"Solid {sld.name} added: {self}")
 
+        # Update the cached data of the building (if any)
+        notify_geometry_changed(self, [
+            poly for wall in sld.children.values() for poly in wall.children.values()
+        ])
+
     def get(self, abspath: str):
         """Get object by the absolute path."""
         obj = self
@@ -95,6 +105,9 @@ class Zone:
 
     def get_polygon_paths(self) -> list[str]:
         """Returns a list of all paths to polygons belonging to this zone."""
+        return get_cached(self, "polygon_paths", self._get_polygon_paths, token=self.path)
+
+    def _get_polygon_paths(self) -> list[str]:
         poly_paths = []
         assert self.parent is not None  # Building
         bn = self.parent.name
@@ -109,8 +122,7 @@ class Zone:
         return poly_paths
 
     def bbox(self) -> tuple[PointType, PointType]:
-        pts, _ = self.get_mesh()
-        return bounding_box(pts)
+        return get_cached(self, "bbox", lambda: bounding_box(self.get_mesh()[0]))
 
     def get_mesh(self) -> tuple[PointType, IndexType]:
         """Get vertices and faces of all solids. Used mostly for plotting.
@@ -120,14 +132,13 @@ class Zone:
         Return:
             tuple of vertices, shaped (num_pts, 3), and faces, shaped (num_tri, 3)
         """
-        return get_mesh_from_solids(list(self.children.values()))
+        return get_cached(
+            self, "mesh", lambda: get_mesh_from_solids(list(self.children.values()))
+        )
 
     def volume(self) -> float:
         """Calculate zone volume as the sum of solid volumes."""
-        volume = 0.0
-        for sld in self.solids.values():
-            volume += sld.volume
-        return volume
+        return get_cached(self, "volume", lambda: sum(sld.volume for sld in self.solids.values()))
 
     def __str__(self):
         s = f"Zone(name={self.name}, "
@@ -3,11 +3,11 @@
 This format can be used to import/export zone geometry.
 There is no metadata attached, so the information
 about the original structure of the model (zones, solids, walls, polygons)
-is lost. Each triangle is read/written as a separate wall.
-There can be multiple solids in an STL file.
+is lost. Each triangle is read/written as a separate polygon.
+There can be multiple solids in an ASCII STL file.
 One STL file = one zone.
 
-STL format:
+ASCII STL format:
 ---------------------------------------
 solid name
      facet normal ni nj nk
@@ -19,26 +19,86 @@ solid name
      endfacet
 endsolid name
 ---------------------------------------
+
+Binary STL format (little-endian):
+---------------------------------------
+UINT8[80]    header
+UINT32       number of facets
+foreach facet:
+    REAL32[3]    normal
+    REAL32[3]    vertex 1
+    REAL32[3]    vertex 2
+    REAL32[3]    vertex 3
+    UINT16       attribute byte count
+---------------------------------------
+A binary STL file has only one solid. Coordinates are stored in single precision.
+
+Both formats are read straight into numpy arrays (see `read_stl_facets()`).
 """
 
 import logging
+import os
+import re
 from pathlib import Path
 
 import numpy as np
 
 from building3d.random import random_id
+from building3d.config import EPSILON
 from building3d.geom.building import Building
 from building3d.geom.polygon import Polygon
 from building3d.geom.solid import Solid
 from building3d.geom.types import FLOAT
+from building3d.geom.types import PointType
+from building3d.geom.types import VectorType
 from building3d.geom.wall import Wall
 from building3d.geom.zone import Zone
 
 logger = logging.getLogger(__name__)
 
 
-def write_stl(path: str, bdg: Building, parent_dirs: bool = True) -> None:
-    """Read STL file.
+# Record of a facet in a binary STL file
+BINARY_FACET_DTYPE = np.dtype(
+    [("normal", "<f4", (3,)), ("vertices", "<f4", (3, 3)), ("attr", "<u2")]
+)
+BINARY_HEADER_SIZE = 84  # 80 bytes of the header and the number of facets
+# Start of the header of written binary files, followed by the building name.
+# The header must not start with "solid", because some readers would take it for ASCII.
+BINARY_HEADER_PREFIX = "binary STL "
+
+# Number of facets formatted at once when writing an ASCII file
+ASCII_CHUNK_SIZE = 10000
+
+ASCII_FACET_TEMPLATE = (
+    "  facet normal %r %r %r\n"
+    "    outer loop\n"
+    "      vertex %r %r %r\n"
+    "      vertex %r %r %r\n"
+    "      vertex %r %r %r\n"
+    "    endloop\n"
+    "  endfacet\n"
+)
+
+SOLID_RE = re.compile(r"^[ \t]*solid\b[ \t]*(.*?)[ \t]*\r?$", re.MULTILINE)
+
+# Tokens of an ASCII facet ("facet normal ni nj nk outer loop vertex v1x v1y v1z ... endfacet")
+ASCII_FACET_NUM_TOKENS = 21
+ASCII_FACET_KEYWORDS = {
+    0: "facet",
+    1: "normal",
+    5: "outer",
+    6: "loop",
+    7: "vertex",
+    11: "vertex",
+    15: "vertex",
+    19: "endloop",
+    20: "endfacet",
+}
+ASCII_FACET_NUMBERS = [2, 3, 4, 8, 9, 10, 12, 13, 14, 16, 17, 18]  # Normal and vertices
+
+
+def write_stl(path: str, bdg: Building, parent_dirs: bool = True, binary: bool = False) -> None:
+    """Write STL file.
 
     STL does not contain information about how facets (triangles)
     are grouped together, so each facet is treated as a separate triangular wall/polygon.
@@ -46,10 +106,13 @@ def write_stl(path: str, bdg: Building, parent_dirs: bool = True) -> None:
     It means that if you write a zone to STL and then read it again,
     they may have different number of polygons!
 
+    A binary file has only one solid, so all solids are written as one.
+
     Args:
         path: path to the output file
         bdg: Building instance
         parent_dirs: if True, parent directories will be created
+        binary: if True, the binary format is used
     """
     logger.debug(f"Writing building {bdg.name} ({bdg.uid}) to STL: {path}")
 
@@ -58,42 +121,72 @@ def write_stl(path: str, bdg: Building, parent_dirs: bool = True) -> None:
         if not p.parent.exists():
             p.parent.mkdir(parents=True)
 
-    lines = []
-    l1 = " " * 2
-    l2 = " " * 4
-    l3 = " " * 6
-    for zone in bdg.zones.values():
-        for sld in zone.solids.values():
-            lines.append(f"solid {sld.uid}\n")
-            for wall in sld.walls.values():
-                for _, poly in wall.polygons.items():
-                    ni, nj, nk = poly.vn
-                    for facet in poly.tri:
-                        lines.append(f"{l1}facet normal {ni} {nj} {nk}\n")
-                        lines.append(f"{l2}outer loop\n")
-                        v1x, v1y, v1z = poly.pts[facet[0]]
-                        v2x, v2y, v2z = poly.pts[facet[1]]
-                        v3x, v3y, v3z = poly.pts[facet[2]]
-                        lines.append(f"{l3}vertex {v1x} {v1y} {v1z}\n")
-                        lines.append(f"{l3}vertex {v2x} {v2y} {v2z}\n")
-                        lines.append(f"{l3}vertex {v3x} {v3y} {v3z}\n")
-                        lines.append(f"{l2}endloop\n")
-                        lines.append(f"{l1}endfacet\n")
-            lines.append(f"endsolid {sld.uid}\n")
-    with open(path, "w") as f:
-        f.writelines(lines)
-    logger.debug(f"Number of lines in STL file = {len(lines)}")
+    solids = [sld for zone in bdg.zones.values() for sld in zone.solids.values()]
+
+    if binary:
+        facets = [get_solid_facets(sld) for sld in solids]
+        vertices = np.concatenate([f[0] for f in facets]) if facets else np.zeros((0, 3, 3))
+        normals = np.concatenate([f[1] for f in facets]) if facets else np.zeros((0, 3))
+
+        data = np.zeros(vertices.shape[0], dtype=BINARY_FACET_DTYPE)
+        data["normal"] = normals
+        data["vertices"] = vertices
+        header = f"{BINARY_HEADER_PREFIX}{bdg.name}".encode()[:80].ljust(80, b" ")
+
+        with open(path, "wb") as f:
+            f.write(header)
+            f.write(np.uint32(data.shape[0]).tobytes())
+            data.tofile(f)
+        logger.debug(f"Number of facets in STL file = {data.shape[0]}")
+
+    else:
+        num_facets = 0
+        with open(path, "w") as f:
+            for sld in solids:
+                vertices, normals = get_solid_facets(sld)
+                values = np.concatenate((normals, vertices.reshape((-1, 9))), axis=1)
+                f.write(f"solid {sld.uid}\n")
+                for i in range(0, values.shape[0], ASCII_CHUNK_SIZE):
+                    chunk = values[i : i + ASCII_CHUNK_SIZE]
+                    f.write(ASCII_FACET_TEMPLATE * chunk.shape[0] % tuple(chunk.ravel().tolist()))
+                f.write(f"endsolid {sld.uid}\n")
+                num_facets += values.shape[0]
+        logger.debug(f"Number of facets in STL file = {num_facets}")
+
+
+def get_solid_facets(sld: Solid) -> tuple[PointType, VectorType]:
+    """Returns vertices and normals of all triangles of the solid.
+
+    Args:
+        sld: Solid instance
+
+    Returns:
+        tuple of vertices, shaped (num_facets, 3, 3), and normals, shaped (num_facets, 3)
+    """
+    polys = [poly for wall in sld.walls.values() for poly in wall.polygons.values()]
+    if len(polys) == 0:
+        return np.zeros((0, 3, 3), dtype=FLOAT), np.zeros((0, 3), dtype=FLOAT)
+
+    vertices = np.concatenate([poly.pts[poly.tri] for poly in polys])
+    normals = np.repeat(
+        np.array([poly.vn for poly in polys], dtype=FLOAT),
+        [poly.tri.shape[0] for poly in polys],
+        axis=0,
+    )
+    return vertices, normals
 
 
 def read_stl(path: str) -> Building:
-    """Read a building from an STL file.
+    """Read a building from an STL file (ASCII or binary).
 
     Information about zones is lost. Information about walls is lost.
-    The output building has 1 zone with as many walls and polygons as
-    there are triangles.
+    The output building has 1 zone with as many solids as there are in the file.
+    Each solid has 1 wall with as many polygons as there are triangles.
 
     This is because STL does not contain information about how facets (triangles)
     are grouped together.
+
+    Degenerate facets (with zero area) are skipped.
     """
     logger.debug(f"Reading a zone from STL: {path}")
 
@@ -102,79 +195,197 @@ def read_stl(path: str) -> Building:
 
     logger.debug(f"Assuming zone name based on filename: {zone.name}")
 
-    with open(path, "r") as f:
-        lines = f.readlines()
-
-    i = 0
-    wall = None
-    solid_uid = None
-    while i < len(lines):
-
-        line = lines[i].strip()
-
-        if line[: len("solid")] == "solid":
-            # Start new solid with one wall and multiple polygons
-            solid_uid = line[len("solid") :].strip()
-            wall = Wall()
-
-        elif line[:5] == "facet":
-            # Start new polygon
-            # Read normal from STL
-            normal_coord_list = (
-                line[len("facet") :].split("normal")[1].strip().split(" ")
-            )
-            normal_x = float(normal_coord_list[0])
-            normal_y = float(normal_coord_list[1])
-            normal_z = float(normal_coord_list[2])
-            normal = np.array([normal_x, normal_y, normal_z], dtype=FLOAT)
-            # Read vertices
-            i += 1
-            line = lines[i].strip()
-            assert line == "outer loop"
-            vertices = np.zeros((3, 3))
-            for k in range(3):
-                i += 1
-                line = lines[i].strip()
-                assert line[: len("vertex")] == "vertex"
-                v = np.array(
-                    [float(v) for v in line[len("vertex") :].strip().split(" ")],
-                    dtype=FLOAT,
-                )
-                vertices[k, :] = v
-
-            i += 1
-            line = lines[i].strip()
-            assert line == "endloop"
-
-            # Add polygon
-            poly = Polygon(vertices)
-            if not np.isclose(poly.vn, normal, rtol=1e-2).all():
-                logger.warning(
-                    f"Normal different than in STL: calculated={poly.vn} vs. stl={normal}"
-                )
-
-            if wall is not None:
-                wall.add_polygon(poly)
-            else:
-                raise ValueError("No wall created, so cannot add polygons to it.")
-
-        elif line[: len("endsolid")] == "endsolid":
-            assert line[len("endsolid") :].strip() == solid_uid
-            # Add solid to wall
-            if wall is not None:
-                if solid_uid is None or solid_uid == "":
-                    solid_uid = random_id()
-
-                solid = Solid([wall])
-                zone.add_solid(solid)
-            else:
-                raise ValueError("No wall created, so cannot add it to the zone/solid.")
-        else:
-            pass  # Empty line?
-
-        i += 1
+    for solid_uid, vertices, normals in read_stl_facets(path):
+        vertices, vn = check_facets(vertices, normals)
+        wall = Wall(Polygon.from_triangles(vertices, vn))
+
+        if solid_uid == "":
+            solid_uid = random_id()
+        zone.add_solid(Solid([wall], uid=solid_uid))
 
     logger.debug(f"Zone read from STL: {zone}")
     logger.debug(f"Number of solids in zone {zone.name} = {len(zone.solids.keys())}")
 
     return bdg
+
+
+def check_facets(vertices: PointType, normals: VectorType) -> tuple[PointType, VectorType]:
+    """Removes degenerate facets and checks the normals read from STL.
+
+    Args:
+        vertices: vertices of the facets, shape (num_facets, 3, 3)
+        normals: normals read from STL, shape (num_facets, 3)
+
+    Returns:
+        tuple of vertices and calculated unit normals of non-degenerate facets
+    """
+    # Normal of the first corner, like in `Polygon.from_triangles()`
+    cross = np.cross(vertices[:, 0] - vertices[:, 2], vertices[:, 1] - vertices[:, 2])
+    len_cross = np.linalg.norm(cross, axis=1)
+
+    valid = len_cross > EPSILON
+    if not valid.all():
+        logger.warning(f"Skipping {(~valid).sum()} degenerate facets")
+    vertices = vertices[valid]
+    normals = normals[valid]
+    vn = cross[valid] / len_cross[valid, np.newaxis]
+
+    # Many programs write zero normals, so only non-zero normals are compared
+    written = np.any(normals != 0, axis=1)
+    different = written & ~np.all(np.isclose(vn, normals, rtol=1e-2, atol=1e-6), axis=1)
+    if different.any():
+        i = np.flatnonzero(different)[0]
+        logger.warning(
+            f"Normals of {different.sum()} facets different than in STL, "
+            f"e.g. calculated={vn[i]} vs. stl={normals[i]}"
+        )
+
+    return vertices, vn
+
+
+def read_stl_facets(path: str) -> list[tuple[str, PointType, VectorType]]:
+    """Reads facets of all solids from an STL file (ASCII or binary).
+
+    Args:
+        path: path to the STL file
+
+    Returns:
+        list of tuples (solid name, vertices, normals) with vertices shaped
+        (num_facets, 3, 3) and normals shaped (num_facets, 3)
+    """
+    if is_binary_stl(path):
+        return [read_binary_stl_facets(path)]
+    else:
+        with open(path, "r") as f:
+            text = f.read()
+        return read_ascii_stl_facets(text)
+
+
+def is_binary_stl(path: str) -> bool:
+    """Checks whether the STL file is binary.
+
+    The size of a binary file must match the number of facets in its header.
+    The header can't be used, because it can start with "solid" like an ASCII file.
+    """
+    size = os.path.getsize(path)
+    if size < BINARY_HEADER_SIZE:
+        return False
+    with open(path, "rb") as f:
+        header = f.read(BINARY_HEADER_SIZE)
+    num_facets = int(np.frombuffer(header[80:84], dtype="<u4")[0])
+    return size == BINARY_HEADER_SIZE + num_facets * BINARY_FACET_DTYPE.itemsize
+
+
+def read_binary_stl_facets(path: str) -> tuple[str, PointType, VectorType]:
+    """Reads the solid from a binary STL file.
+
+    The solid name is taken from the header if it starts with `BINARY_HEADER_PREFIX`
+    (files written by `write_stl()`) or with "solid" (some other programs).
+    Otherwise it is empty.
+
+    Returns:
+        tuple (solid name, vertices, normals)
+    """
+    with open(path, "rb") as f:
+        header = f.read(80)
+    data = np.fromfile(path, dtype=BINARY_FACET_DTYPE, offset=BINARY_HEADER_SIZE)
+
+    name = ""
+    header_str = header.decode("ascii", errors="ignore").strip("\x00 ")
+    for prefix in (BINARY_HEADER_PREFIX, "solid"):
+        if header_str.startswith(prefix):
+            name = header_str[len(prefix) :].strip()
+            break
+
+    vertices = data["vertices"].astype(FLOAT)
+    normals = data["normal"].astype(FLOAT)
+    return name, vertices, normals
+
+
+def read_ascii_stl_facets(text: str) -> list[tuple[str, PointType, VectorType]]:
+    """Parses all solids of an ASCII STL file.
+
+    The text of each solid is split into tokens, which are arranged in a table
+    with one row per facet. The keywords are checked column by column
+    and the numbers are converted at once.
+
+    Args:
+        text: contents of the file
+
+    Returns:
+        list of tuples (solid name, vertices, normals)
+    """
+    solids = []
+    pos = 0
+    while True:
+        m = SOLID_RE.search(text, pos)
+        if m is None:
+            break
+        name = m.group(1)
+        end = text.find("endsolid", m.end())
+        if end < 0:
+            raise ValueError(f"Missing endsolid of solid {name}")
+
+        tokens = text[m.end() : end].split()
+        if len(tokens) % ASCII_FACET_NUM_TOKENS != 0:
+            raise ValueError(f"Incorrect facets in solid {name}")
+        table = np.array(tokens, dtype=object).reshape((-1, ASCII_FACET_NUM_TOKENS))
+        for col, keyword in ASCII_FACET_KEYWORDS.items():
+            if not (table[:, col] == keyword).all():
+                raise ValueError(f"Incorrect facets in solid {name}: expected '{keyword}'")
+        numbers = table[:, ASCII_FACET_NUMBERS].astype(FLOAT)
+
+        line_end = text.find("\n", end)
+        if line_end < 0:
+            line_end = len(text)
+        end_name = text[end + len("endsolid") : line_end].strip()
+        if end_name != "" and end_name != name:
+            logger.warning(f"Solid name {name} different than endsolid name {end_name}")
+
+        solids.append((name, numbers[:, 3:].reshape((-1, 3, 3)), numbers[:, :3].copy()))
+        pos = end + len("endsolid")
+
+    return solids
+
+
+def read_stl_array_format(path: str) -> tuple:
+    """Reads an STL file (ASCII or binary) directly into the array format.
+
+    The structure is the same as of the building returned by `read_stl()`
+    converted with `to_array_format()`: one zone, one solid per STL solid,
+    one wall per solid and one polygon per facet. No `Building`, `Polygon`, etc.
+    instances are created, so it is much faster and uses less memory.
+    The tuple can be passed directly to `Simulation`.
+
+    Degenerate facets (with zero area) are skipped.
+
+    Args:
+        path: path to the STL file
+
+    Returns:
+        tuple (points, faces, polygons, walls, solids, zones), see `to_array_format()`
+    """
+    logger.debug(f"Reading STL to the array format: {path}")
+
+    all_vertices = []
+    walls = []
+    for sn, (_, vertices, normals) in enumerate(read_stl_facets(path)):
+        vertices, _ = check_facets(vertices, normals)
+        all_vertices.append(vertices.reshape((-1, 3)))
+        walls.append(np.full(vertices.shape[0], sn, dtype=int))
+
+    num_solids = len(all_vertices)
+    if num_solids == 0:
+        raise ValueError(f"No solids found in {path}")
+
+    points = np.concatenate(all_vertices).astype(float)
+    num_polys = points.shape[0] // 3
+    # Vertices of each facet are ordered like by `triangulate()`, i.e. (2, 0, 1)
+    faces = np.arange(3 * num_polys, dtype=int).reshape((-1, 3))[:, [2, 0, 1]]
+    polygons = np.arange(num_polys, dtype=int)
+    solids = np.arange(num_solids, dtype=int)  # One wall per solid
+    zones = np.zeros(num_solids, dtype=int)
+
+    logger.debug(f"Number of solids = {num_solids}, number of facets = {num_polys}")
+
+    return points, faces, polygons, np.concatenate(walls), solids, zones
@@ -1,3 +1,4 @@
+import os
 import uuid
 
 import numpy as np
@@ -27,6 +28,22 @@ def random_id(size: int | None = None) -> str:
         return uid[:size]
 
 
+def random_ids(num: int) -> list[str]:
+    """Return a list of `num` random UUIDs (version 4), like `random_id()`.
+
+    All UUIDs are generated from one buffer of random bytes,
+    which is much faster than calling `random_id()` in a loop.
+    """
+    b = np.frombuffer(os.urandom(16 * num), dtype=np.uint8).reshape((num, 16)).copy()
+    b[:, 6] = (b[:, 6] & 0x0F) | 0x40  # Version 4
+    b[:, 8] = (b[:, 8] & 0x3F) | 0x80  # Variant RFC 4122
+    h = b.tobytes().hex()
+    return [
+        f"{h[i:i + 8]}-{h[i + 8:i + 12]}-{h[i + 12:i + 16]}-{h[i + 16:i + 20]}-{h[i + 20:i + 32]}"
+        for i in range(0, 32 * num, 32)
+    ]
+
+
 def random_within(lim=1.0) -> float:
     """Return random float within range [-lim, +lim)"""
     if lim == 0:
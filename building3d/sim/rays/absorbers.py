@@ -0,0 +1,253 @@
+"""Absorber (receiver) hit detection and accumulation.
+
+Rays are tested against absorbers in parallel. A ray hitting an absorber
+gives all its energy to it. Since many rays can hit the same absorber
+in the same step, the hits are not added directly to the shared `hits` array.
+Instead, each ray stores the index of the absorber it hit and the absorbed energy,
+and the hits are summed after the parallel section by `collect_hits()`,
+using a separate accumulator for each chunk of rays. The number of chunks is fixed,
+so the order of floating point additions (and hence the result) doesn't depend
+on the number of threads.
+
+If there are many absorbers, only those close to the ray are checked.
+They are found in a sparse grid of absorbers (see `make_point_grid()`):
+in the cell of the ray position (step mode) or in the cells crossed by the ray
+until the next wall hit (event mode).
+"""
+import numpy as np
+from numba import njit
+from numba import prange
+
+from building3d.geom.types import FLOAT
+from building3d.geom.types import FloatDataType
+from building3d.geom.types import IndexType
+from building3d.geom.types import PointType
+from building3d.geom.types import VectorType
+
+from .voxel_grid import VoxelGrid
+from .voxel_grid import get_cell_polygons
+
+# If there are more absorbers than this, a grid is used to find the ones near the ray
+MIN_ABSORBERS_FOR_GRID = 16
+
+# Number of chunks of rays whose hits are summed separately in `collect_hits()`
+NUM_HIT_CHUNKS = 64
+
+
+@njit
+def find_absorber(
+    pos: PointType,
+    absorbers: PointType,
+    absorber_sq_radius: float,
+    absorber_grid: VoxelGrid,
+) -> int:
+    """Returns the index of the first absorber containing the point `pos` (-1 if none).
+
+    If there are many absorbers (see `MIN_ABSORBERS_FOR_GRID`), only the absorbers
+    from the grid cell of the point are checked.
+
+    Args:
+        pos: point (ray position)
+        absorbers: array of absorber positions
+        absorber_sq_radius: squared radius of absorbers
+        absorber_grid: grid of absorbers (see `make_point_grid()`)
+
+    Returns:
+        absorber index or -1
+    """
+    if absorbers.shape[0] > MIN_ABSORBERS_FOR_GRID:
+        x = int(np.floor(pos[0] / absorber_grid.step))
+        y = int(np.floor(pos[1] / absorber_grid.step))
+        z = int(np.floor(pos[2] / absorber_grid.step))
+        for sn in get_cell_polygons(absorber_grid, x, y, z):
+            if sq_distance(pos, absorbers[sn]) < absorber_sq_radius:
+                return sn
+        return -1
+
+    for sn in range(absorbers.shape[0]):
+        if sq_distance(pos, absorbers[sn]) < absorber_sq_radius:
+            return sn
+    return -1
+
+
+@njit
+def find_next_absorber(
+    pos: PointType,
+    velocity: VectorType,
+    t_max: float,
+    absorbers: PointType,
+    absorber_sq_radius: float,
+    absorber_grid: VoxelGrid,
+) -> tuple[float, int]:
+    """Returns the time after which a ray enters the nearest absorber and its index.
+
+    Only absorbers entered not later than `t_max` are considered.
+    If there are many absorbers (see `MIN_ABSORBERS_FOR_GRID`), only the absorbers
+    from the grid cells crossed by the ray are checked (3D DDA traversal).
+    Each absorber is stored in all cells overlapping with it, so it is found
+    in the cell in which the ray enters it and the traversal stops after that cell.
+
+    Args:
+        pos: ray position
+        velocity: ray velocity
+        t_max: maximum time, e.g. time to the next wall hit (may be `np.inf`)
+        absorbers: array of absorber positions
+        absorber_sq_radius: squared radius of absorbers
+        absorber_grid: grid of absorbers (see `make_point_grid()`)
+
+    Returns:
+        tuple (time to absorber, absorber index), or (`np.inf`, -1) if no absorber is hit
+    """
+    t_best = np.inf
+    an = -1
+
+    if absorbers.shape[0] <= MIN_ABSORBERS_FOR_GRID:
+        for sn in range(absorbers.shape[0]):
+            t_abs = time_to_sphere(pos, velocity, absorbers[sn], absorber_sq_radius)
+            if t_abs <= t_max and t_abs < t_best:
+                t_best = t_abs
+                an = sn
+        return t_best, an
+
+    step = absorber_grid.step
+    origin = absorber_grid.origin
+    shape = absorber_grid.shape
+
+    # Part of the ray inside the grid
+    t_enter = 0.0
+    t_exit = t_max
+    for k in range(3):
+        lo = origin[k] * step
+        hi = (origin[k] + shape[k]) * step
+        if velocity[k] == 0.0:
+            if pos[k] < lo or pos[k] > hi:
+                return t_best, an
+            continue
+        t_lo = (lo - pos[k]) / velocity[k]
+        t_hi = (hi - pos[k]) / velocity[k]
+        t_enter = max(t_enter, min(t_lo, t_hi))
+        t_exit = min(t_exit, max(t_lo, t_hi))
+    if t_enter > t_exit:
+        return t_best, an
+
+    # First cell and the times at which the ray crosses the next cell boundary along each axis
+    cell = np.zeros(3, dtype=np.int64)
+    cell_step = np.zeros(3, dtype=np.int64)
+    t_next = np.full(3, np.inf)
+    t_delta = np.full(3, np.inf)
+    for k in range(3):
+        x = pos[k] + velocity[k] * t_enter
+        cell[k] = min(max(int(np.floor(x / step)), origin[k]), origin[k] + shape[k] - 1)
+        if velocity[k] > 0:
+            cell_step[k] = 1
+            t_next[k] = ((cell[k] + 1) * step - pos[k]) / velocity[k]
+            t_delta[k] = step / velocity[k]
+        elif velocity[k] < 0:
+            cell_step[k] = -1
+            t_next[k] = (cell[k] * step - pos[k]) / velocity[k]
+            t_delta[k] = -step / velocity[k]
+
+    while True:
+        for sn in get_cell_polygons(absorber_grid, cell[0], cell[1], cell[2]):
+            t_abs = time_to_sphere(pos, velocity, absorbers[sn], absorber_sq_radius)
+            if t_abs <= t_max and (t_abs < t_best or (t_abs == t_best and sn < an)):
+                t_best = t_abs
+                an = sn
+
+        # Move to the next cell
+        k = np.argmin(t_next)
+        t_cell_exit = t_next[k]
+        if t_best <= t_cell_exit or t_cell_exit > t_exit:
+            break
+        cell[k] += cell_step[k]
+        if cell[k] < origin[k] or cell[k] >= origin[k] + shape[k]:
+            break
+        t_next[k] += t_delta[k]
+
+    return t_best, an
+
+
+@njit
+def time_to_sphere(
+    pos: PointType,
+    velocity: VectorType,
+    center: PointType,
+    sq_radius: float,
+) -> float:
+    """Returns the time after which a ray enters a sphere.
+
+    Returns 0 if the ray is already inside the sphere and `np.inf` if it never enters it.
+    """
+    rel = pos - center
+    c = np.dot(rel, rel) - sq_radius
+    if c <= 0:
+        return 0.0
+
+    b = 2.0 * np.dot(velocity, rel)
+    if b >= 0:
+        # The ray is moving away from the sphere
+        return np.inf
+
+    a = np.dot(velocity, velocity)
+    disc = b * b - 4.0 * a * c
+    if disc < 0:
+        return np.inf
+
+    return (-b - np.sqrt(disc)) / (2.0 * a)
+
+
+@njit
+def sq_distance(pt1: PointType, pt2: PointType) -> float:
+    """Returns the squared distance between two points (without allocating arrays)."""
+    dx = pt1[0] - pt2[0]
+    dy = pt1[1] - pt2[1]
+    dz = pt1[2] - pt2[2]
+    return dx * dx + dy * dy + dz * dz
+
+
+@njit
+def make_chunk_hits(num_rays: int, num_absorbers: int) -> FloatDataType:
+    """Returns the accumulators used by `collect_hits()`, shape (num_chunks, num_absorbers).
+
+    The array can be reused in all steps of a batch (it is reset by `collect_hits()`).
+    """
+    num_chunks = min(NUM_HIT_CHUNKS, max(num_rays, 1))
+    return np.zeros((num_chunks, num_absorbers), dtype=FLOAT)
+
+
+@njit(parallel=True)
+def collect_hits(
+    absorbed_by: IndexType,
+    absorbed_energy: FloatDataType,
+    hits: FloatDataType,
+    chunk_hits: FloatDataType,
+) -> None:
+    """Adds the energy absorbed by each ray to the hits of its absorber.
+
+    Rays are split into `NUM_HIT_CHUNKS` chunks, each chunk is summed into its own
+    accumulator, and the accumulators are merged in order at the end,
+    so the result is the same for any number of threads. `absorbed_by` is reset to -1.
+
+    Args:
+        absorbed_by: index of the absorber hit by each ray (-1 if none), shape (num_rays, )
+        absorbed_energy: energy absorbed by each ray, shape (num_rays, )
+        hits: absorber hits, updated in-place, shape (num_absorbers, )
+        chunk_hits: accumulators of the chunks (see `make_chunk_hits()`), overwritten
+
+    Returns:
+        None
+    """
+    num_rays = absorbed_by.size
+    num_chunks = chunk_hits.shape[0]
+    chunk_size = (num_rays + num_chunks - 1) // num_chunks
+
+    for ch in prange(num_chunks):
+        chunk_hits[ch, :] = 0.0
+        for rn in range(ch * chunk_size, min((ch + 1) * chunk_size, num_rays)):
+            an = absorbed_by[rn]
+            if an >= 0:
+                chunk_hits[ch, an] += absorbed_energy[rn]
+                absorbed_by[rn] = -1
+
+    for ch in range(num_chunks):
+        hits += chunk_hits[ch]
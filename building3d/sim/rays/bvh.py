@@ -0,0 +1,379 @@
+"""Bounding volume hierarchy (BVH) over the triangles of a compiled scene.
+
+The BVH is an alternative to the voxel grid. It adapts to uneven polygon density
+(e.g. detailed objects in large rooms) and does not need any tuning of the cell size.
+
+The BVH is a named tuple of arrays:
+- node_bbox:  bounding box (min, max) of each node, shape `(num_nodes, 2, 3)`
+- node_left:  index of the left child (the right child is `node_left + 1`), -1 for leaves
+- node_start: index of the first triangle of a leaf in the triangle arrays below
+- node_count: number of triangles in a leaf, 0 for internal nodes
+- max_depth:  depth of the tree (used to size the traversal stack)
+- tri_v0:     first vertex of each triangle, shape `(num_triangles, 3)`
+- tri_e1:     edge from the first to the second vertex, shape `(num_triangles, 3)`
+- tri_e2:     edge from the first to the third vertex, shape `(num_triangles, 3)`
+- tri_poly:   polygon index of each triangle, shape `(num_triangles, )`
+
+Triangles are reordered during the build, so that each leaf refers to a contiguous
+range of the triangle arrays. The tree is built top-down using the surface area
+heuristic (SAH) evaluated on a fixed number of bins.
+"""
+from typing import NamedTuple
+
+import numpy as np
+from numba import njit
+
+from building3d.geom.types import FLOAT
+from building3d.geom.types import INT
+from building3d.geom.types import BoolDataType
+from building3d.geom.types import FloatDataType
+from building3d.geom.types import IndexType
+from building3d.geom.types import PointType
+from building3d.geom.types import VectorType
+
+from .scene import Scene
+from .scene import get_num_polygons
+
+
+class BVH(NamedTuple):
+    node_bbox: FloatDataType
+    node_left: IndexType
+    node_start: IndexType
+    node_count: IndexType
+    max_depth: int
+    tri_v0: PointType
+    tri_e1: VectorType
+    tri_e2: VectorType
+    tri_poly: IndexType
+
+
+@njit
+def make_bvh(scene: Scene, leaf_size: int = 4, num_bins: int = 16) -> BVH:
+    """Builds a BVH over all triangles of the scene.
+
+    Args:
+        scene: compiled scene (see `make_scene()`)
+        leaf_size: nodes with this many triangles or fewer are not split
+        num_bins: number of bins used to evaluate the surface area heuristic
+
+    Returns:
+        BVH
+    """
+    num_tri = scene.tri.shape[0]
+
+    # Triangle vertices, bounding boxes and centroids
+    v0 = np.zeros((num_tri, 3), dtype=FLOAT)
+    v1 = np.zeros((num_tri, 3), dtype=FLOAT)
+    v2 = np.zeros((num_tri, 3), dtype=FLOAT)
+    poly = np.zeros(num_tri, dtype=INT)
+    for pn in range(get_num_polygons(scene)):
+        pts = scene.pts[scene.pt_offset[pn]:scene.pt_offset[pn + 1]]
+        for ti in range(scene.tri_offset[pn], scene.tri_offset[pn + 1]):
+            v0[ti] = pts[scene.tri[ti, 0]]
+            v1[ti] = pts[scene.tri[ti, 1]]
+            v2[ti] = pts[scene.tri[ti, 2]]
+            poly[ti] = pn
+
+    tri_min = np.minimum(np.minimum(v0, v1), v2)
+    tri_max = np.maximum(np.maximum(v0, v1), v2)
+    centroid = (v0 + v1 + v2) / 3.0
+
+    # Nodes (a binary tree with N leaves has 2N - 1 nodes)
+    max_nodes = max(2 * num_tri - 1, 1)
+    node_bbox = np.zeros((max_nodes, 2, 3), dtype=FLOAT)
+    node_left = np.full(max_nodes, -1, dtype=INT)
+    node_start = np.zeros(max_nodes, dtype=INT)
+    node_count = np.zeros(max_nodes, dtype=INT)
+    node_depth = np.zeros(max_nodes, dtype=INT)
+
+    order = np.arange(num_tri).astype(INT)
+    node_count[0] = num_tri
+    num_nodes = 1
+    max_depth = 0
+
+    bin_count = np.zeros(num_bins, dtype=INT)
+    bin_min = np.zeros((num_bins, 3), dtype=FLOAT)
+    bin_max = np.zeros((num_bins, 3), dtype=FLOAT)
+    right_area = np.zeros(num_bins, dtype=FLOAT)
+    right_count = np.zeros(num_bins, dtype=INT)
+
+    stack = [0]
+    while len(stack) > 0:
+        node = stack.pop()
+        start = node_start[node]
+        count = node_count[node]
+        prims = order[start:start + count]
+        max_depth = max(max_depth, node_depth[node])
+
+        # Node bounds and centroid bounds
+        cmin = np.full(3, np.inf, dtype=FLOAT)
+        cmax = np.full(3, -np.inf, dtype=FLOAT)
+        for k in range(3):
+            node_bbox[node, 0, k] = np.inf
+            node_bbox[node, 1, k] = -np.inf
+        for ti in prims:
+            for k in range(3):
+                node_bbox[node, 0, k] = min(node_bbox[node, 0, k], tri_min[ti, k])
+                node_bbox[node, 1, k] = max(node_bbox[node, 1, k], tri_max[ti, k])
+                cmin[k] = min(cmin[k], centroid[ti, k])
+                cmax[k] = max(cmax[k], centroid[ti, k])
+
+        if count <= leaf_size:
+            continue
+
+        # Find the best split using binned SAH
+        best_cost = np.inf
+        best_axis = -1
+        best_bin = -1
+        for axis in range(3):
+            extent = cmax[axis] - cmin[axis]
+            if extent <= 0.0:
+                continue
+
+            bin_count[:] = 0
+            bin_min[:, :] = np.inf
+            bin_max[:, :] = -np.inf
+            for ti in prims:
+                b = get_bin(centroid[ti, axis], cmin[axis], extent, num_bins)
+                bin_count[b] += 1
+                for k in range(3):
+                    bin_min[b, k] = min(bin_min[b, k], tri_min[ti, k])
+                    bin_max[b, k] = max(bin_max[b, k], tri_max[ti, k])
+
+            # Sweep from the right to get the area and count on the right side of each split
+            acc_min = np.full(3, np.inf, dtype=FLOAT)
+            acc_max = np.full(3, -np.inf, dtype=FLOAT)
+            acc_count = 0
+            for b in range(num_bins - 1, 0, -1):
+                acc_count += bin_count[b]
+                for k in range(3):
+                    acc_min[k] = min(acc_min[k], bin_min[b, k])
+                    acc_max[k] = max(acc_max[k], bin_max[b, k])
+                right_count[b] = acc_count
+                right_area[b] = half_area(acc_min, acc_max)
+
+            # Sweep from the left and evaluate the cost of splitting before bin b
+            acc_min[:] = np.inf
+            acc_max[:] = -np.inf
+            acc_count = 0
+            for b in range(1, num_bins):
+                acc_count += bin_count[b - 1]
+                for k in range(3):
+                    acc_min[k] = min(acc_min[k], bin_min[b - 1, k])
+                    acc_max[k] = max(acc_max[k], bin_max[b - 1, k])
+                if acc_count == 0 or right_count[b] == 0:
+                    continue
+                cost = half_area(acc_min, acc_max) * acc_count + right_area[b] * right_count[b]
+                if cost < best_cost:
+                    best_cost = cost
+                    best_axis = axis
+                    best_bin = b
+
+        # Partition triangles
+        mid = 0
+        if best_axis >= 0:
+            node_area = half_area(node_bbox[node, 0], node_bbox[node, 1])
+            leaf_cost = count * node_area
+            # Traversal of an internal node is assumed to be as costly as one intersection test
+            if best_cost + node_area >= leaf_cost and count <= 4 * leaf_size:
+                continue
+
+            extent = cmax[best_axis] - cmin[best_axis]
+            i = 0
+            j = count - 1
+            while i <= j:
+                b = get_bin(centroid[prims[i], best_axis], cmin[best_axis], extent, num_bins)
+                if b < best_bin:
+                    i += 1
+                else:
+                    prims[i], prims[j] = prims[j], prims[i]
+                    j -= 1
+            mid = i
+
+        if mid == 0 or mid == count:
+            # All centroids are equal, split in half
+            mid = count // 2
+
+        left = num_nodes
+        num_nodes += 2
+        node_left[node] = left
+        node_count[node] = 0
+        node_start[left] = start
+        node_count[left] = mid
+        node_start[left + 1] = start + mid
+        node_count[left + 1] = count - mid
+        node_depth[left] = node_depth[node] + 1
+        node_depth[left + 1] = node_depth[node] + 1
+        stack.append(left)
+        stack.append(left + 1)
+
+    return BVH(
+        node_bbox[:num_nodes].copy(),
+        node_left[:num_nodes].copy(),
+        node_start[:num_nodes].copy(),
+        node_count[:num_nodes].copy(),
+        max_depth,
+        v0[order].copy(),
+        (v1[order] - v0[order]).copy(),
+        (v2[order] - v0[order]).copy(),
+        poly[order].copy(),
+    )
+
+
+@njit
+def get_bin(c: float, cmin: float, extent: float, num_bins: int) -> int:
+    """Returns the bin index of a centroid coordinate."""
+    b = int(num_bins * (c - cmin) / extent)
+    return min(max(b, 0), num_bins - 1)
+
+
+@njit
+def half_area(bmin: PointType, bmax: PointType) -> float:
+    """Returns half of the surface area of a bounding box."""
+    dx = bmax[0] - bmin[0]
+    dy = bmax[1] - bmin[1]
+    dz = bmax[2] - bmin[2]
+    return dx * dy + dy * dz + dz * dx
+
+
+@njit
+def ray_box_entry(
+    pos: PointType,
+    velocity: VectorType,
+    bbox: FloatDataType,
+    t_max: float,
+) -> float:
+    """Returns the time at which a ray enters a bounding box, or `np.inf` if it misses it.
+
+    Boxes entered after `t_max` are treated as missed.
+    """
+    t_enter = 0.0
+    t_exit = t_max
+    for k in range(3):
+        if velocity[k] == 0.0:
+            if pos[k] < bbox[0, k] or pos[k] > bbox[1, k]:
+                return np.inf
+            continue
+        t1 = (bbox[0, k] - pos[k]) / velocity[k]
+        t2 = (bbox[1, k] - pos[k]) / velocity[k]
+        if t1 > t2:
+            t1, t2 = t2, t1
+        if t1 > t_enter:
+            t_enter = t1
+        if t2 < t_exit:
+            t_exit = t2
+        if t_enter > t_exit:
+            return np.inf
+    return t_enter
+
+
+@njit
+def ray_triangle(
+    pos: PointType,
+    velocity: VectorType,
+    v0: PointType,
+    e1: VectorType,
+    e2: VectorType,
+    tol: float = 1e-9,
+) -> float:
+    """Returns the time at which a ray hits a triangle (Moller-Trumbore), or `np.inf` if none.
+
+    Rays parallel to the triangle are treated as missing it.
+    Hits within `tol` (in barycentric coordinates) from the edges are accepted.
+    """
+    # p = velocity x e2
+    px = velocity[1] * e2[2] - velocity[2] * e2[1]
+    py = velocity[2] * e2[0] - velocity[0] * e2[2]
+    pz = velocity[0] * e2[1] - velocity[1] * e2[0]
+    det = e1[0] * px + e1[1] * py + e1[2] * pz
+    if det == 0.0:
+        return np.inf
+    inv_det = 1.0 / det
+
+    tx = pos[0] - v0[0]
+    ty = pos[1] - v0[1]
+    tz = pos[2] - v0[2]
+    u = (tx * px + ty * py + tz * pz) * inv_det
+    if u < -tol or u > 1.0 + tol:
+        return np.inf
+
+    # q = t x e1
+    qx = ty * e1[2] - tz * e1[1]
+    qy = tz * e1[0] - tx * e1[2]
+    qz = tx * e1[1] - ty * e1[0]
+    v = (velocity[0] * qx + velocity[1] * qy + velocity[2] * qz) * inv_det
+    if v < -tol or u + v > 1.0 + tol:
+        return np.inf
+
+    return (e2[0] * qx + e2[1] * qy + e2[2] * qz) * inv_det
+
+
+@njit
+def bvh_first_hit(
+    bvh: BVH,
+    pos: PointType,
+    velocity: VectorType,
+    transparent: BoolDataType,
+    skip: int = -1,
+    t_min: float = 0.0,
+) -> tuple[int, float]:
+    """Finds the first polygon hit by a ray and the time until the hit.
+
+    Same as `find_next_hit()`, but only the triangles from the BVH nodes
+    crossed by the ray are tested.
+
+    Args:
+        bvh: BVH of the scene (see `make_bvh()`)
+        pos: The starting position of the ray.
+        velocity: The velocity vector of the ray.
+        transparent: Boolean mask of transparent polygons, shape (num_polygons, ).
+        skip: Index of a polygon to be ignored, -1 if none.
+        t_min: Hits at times lower than or equal to `t_min` are ignored.
+
+    Returns:
+        tuple: (index of the target polygon, time to hit), or (-1, np.inf) if no polygon is hit.
+    """
+    min_t = np.inf
+    min_t_index = -1
+
+    stack = np.empty(bvh.max_depth + 2, dtype=INT)
+    stack[0] = 0
+    sp = 1
+
+    while sp > 0:
+        sp -= 1
+        node = stack[sp]
+
+        if ray_box_entry(pos, velocity, bvh.node_bbox[node], min_t) == np.inf:
+            continue
+
+        left = bvh.node_left[node]
+        if left < 0:
+            # Leaf
+            for ti in range(bvh.node_start[node], bvh.node_start[node] + bvh.node_count[node]):
+                pn = bvh.tri_poly[ti]
+                if pn == skip or transparent[pn]:
+                    continue
+                t = ray_triangle(pos, velocity, bvh.tri_v0[ti], bvh.tri_e1[ti], bvh.tri_e2[ti])
+                if t > t_min and t < min_t:
+                    min_t = t
+                    min_t_index = pn
+        else:
+            # Visit the closer child first (it is pushed last)
+            t_left = ray_box_entry(pos, velocity, bvh.node_bbox[left], min_t)
+            t_right = ray_box_entry(pos, velocity, bvh.node_bbox[left + 1], min_t)
+            if t_left <= t_right:
+                if t_right < np.inf:
+                    stack[sp] = left + 1
+                    sp += 1
+                if t_left < np.inf:
+                    stack[sp] = left
+                    sp += 1
+            else:
+                if t_left < np.inf:
+                    stack[sp] = left
+                    sp += 1
+                stack[sp] = left + 1
+                sp += 1
+
+    return min_t_index, min_t
@@ -0,0 +1,90 @@
+"""Checkpoints of the ray simulation state.
+
+A checkpoint holds everything needed to continue a simulation after the last
+completed batch: ray positions, velocities and energy, absorber hits, the step number
+and the state of the random number generator. It also holds a hash of the configuration
+and geometry, so that a simulation is never resumed with different parameters.
+Checkpoints are written to a temporary file which then replaces the previous one,
+so an interrupted write never destroys the last checkpoint.
+"""
+import hashlib
+import json
+import logging
+import os
+from typing import NamedTuple
+
+import numpy as np
+
+from building3d.geom.types import FloatDataType
+from building3d.geom.types import PointType
+from building3d.geom.types import VectorType
+
+from .simulation_config import SimulationConfig
+
+logger = logging.getLogger(__name__)
+
+# Engine parameters which can be changed when resuming a simulation
+# (e.g. to extend a finished simulation by increasing the number of steps)
+UNHASHED_ENGINE_KEYS = ("num_steps", "checkpoint_every")
+
+
+class Checkpoint(NamedTuple):
+    step: int
+    position: PointType
+    velocity: VectorType
+    energy: FloatDataType
+    hits: FloatDataType
+    rng_state: dict
+    config_hash: str
+
+
+def get_config_hash(sim_cfg: SimulationConfig, arrays: tuple[np.ndarray, ...]) -> str:
+    """Returns a hash of the engine and ray parameters and the given arrays (e.g. geometry).
+
+    The parameters listed in `UNHASHED_ENGINE_KEYS` are not included.
+    """
+    engine = {k: v for k, v in sim_cfg.engine.items() if k not in UNHASHED_ENGINE_KEYS}
+    params = repr((sorted(engine.items()), sorted(sim_cfg.rays.items())))
+
+    h = hashlib.sha256(params.encode())
+    for arr in arrays:
+        arr = np.ascontiguousarray(arr)
+        h.update(repr((arr.dtype.str, arr.shape)).encode())
+        h.update(arr.tobytes())
+
+    return h.hexdigest()
+
+
+def save_checkpoint(path: str, checkpoint: Checkpoint) -> None:
+    """Saves the checkpoint to an .npz file, replacing the previous one atomically."""
+    logger.debug(f"Saving checkpoint at step {checkpoint.step} to {path}")
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(
+            f,
+            step=checkpoint.step,
+            position=checkpoint.position,
+            velocity=checkpoint.velocity,
+            energy=checkpoint.energy,
+            hits=checkpoint.hits,
+            rng_state=json.dumps(checkpoint.rng_state),
+            config_hash=checkpoint.config_hash,
+        )
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path: str) -> Checkpoint:
+    """Loads the checkpoint saved with `save_checkpoint()`."""
+    logger.debug(f"Loading checkpoint from {path}")
+
+    with np.load(path) as data:
+        return Checkpoint(
+            step=int(data["step"]),
+            position=data["position"],
+            velocity=data["velocity"],
+            energy=data["energy"],
+            hits=data["hits"],
+            rng_state=json.loads(str(data["rng_state"])),
+            config_hash=str(data["config_hash"]),
+        )
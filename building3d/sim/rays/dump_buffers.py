@@ -1,16 +1,31 @@
+"""Saving and reading simulation buffers.
+
+Each quantity (position, energy, hits) is stored in a single .npy file
+with the step number as the first axis. The file is extended in place
+after each batch: the data is appended at the end and the array header,
+which has a fixed size, is rewritten with the new number of steps.
+Since every step takes the same number of bytes, the byte offset of any step
+is known without an index, so any range of steps can be read without loading
+the whole file (see `open_buffers()`).
+"""
 import logging
+import os
+import struct
 
 import numpy as np
+from numpy.lib import format as npy_format
 
-from building3d.geom.types import FLOAT
 from building3d.geom.types import FloatDataType
 from building3d.geom.types import PointType
-from building3d.paths.wildcardpath import WildcardPath
 
 from .simulation_config import SimulationConfig
 
 logger = logging.getLogger(__name__)
 
+# Size of the .npy header (magic string, header length and the array description).
+# It is fixed, so that the header can be rewritten when the file grows.
+NPY_HEADER_SIZE = 128
+
 
 def dump_buffers(
     pos_buf: PointType,
@@ -22,11 +37,15 @@ def dump_buffers(
 ):
     """Saves buffer arrays to a chosen directory.
 
-    Each step is saved in a separate file.
+    The buffers are written to the files at the steps `init_step`, `init_step + 1`, ...
+    Steps already present in the files are overwritten, the remaining ones are appended.
+    This way consecutive batches, which share the first/last step, can be dumped one by one.
+    If positions and energy are recorded every `sim_cfg.engine["record_every"]` steps,
+    their files are indexed by the record number, i.e. `step // record_every`.
 
     Args:
-        pos_buf: buffer of ray positions, shaped (num_steps, num_rays, 3)
-        enr_buf: buffer of ray energy, shaped (num_steps, num_rays)
+        pos_buf: buffer of ray positions, shaped (num_records, num_recorded_rays, 3)
+        enr_buf: buffer of ray energy, shaped (num_records, num_recorded_rays)
         hit_buf: buffer of ray absorber hits, shaped (num_steps, num_absorbers)
         dump_dir: path to the dump directory, will be created if doesn't exist
         sim_cfg: simulation configuration
@@ -37,83 +56,159 @@ def dump_buffers(
     """
     logger.debug(f"Saving buffers to {dump_dir}")
 
-    step = 0
-    num_steps = pos_buf.shape[0]
-
-    while step < num_steps:
-        for data, file in (
-            (pos_buf, sim_cfg.paths["position_file"]),
-            (enr_buf, sim_cfg.paths["energy_file"]),
-            (hit_buf, sim_cfg.paths["hits_file"]),
-        ):
-            path = WildcardPath(file).fill(parent=dump_dir, step=step + init_step)
-            np.save(path, data[step])
+    if not os.path.exists(dump_dir):
+        os.makedirs(dump_dir)
 
-        step += 1
+    record_every = sim_cfg.engine["record_every"]
+    for data, file, first in (
+        (pos_buf, sim_cfg.paths["position_file"], init_step // record_every),
+        (enr_buf, sim_cfg.paths["energy_file"], init_step // record_every),
+        (hit_buf, sim_cfg.paths["hits_file"], init_step),
+    ):
+        write_steps(os.path.join(dump_dir, file), data, first)
 
 
 def read_buffers(
     dump_dir: str,
     sim_cfg: SimulationConfig,
+    first_step: int = 0,
+    last_step: int | None = None,
+    rays: slice | None = None,
 ) -> tuple[PointType, FloatDataType, FloatDataType]:
-    """Read buffer arrays from a directory.
+    """Read buffer arrays from a directory into memory.
+
+    Only the selected steps and rays are read from the disk
+    (see `open_buffers()` for the arguments).
+
+    Returns:
+        (pos_buf, enr_buf, hit_buf)
+    """
+    pos_buf, enr_buf, hit_buf = open_buffers(dump_dir, sim_cfg, first_step, last_step, rays)
+    return np.array(pos_buf), np.array(enr_buf), np.array(hit_buf)
+
+
+def open_buffers(
+    dump_dir: str,
+    sim_cfg: SimulationConfig,
+    first_step: int = 0,
+    last_step: int | None = None,
+    rays: slice | None = None,
+) -> tuple[PointType, FloatDataType, FloatDataType]:
+    """Opens buffer arrays from a directory as read-only memory-mapped views.
+
+    Nothing is loaded until the views are accessed, and then only the accessed
+    part is read from the disk. Slicing the views (e.g. `pos_buf[100:200]`)
+    gives new views, so runs larger than memory can be processed step by step.
+    Note that fancy indexing (e.g. `pos_buf[[0, 5, 7]]`) loads the data.
+
+    If positions and energy are recorded every `sim_cfg.engine["record_every"]` steps,
+    their buffers contain only the recorded steps from the selected range.
 
     Args:
         dump_dir: path to the dump directory
         sim_cfg: simulation configuration
+        first_step: first step to read (default 0)
+        last_step: step after the last one to read (default None, i.e. until the end)
+        rays: slice of rays to read (default None, i.e. all rays)
 
     Returns:
-        (pos_buf, enr_buf, hit_buf)
+        (pos_buf, enr_buf, hit_buf), shaped (num_steps, num_rays, 3),
+        (num_steps, num_rays) and (num_steps, num_absorbers)
+    """
+    if rays is None:
+        rays = slice(None)
+
+    # Range of records containing the selected steps
+    record_every = sim_cfg.engine["record_every"]
+    first_record = -(-first_step // record_every)
+    last_record = None if last_step is None else -(-last_step // record_every)
+
+    bufs = []
+    for key, first, last in (
+        ("position_file", first_record, last_record),
+        ("energy_file", first_record, last_record),
+        ("hits_file", first_step, last_step),
+    ):
+        path = os.path.join(dump_dir, sim_cfg.paths[key])
+        if not os.path.exists(path):
+            raise RuntimeError(f"Buffer file not found: {path}")
+        bufs.append(np.load(path, mmap_mode="r")[first:last])
+
+    pos_buf, enr_buf, hit_buf = bufs
+    assert pos_buf.shape[0] == enr_buf.shape[0], "Different number of buffer steps in the dump dir?"
+
+    return pos_buf[:, rays], enr_buf[:, rays], hit_buf
+
+
+def write_steps(path: str, data: np.ndarray, init_step: int = 0) -> None:
+    """Writes `data` to the .npy file at the steps `init_step`, `init_step + 1`, ...
+
+    The file is created if it doesn't exist. The existing steps are overwritten,
+    the new ones are appended at the end of the file.
+
+    Args:
+        path: path to the .npy file
+        data: array shaped (num_steps, ...)
+        init_step: step number of `data[0]`
+
+    Raises:
+        ValueError: if `init_step` is after the last step in the file
+            or if the data doesn't match the type or shape of the file contents
+    """
+    data = np.ascontiguousarray(data)
+
+    if not os.path.exists(path):
+        if init_step != 0:
+            raise ValueError(f"Can't write step {init_step} to a new file: {path}")
+        with open(path, "wb") as f:
+            f.write(make_npy_header(data.dtype, data.shape))
+            data.tofile(f)
+        return
+
+    with open(path, "r+b") as f:
+        dtype, shape = read_npy_header(f)
+        if dtype != data.dtype or shape[1:] != data.shape[1:]:
+            raise ValueError(
+                f"Data {data.dtype}{data.shape} doesn't match the file {dtype}{shape}: {path}"
+            )
+        if init_step > shape[0]:
+            raise ValueError(f"Step {init_step} would leave a gap after step {shape[0]}: {path}")
+
+        step_nbytes = data[0:1].nbytes
+        f.seek(NPY_HEADER_SIZE + init_step * step_nbytes)
+        data.tofile(f)
+
+        num_steps = max(shape[0], init_step + data.shape[0])
+        f.seek(0)
+        f.write(make_npy_header(dtype, (num_steps,) + shape[1:]))
+
+
+def make_npy_header(dtype: np.dtype, shape: tuple[int, ...]) -> bytes:
+    """Returns a .npy (version 1.0) header of size `NPY_HEADER_SIZE`."""
+    header = repr({
+        "descr": npy_format.dtype_to_descr(dtype),
+        "fortran_order": False,
+        "shape": tuple(int(n) for n in shape),
+    })
+    magic = npy_format.magic(1, 0)
+    header_len = NPY_HEADER_SIZE - len(magic) - 2
+    if len(header) + 1 > header_len:
+        raise ValueError(f"Array description too long for the .npy header: {header}")
+    header = header.ljust(header_len - 1) + "\n"
+    return magic + struct.pack("<H", header_len) + header.encode("latin1")
+
+
+def read_npy_header(f) -> tuple[np.dtype, tuple[int, ...]]:
+    """Reads the header of a .npy file written by `write_steps()`.
+
+    Returns:
+        tuple (dtype, shape)
     """
-    wpath_pos = WildcardPath(sim_cfg.paths["position_file"])
-    wpath_enr = WildcardPath(sim_cfg.paths["energy_file"])
-    wpath_hit = WildcardPath(sim_cfg.paths["hits_file"])
-
-    dict_pos = wpath_pos.get_matching_paths_dict_values(parent=dump_dir)
-    dict_enr = wpath_enr.get_matching_paths_dict_values(parent=dump_dir)
-    dict_hit = wpath_hit.get_matching_paths_dict_values(parent=dump_dir)
-
-    if len(dict_pos) == 0:
-        raise RuntimeError("Not position files found.")
-    if len(dict_enr) == 0:
-        raise RuntimeError("Not energy files found.")
-    if len(dict_hit) == 0:
-        raise RuntimeError("Not hit files found.")
-
-    max_step_pos = max([d["step"] for d in dict_pos.values()]) + 1  # Because indexing starts at 0
-    max_step_enr = max([d["step"] for d in dict_enr.values()]) + 1
-    max_step_hit = max([d["step"] for d in dict_hit.values()]) + 1
-    assert (
-        max_step_pos == max_step_enr == max_step_hit
-    ), "Different number of buffer steps in the dump dir?"
-
-    max_step = max_step_pos
-
-    # Initialize to avoid complaints from the linter about possibly unbound variables
-    pos_buf = np.array([], dtype=FLOAT)
-    enr_buf = np.array([], dtype=FLOAT)
-    hit_buf = np.array([], dtype=FLOAT)
-
-    for step_num in range(max_step):
-        pos_path = wpath_pos.fill(parent=dump_dir, step=step_num)
-        pos = np.load(pos_path)
-
-        enr_path = wpath_enr.fill(parent=dump_dir, step=step_num)
-        enr = np.load(enr_path)
-
-        hit_path = wpath_hit.fill(parent=dump_dir, step=step_num)
-        hit = np.load(hit_path)
-
-        num_rays = pos.shape[0]
-        num_absorbers = hit.shape[0]
-
-        if step_num == 0:
-            pos_buf = np.zeros((max_step, num_rays, 3), dtype=FLOAT)
-            enr_buf = np.zeros((max_step, num_rays), dtype=FLOAT)
-            hit_buf = np.zeros((max_step, num_absorbers), dtype=FLOAT)
-
-        pos_buf[step_num, 0:num_rays, 0:3] = pos
-        enr_buf[step_num, 0:num_rays] = enr
-        hit_buf[step_num, 0:num_absorbers] = hit
-
-    return pos_buf, enr_buf, hit_buf
+    f.seek(0)
+    version = npy_format.read_magic(f)
+    if version != (1, 0):
+        raise ValueError(f"Unsupported .npy version: {version}")
+    shape, fortran_order, dtype = npy_format.read_array_header_1_0(f)
+    if fortran_order or f.tell() != NPY_HEADER_SIZE:
+        raise ValueError("The .npy file was not written by write_steps()")
+    return dtype, shape
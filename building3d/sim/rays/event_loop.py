@@ -0,0 +1,310 @@
+import numpy as np
+from numba import njit
+
+from numba import prange
+
+from building3d.geom.types import FLOAT
+from building3d.geom.types import BoolDataType
+from building3d.geom.types import INT
+from building3d.geom.types import FloatDataType
+from building3d.geom.types import IndexType
+from building3d.geom.types import PointType
+from building3d.geom.types import VectorType
+
+from .absorbers import collect_hits
+from .absorbers import find_next_absorber
+from .absorbers import make_chunk_hits
+from .bvh import BVH
+from .bvh import bvh_first_hit
+from .find_target import find_next_hit
+from .jit_print import jit_print
+from .scene import Scene
+from .simulation_loop import record_state
+from .voxel_grid import VoxelGrid
+
+
+@njit
+def time_to_exit_box(
+    pos: PointType,
+    velocity: VectorType,
+    min_xyz: PointType,
+    max_xyz: PointType,
+) -> float:
+    """Returns the time after which a ray leaves an axis-aligned box."""
+    t_exit = np.inf
+    for k in range(3):
+        if velocity[k] > 0:
+            t = (max_xyz[k] - pos[k]) / velocity[k]
+        elif velocity[k] < 0:
+            t = (min_xyz[k] - pos[k]) / velocity[k]
+        else:
+            continue
+        if t < t_exit:
+            t_exit = t
+    return max(t_exit, 0.0)
+
+
+@njit
+def find_next_event(
+    pos: PointType,
+    velocity: VectorType,
+    scene: Scene,
+    bvh: BVH | None,
+    transparent: BoolDataType,
+    absorbers: PointType,
+    absorber_sq_radius: float,
+    absorber_grid: VoxelGrid,
+    min_xyz: PointType,
+    max_xyz: PointType,
+    skip: int = -1,
+    atol: float = 1e-3,
+) -> tuple[float, int, int]:
+    """Finds the next event for a ray: a wall hit, an absorber hit or leaving the building.
+
+    Args:
+        pos: ray position
+        velocity: ray velocity
+        scene: compiled scene (see `make_scene()`)
+        bvh: BVH of the scene (see `make_bvh()`), if None all polygons are checked
+        transparent: boolean mask of transparent polygons
+        absorbers: array of absorber positions
+        absorber_sq_radius: squared radius of absorbers
+        absorber_grid: grid of absorbers (see `make_point_grid()`)
+        min_xyz: minimum coordinates of the building bounding box
+        max_xyz: maximum coordinates of the building bounding box
+        skip: polygon to be ignored (e.g. the one the ray has just been reflected from)
+        atol: absolute tolerance
+
+    Returns:
+        tuple (time to event, polygon index, absorber index). If both indices are -1,
+        the event means that the ray leaves the bounding box of the building.
+    """
+    if bvh is not None:
+        pn, t = bvh_first_hit(bvh, pos, velocity, transparent, skip)
+    else:
+        pn, t = find_next_hit(pos, velocity, scene, transparent, skip, atol)
+
+    t_abs, an = find_next_absorber(pos, velocity, t, absorbers, absorber_sq_radius, absorber_grid)
+    if an >= 0:
+        # The absorber is reached before the wall
+        t = t_abs
+        pn = -1
+
+    if pn < 0 and an < 0:
+        # Nothing in front of the ray, it will escape through some opening
+        t = time_to_exit_box(pos, velocity, min_xyz, max_xyz)
+
+    return t, pn, an
+
+
+@njit(parallel=True)
+def event_loop(
+    init_step: int,
+    num_steps: int,
+    num_rays: int,
+    time_step: float,
+    position: PointType,
+    velocity: VectorType,
+    energy: FloatDataType,
+    hits: FloatDataType,
+    absorbers: PointType,
+    absorber_radius: float,
+    absorber_grid: VoxelGrid,
+    scene: Scene,
+    bvh: BVH | None,
+    transparent: BoolDataType,
+    surf_absorption: FloatDataType,
+    record_rays: IndexType,
+    pos_buf: PointType,
+    enr_buf: FloatDataType,
+    hit_buf: FloatDataType,
+    record_every: int = 1,
+    verbose: bool = True,
+    eps: float = 1e-6,
+) -> tuple[PointType, VectorType, FloatDataType, FloatDataType]:
+    """Performs an event-driven simulation loop for ray tracing in a building environment.
+
+    Instead of looking for nearby polygons in each step (like `simulation_loop()`),
+    this function calculates the exact time and position of the next wall hit
+    once per reflection. The rays are then moved along straight lines until the next event.
+    The absorber hits are calculated analytically (ray-sphere intersection) and their energy
+    is binned into the time step in which the ray enters the absorber.
+
+    The input and output arrays are the same as in `simulation_loop()`,
+    so both functions can be used interchangeably.
+
+    Args:
+        init_step (int): Initial step number, used only for printing the progress
+        num_steps (int): Number of simulation steps to perform.
+        num_rays (int): Number of rays to simulate.
+        time_step (float): Simulation time step in seconds.
+        position (PointType): Current position of all rays.
+        velocity (VectorType): Current velocity of all rays.
+        energy (FloatDataType): Current energy of all rays.
+        hits (FloatDataType): Current absorber hits.
+        absorbers (PointType): Array of absorber positions.
+        absorber_radius (float): Size of absorbers.
+        absorber_grid (VoxelGrid): Grid of absorbers (see `make_point_grid()`),
+                                   used to find absorbers along the ray if there are many.
+        scene (Scene): Compiled scene with the building polygons (see `make_scene()`).
+        bvh (BVH | None): Bounding volume hierarchy of the scene (see `make_bvh()`).
+                          If None, all polygons are checked to find the next hit.
+        transparent (BoolDataType): Boolean mask of transparent polygons,
+                                    shape (num_polygons, ).
+        surf_absorption (FloatDataType): Absorption coefficients for each polygon,
+                                         shape (len(polygons), ).
+        record_rays (IndexType): Indices of rays whose positions and energy are stored
+                                 in the buffers. If empty, only absorber hits are stored
+                                 and the memory use doesn't depend on the number of steps.
+        pos_buf (PointType): Output buffer of recorded ray positions,
+                             shaped (num_steps // record_every + 1, len(record_rays), 3).
+        enr_buf (FloatDataType): Output buffer of recorded ray energy,
+                                 shaped (num_steps // record_every + 1, len(record_rays)).
+        hit_buf (FloatDataType): Output buffer of absorber hits,
+                                 shaped (num_steps + 1, num_absorbers).
+        record_every (int): Positions and energy are stored every `record_every` steps.
+                            `num_steps` must be its multiple.
+        verbose (bool): Prints progress if True
+        eps (float): Small number used in comparison operations.
+
+    Returns:
+        tuple[PointType, VectorType, FloatDataType, FloatDataType]: Final state of the rays
+            (position, velocity, energy, hits), i.e. the updated input arrays.
+    """
+    jit_print(verbose, "Preparing for the event loop")
+
+    # Absorber size as a squared radius (to avoid calculating sqrt for each ray and step)
+    absorber_sq_radius = absorber_radius ** 2
+
+    # Polygon points and normal vectors
+    points = scene.pts
+    poly_vn = scene.vn
+
+    # Get bounding box
+    min_xyz = np.zeros(3, dtype=FLOAT)
+    max_xyz = np.zeros(3, dtype=FLOAT)
+    for k in range(3):
+        min_xyz[k] = points[:, k].min() - eps
+        max_xyz[k] = points[:, k].max() + eps
+
+    # Fill buffers with initial values
+    # (buffers have one more step to keep the initial state)
+    record_state(pos_buf, enr_buf, 0, position, energy, record_rays)
+    hit_buf[0, :] = hits
+
+    # Next event of each ray:
+    # - time relative to the beginning of this batch,
+    # - polygon to be hit (-1 if none),
+    # - absorber to be hit (-1 if none).
+    jit_print(verbose, "Finding the first event for each ray")
+    t_event = np.full(num_rays, np.inf, dtype=FLOAT)
+    next_poly = np.full(num_rays, -1, dtype=INT)
+    next_absorber = np.full(num_rays, -1, dtype=INT)
+
+    for rn in prange(num_rays):
+        if energy[rn] <= eps:
+            continue
+        t, pn, an = find_next_event(
+            position[rn],
+            velocity[rn],
+            scene,
+            bvh,
+            transparent,
+            absorbers,
+            absorber_sq_radius,
+            absorber_grid,
+            min_xyz,
+            max_xyz,
+        )
+        t_event[rn] = t
+        next_poly[rn] = pn
+        next_absorber[rn] = an
+
+    # Energy absorbed by absorbers during the current step
+    absorbed_by = np.full(num_rays, -1, dtype=INT)
+    absorbed_energy = np.zeros(num_rays, dtype=FLOAT)
+    chunk_hits = make_chunk_hits(num_rays, hits.size)
+
+    # Move rays
+    jit_print(verbose, "Entering the event loop")
+    for i in range(num_steps):
+        jit_print(verbose, "Step", init_step + i, "| total energy =", energy.sum())
+
+        # Reset hits for each absorber
+        hits[:] = 0.0
+
+        t_end = (i + 1) * time_step
+
+        for rn in prange(num_rays):
+            # If energy is null, the ray should not move
+            if energy[rn] <= eps:
+                continue
+
+            # Process all events that happen within this step
+            # (rays are moved element by element to avoid temporary arrays)
+            t_now = i * time_step
+            while t_event[rn] <= t_end:
+                dt = t_event[rn] - t_now
+                for k in range(3):
+                    position[rn, k] += velocity[rn, k] * dt
+                t_now = t_event[rn]
+                pn = next_poly[rn]
+                an = next_absorber[rn]
+
+                if an >= 0:
+                    # The ray entered the absorber
+                    absorbed_by[rn] = an
+                    absorbed_energy[rn] = energy[rn]
+                    energy[rn] = 0.0
+                    break
+
+                if pn < 0:
+                    # The ray left the building
+                    energy[rn] = 0.0
+                    break
+
+                # Reflect from the target polygon
+                energy[rn] -= surf_absorption[pn]
+                if energy[rn] <= eps:
+                    energy[rn] = 0.0
+                    break
+
+                vn = poly_vn[pn]
+                dot = np.dot(vn, velocity[rn])
+                velocity[rn] = velocity[rn] - 2 * dot * vn
+
+                t, pn, an = find_next_event(
+                    position[rn],
+                    velocity[rn],
+                    scene,
+                    bvh,
+                    transparent,
+                    absorbers,
+                    absorber_sq_radius,
+                    absorber_grid,
+                    min_xyz,
+                    max_xyz,
+                    skip=pn,
+                )
+                t_event[rn] = t_now + t
+                next_poly[rn] = pn
+                next_absorber[rn] = an
+
+            # Move the ray until the end of this step
+            if energy[rn] > eps:
+                dt = t_end - t_now
+                for k in range(3):
+                    position[rn, k] += velocity[rn, k] * dt
+
+        # Collect absorber hits
+        # This can't be done inside prange, because many rays can hit the same absorber
+        collect_hits(absorbed_by, absorbed_energy, hits, chunk_hits)
+
+        # Add state to the buffers
+        if (i + 1) % record_every == 0:
+            record_state(pos_buf, enr_buf, (i + 1) // record_every, position, energy, record_rays)
+        hit_buf[i+1, :] = hits
+
+    jit_print(verbose, "Exiting the event loop")
+
+    return position, velocity, energy, hits
@@ -1,34 +1,42 @@
+import numpy as np
 from numba import njit
 
 from building3d.geom.types import IndexType
 
+from .voxel_grid import VoxelGrid
+from .voxel_grid import get_cell_polygons
+
 
 @njit
 def find_nearby_polygons(
     x: int,
     y: int,
     z: int,
-    grid: dict[tuple[int, int, int], IndexType],
-) -> set[int]:
-    """Find local polygons based on the BVH grid and location (x, y, z).
+    grid: VoxelGrid,
+) -> IndexType:
+    """Find local polygons based on the voxel grid and location (x, y, z).
 
     Looks at the current cell and adjacent cells.
+    If the grid was made with `neighborhood=True`, this is a single lookup
+    returning a view of the grid data (no allocation).
+    Otherwise, the polygons of 27 cells are merged into a new array.
 
     Args:
         x: cell index 0,
         y: cell index 1,
         z: cell index 2,
-        grid: dict with keys like (x, y, z) and arrays with polygon indices as values
+        grid: voxel grid (see `make_voxel_grid()`)
 
     Return:
-        set of polygon indices
+        array of unique polygon indices
     """
-    nearby_indices = set()
+    if grid.neighborhood:
+        return get_cell_polygons(grid, x, y, z)
+
+    nearby_indices = np.zeros(0, dtype=grid.cell_polys.dtype)
     for i in range(-1, 2, 1):
         for j in range(-1, 2, 1):
             for k in range(-1, 2, 1):
-                if (x + i, y + j, z + k) in grid:
-                    poly_indices = grid[(x + i, y + j, z + k)]
-                    for index in poly_indices:
-                        nearby_indices.add(index)
-    return nearby_indices
+                poly_indices = get_cell_polygons(grid, x + i, y + j, z + k)
+                nearby_indices = np.concatenate((nearby_indices, poly_indices))
+    return np.unique(nearby_indices)
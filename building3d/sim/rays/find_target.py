@@ -2,12 +2,15 @@ from numba import njit
 import numpy as np
 
 from building3d.config import GEOM_ATOL
-from building3d.geom.polygon.ispointinside import is_point_inside_projection
-from building3d.geom.polygon.distance import distance_point_to_polygon
+from building3d.geom.types import BoolDataType
 from building3d.geom.types import IndexType
 from building3d.geom.types import PointType
 from building3d.geom.types import VectorType
-from building3d.geom.vectors import normal
+
+from .scene import Scene
+from .scene import distance_point_to_scene_polygon
+from .scene import get_num_polygons
+from .scene import is_point_inside_scene_polygon
 
 
 @njit
@@ -15,63 +18,112 @@ def find_target_surface(
     # Ray position and direction
     pos: PointType,
     direction: VectorType,
-    # Polygon vertices and faces, each list element contains an array defining a polygon
-    poly_pts: list[PointType],
-    poly_tri: list[IndexType],
+    # Compiled scene (see `make_scene()`)
+    scene: Scene,
     # Which polygons to check and which to neglect
-    transparent_polygons: set[int],
-    polygons_to_check: set[int],
+    transparent: BoolDataType,
+    polygons_to_check: IndexType,
     atol: float = GEOM_ATOL,
 ) -> int:
     """Find the target surface for a ray at position `pos` going along `direction`.
 
     Transparent polygons are ignored.
-    The function checks only the polygons from the set `polygons_to_check`.
-
-    NOTE:
-        `transparent_polygons` and `polygons_to_check` cannot be empty sets if JIT is used.
-        `set([-1])` is a good substitute for an empty set.
+    The function checks only the polygons from the array `polygons_to_check`.
 
     Args:
         pos: The starting position of the ray.
         direction: The direction vector of the ray.
-        poly_pts: List of polygon vertices, where each element is an array defining a polygon.
-        poly_tri: List of polygon faces, corresponding to the poly_pts.
-        transparent_polygons: Set of indices for polygons to be considered transparent.
-        polygons_to_check: Set of indices for polygons to be checked for intersection.
+        scene: Compiled scene with the polygons (see `make_scene()`).
+        transparent: Boolean mask of transparent polygons, shape (num_polygons, ).
+        polygons_to_check: Array of indices for polygons to be checked for intersection.
 
     Returns:
         int: The index of the target surface (polygon) hit by the ray, or -1 if no surface is hit.
     """
-    # Key -> polygon number
-    # Value -> polygon distance to ray's position (pos)
-    target_candidates = {-1: np.inf}  # Initialize with dummy data for numba to know the types
+    min_dist = np.inf
     min_dist_index = -1
 
     for pn in polygons_to_check:
-        if pn in transparent_polygons:
+        if transparent[pn]:
             continue
 
-        if is_point_inside_projection(
-            pos, direction, poly_pts[pn], poly_tri[pn], fwd_only=True, atol=atol
-        ):
-            # Calculate polygon normal vector using the assumption that
-            # the first vector is convex
-            polygon_normal = normal(poly_pts[pn][-1], poly_pts[pn][0], poly_pts[pn][1])
+        a, b, c, d = scene.plane[pn]
+        denom = a * direction[0] + b * direction[1] + c * direction[2]
 
-            # Calculate how far the ray is from this polygon
-            dist = distance_point_to_polygon(pos, poly_pts[pn], poly_tri[pn], polygon_normal)
-            target_candidates[pn] = dist
+        if np.abs(denom) < atol:
+            # The ray is parallel to the polygon, check if it lies on its surface
+            ptest = pos
+        else:
+            s = (-d - a * pos[0] - b * pos[1] - c * pos[2]) / denom
+            if s < 0:
+                # The polygon is behind the ray
+                continue
+            ptest = pos + s * direction
 
-            if min_dist_index < 0:
-                # It is the first polygon that is being checked...
-                min_dist_index = pn
+        if is_point_inside_scene_polygon(ptest, scene, pn, atol=atol):
+            # Calculate how far the ray is from this polygon
+            dist = distance_point_to_scene_polygon(pos, scene, pn)
 
             # If it is the closest polygon so far -> remember it
-            if dist < target_candidates[min_dist_index]:
+            if min_dist_index < 0 or dist < min_dist:
+                min_dist = dist
                 min_dist_index = pn
 
-    if min_dist_index < 0:
-        return -1
-    else:
-        return min_dist_index
+    return min_dist_index
+
+
+@njit
+def find_next_hit(
+    # Ray position and velocity
+    pos: PointType,
+    velocity: VectorType,
+    # Compiled scene (see `make_scene()`)
+    scene: Scene,
+    # Which polygons to neglect
+    transparent: BoolDataType,
+    skip: int = -1,
+    atol: float = GEOM_ATOL,
+) -> tuple[int, float]:
+    """Find the first polygon hit by a ray and the time until the hit.
+
+    Unlike `find_target_surface()`, this function checks all polygons
+    and returns the exact time after which the ray reaches the target,
+    i.e. the hit point is `pos + t * velocity`.
+
+    Transparent polygons and the polygon `skip` (e.g. the one the ray has just been
+    reflected from) are ignored.
+
+    Args:
+        pos: The starting position of the ray.
+        velocity: The velocity vector of the ray.
+        scene: Compiled scene with the polygons (see `make_scene()`).
+        transparent: Boolean mask of transparent polygons, shape (num_polygons, ).
+        skip: Index of a polygon to be ignored, -1 if none.
+        atol: absolute tolerance
+
+    Returns:
+        tuple: (index of the target polygon, time to hit), or (-1, np.inf) if no polygon is hit.
+    """
+    min_t = np.inf
+    min_t_index = -1
+
+    for pn in range(get_num_polygons(scene)):
+        if pn == skip or transparent[pn]:
+            continue
+
+        a, b, c, d = scene.plane[pn]
+        denom = a * velocity[0] + b * velocity[1] + c * velocity[2]
+
+        if np.abs(denom) < atol:
+            # The ray is parallel to the polygon, so it can only graze it
+            continue
+
+        t = (-d - a * pos[0] - b * pos[1] - c * pos[2]) / denom
+        if t <= 0 or t >= min_t:
+            continue
+
+        if is_point_inside_scene_polygon(pos + t * velocity, scene, pn, atol=atol):
+            min_t = t
+            min_t_index = pn
+
+    return min_t_index, min_t
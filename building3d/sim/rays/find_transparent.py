@@ -21,22 +21,34 @@ This building script, a coding feat.
 """
 
 import logging
+from collections import Counter
+from weakref import WeakKeyDictionary
 
+import numpy as np
+from scipy.spatial import KDTree
+
+from building3d.config import GEOM_ATOL
+from building3d.config import GEOM_RTOL
 from building3d.geom.building import Building
-from building3d.geom.building.graph import graph_polygon
+from building3d.geom.building.graph import find_facing_polygons
 from building3d.geom.paths.split_path import split_path
+from building3d.geom.types import IndexType
+from building3d.geom.types import PointType
 
 logger = logging.getLogger(__name__)
 
 
 # Use cache to speed up finding transparent polygons for each ray within a building
-CACHE: dict[int, set[str]] = {}  # {id(building): set(transparent_polygon_paths)}
+# (weak keys, because the id of a deleted building can be reused by a new one)
+CACHE: WeakKeyDictionary[Building, set[str]] = WeakKeyDictionary()  # {building: set(paths)}
 
 
 def find_transparent(building: Building) -> set[str]:
     """Finds and returns the list of transparent polygons in the building.
 
     A polygon is transparent if it separates two adjacent solids within a single zone.
+    The facing polygons are found with a KD-tree of polygon centroids
+    (see `find_facing_polygons()`), so this is fast also for large models.
 
     Args:
         building: Building instance
@@ -45,39 +57,110 @@ def find_transparent(building: Building) -> set[str]:
         set of paths to polygons
     """
     logger.debug(f"Finding transparent polygons in {building.name}")
-    if id(building) in CACHE:
-        return CACHE[id(building)]
+    if building in CACHE:
+        return CACHE[building]
 
     else:
         # Find facing polygons (matching exactly)
-        logger.debug("Making graph")
-        graph = graph_polygon(building, facing=True, overlapping=False, touching=False)
-
-        transparent_polygons = []
-        added = set()
-
-        logger.debug("Iterating through the graph items")
-        for k, v in graph.items():
-            assert isinstance(v, list)
-            assert (
-                len(v) <= 1
-            ), f"Expected one facing polygon, but found more ({len(v)})"
-
-            if len(v) == 1:
-                if k not in added or v[0] not in added:
-                    _, z0, *_ = split_path(k)
-                    _, z1, *_ = split_path(v[0])
-
-                    # Doesn't have to check if plg0 is facing plg1,
-                    # because if they are in the graph, they must be
-                    if z0 == z1:
-                        logger.debug(f"Transparent polygons found: {k}, {v[0]}")
-                        transparent_polygons.extend([k, v[0]])
-                        added.add(k)
-                        added.add(v[0])
+        facing_pairs = find_facing_polygons(building)
+
+        num_facing = Counter(path for pair in facing_pairs for path in pair)
+        for path, num in num_facing.items():
+            assert num <= 1, f"Expected one facing polygon for {path}, but found more ({num})"
+
+        set_of_transparent_polygons = set()
+        for p0, p1 in facing_pairs:
+            _, z0, *_ = split_path(p0)
+            _, z1, *_ = split_path(p1)
+            if z0 == z1:
+                logger.debug(f"Transparent polygons found: {p0}, {p1}")
+                set_of_transparent_polygons.add(p0)
+                set_of_transparent_polygons.add(p1)
 
         # Add to CACHE
-        set_of_transparent_polygons = set(transparent_polygons)
-        CACHE[id(building)] = set_of_transparent_polygons
+        CACHE[building] = set_of_transparent_polygons
 
         return set_of_transparent_polygons
+
+
+def find_transparent_arrays(
+    points: PointType,
+    faces: IndexType,
+    polygons: IndexType,
+    walls: IndexType,
+    solids: IndexType,
+    zones: IndexType,
+) -> set[int]:
+    """Finds transparent polygons in a building given in the array format.
+
+    Works like `find_transparent()`, but doesn't need a `Building` instance.
+    Candidate pairs are found with a KD-tree of polygon centroids (weighted by triangle areas,
+    so they don't depend on the triangulation). A pair is facing if the polygons are
+    in the same zone, have opposite normals, the same points and the same area.
+
+    Args:
+        points, faces, polygons, walls, solids, zones: building in the array format
+            (see `to_array_format()`)
+
+    Returns:
+        set of polygon numbers
+    """
+    num_polys = walls.shape[0]
+    logger.debug(f"Finding transparent polygons among {num_polys} polygons")
+
+    tri_pts = points[faces]
+    cross = np.cross(tri_pts[:, 1] - tri_pts[:, 0], tri_pts[:, 2] - tri_pts[:, 0])
+    tri_area = np.linalg.norm(cross, axis=1) / 2.0
+    poly_area = np.bincount(polygons, weights=tri_area, minlength=num_polys)
+
+    valid = np.flatnonzero(poly_area > 0)
+    if valid.shape[0] < 2:
+        return set()
+
+    tri_ctr = tri_pts.mean(axis=1)
+    centroids = np.stack(
+        [
+            np.bincount(polygons, weights=tri_area * tri_ctr[:, k], minlength=num_polys)
+            for k in range(3)
+        ],
+        axis=1,
+    )
+    centroids = centroids[valid] / poly_area[valid, np.newaxis]
+
+    # Normals are sums of the cross products of all triangles
+    poly_vn = np.stack(
+        [np.bincount(polygons, weights=cross[:, k], minlength=num_polys) for k in range(3)],
+        axis=1,
+    )
+    poly_vn[valid] /= np.linalg.norm(poly_vn[valid], axis=1)[:, np.newaxis]
+
+    radius = GEOM_RTOL * max(np.ptp(centroids, axis=0).max(), 1.0)
+    candidates = valid[KDTree(centroids).query_pairs(radius, output_type="ndarray")]
+
+    # Only polygons within a single zone are transparent
+    poly_zone = zones[solids[walls]]
+    candidates = candidates[poly_zone[candidates[:, 0]] == poly_zone[candidates[:, 1]]]
+    logger.debug(f"Number of candidate polygon pairs = {len(candidates)}")
+
+    # Faces are sorted by polygons
+    face_offset = np.zeros(num_polys + 1, dtype=np.int64)
+    face_offset[1:] = np.cumsum(np.bincount(polygons, minlength=num_polys))
+
+    transparent = set()
+    for i, j in candidates.tolist():
+        if not np.allclose(poly_vn[i], -poly_vn[j], rtol=GEOM_RTOL):
+            continue
+        if not np.isclose(poly_area[i], poly_area[j]):
+            continue
+
+        pts_i = points[np.unique(faces[face_offset[i] : face_offset[i + 1]])]
+        pts_j = points[np.unique(faces[face_offset[j] : face_offset[j + 1]])]
+        if pts_i.shape != pts_j.shape:
+            continue
+        matching = np.isclose(pts_i[:, np.newaxis], pts_j[np.newaxis], atol=GEOM_ATOL).all(axis=2)
+        if matching.any(axis=0).all() and matching.any(axis=1).all():
+            logger.debug(f"Transparent polygons found: {i}, {j}")
+            transparent.add(i)
+            transparent.add(j)
+
+    return transparent
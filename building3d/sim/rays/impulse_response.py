@@ -1,6 +1,7 @@
 import numpy as np
 import pandas as pd
 
+from building3d.geom.types import FLOAT
 from building3d.geom.types import FloatDataType
 from building3d.sim.rays.simulation_config import SimulationConfig
 
@@ -16,13 +17,14 @@ def impulse_response(hit_buf: FloatDataType, sim_cfg: SimulationConfig) -> pd.Da
     Args:
         hit_buf: Array of shape (num_timesteps, num_absorbers) containing the
             cumulative number of ray hits for each absorber over time.
+            It can be memory-mapped (see `open_buffers()`).
         sim_cfg: Simulation configuration object containing time step information.
 
     Returns:
         DataFrame with time index and one column per absorber containing the
         normalized impulse response values.
     """
-    hit_inst = hit_buf.copy()
+    hit_inst = np.array(hit_buf, dtype=FLOAT)
 
     num_steps = hit_inst.shape[0]
     num_absorbers = hit_inst.shape[1]
@@ -24,6 +24,9 @@ def make_movie_from_buffer(
 ):
     """Generate movie from position and energy buffers.
 
+    Only a few steps (the ray trail) are accessed for each frame,
+    so the buffers can be memory-mapped arrays larger than memory (see `open_buffers()`).
+
     Args:
         output_file: path to the output file.
         building: Building instance.
@@ -111,7 +114,7 @@ def make_movie_from_buffer(
             # Draw trailing lines
             line_varr, line_index = position_buffer_to_lines(position)
             line_mesh = pv.PolyData(line_varr, lines=line_index)
-            line_mesh["energy"] = energy.flatten()
+            line_mesh["energy"] = energy.T.ravel()
             line_mesh.set_active_scalars("energy")
             plotter.add_mesh(
                 line_mesh,
@@ -132,7 +135,7 @@ def make_movie_from_buffer(
             line_varr, line_index = position_buffer_to_lines(position)
             line_mesh.points = line_varr
             line_mesh.lines = line_index
-            line_mesh["energy"] = energy.flatten()
+            line_mesh["energy"] = energy.T.ravel()
 
             plotter.write_frame()
 
@@ -140,7 +143,7 @@ def make_movie_from_buffer(
     logger.info(f"Movie saved: {output_file}")
 
 
-def position_buffer_to_lines(pb: np.ndarray) -> tuple[np.ndarray, list[int]]:
+def position_buffer_to_lines(pb: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
     """Convert position buffer array to the format required by PyVista Plotter.
 
     The required format is as follows:
@@ -149,22 +152,17 @@ def position_buffer_to_lines(pb: np.ndarray) -> tuple[np.ndarray, list[int]]:
       followed by the point indices. For example, the two line segments [0, 1] and [1, 2, 3, 4]
       will be represented as [2, 0, 1, 4, 1, 2, 3, 4].
 
+    Points are ordered by ray, then by step (i.e. like `pb.transpose(1, 0, 2)`).
+
     Args:
-        pb: position buffer returned by DumpReader
+        pb: position buffer, shaped (num_steps, num_rays, 3)
 
     Return:
         line points, line connectivity
     """
-    num_rays = pb.shape[1]
-    buf_len = pb.shape[0]
-    line_varr = []
-    line_index = []
-    curr_index = 0
-    for ray_i in range(num_rays):
-        line_index.append(buf_len)
-        for buf_i in range(buf_len):
-            line_varr.append(pb[buf_i, ray_i, :])
-            line_index.append(curr_index)
-            curr_index += 1
-    line_varr = np.array(line_varr)
-    return line_varr, line_index
+    buf_len, num_rays, _ = pb.shape
+    line_varr = np.ascontiguousarray(pb.transpose(1, 0, 2)).reshape(-1, 3)
+    line_index = np.empty((num_rays, buf_len + 1), dtype=np.int64)
+    line_index[:, 0] = buf_len
+    line_index[:, 1:] = np.arange(num_rays * buf_len).reshape(num_rays, buf_len)
+    return line_varr, line_index.ravel()
@@ -8,7 +8,11 @@ from building3d.geom.types import PointType
 
 
 class RayBuffPlotter:
-    """Class with methods for plotting the rays as points and lines based on the ray buffer."""
+    """Class with methods for plotting the rays as points and lines based on the ray buffer.
+
+    The buffers may be memory-mapped (see `open_buffers()`). They are read only when plotting,
+    so to plot a part of a large run, pass sliced views, e.g. `pos_buf[-100:, :500]`.
+    """
 
     def __init__(self, building: Building, pos_buf: PointType, enr_buf: FloatDataType):
         self.building = building
@@ -22,17 +26,10 @@ class RayBuffPlotter:
         plot_objects((self.building, self), colors=colors)
 
     def get_points(self):
-        return self.pos_buf[-1, :, :]
+        return np.array(self.pos_buf[-1, :, :], dtype=FLOAT)
 
     def get_lines(self):
-        line_len = self.pos_buf.shape[0]
-        num_rays = self.pos_buf.shape[1]
-        verts = []
-        lines = []
-        curr_index = 0
-        for rn in range(num_rays):
-            verts.extend(self.pos_buf[:, rn, :])
-            lines.append([curr_index + i for i in range(line_len)])
-            curr_index += line_len
-
-        return np.vstack(verts, dtype=FLOAT), np.vstack(lines)
+        line_len, num_rays, _ = self.pos_buf.shape
+        verts = np.ascontiguousarray(self.pos_buf.transpose(1, 0, 2), dtype=FLOAT).reshape(-1, 3)
+        lines = np.arange(num_rays * line_len).reshape(num_rays, line_len)
+        return verts, lines
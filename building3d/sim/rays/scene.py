@@ -0,0 +1,231 @@
+"""Compiled scene: a flat (CSR-like) representation of polygons used in the JIT-compiled kernels.
+
+The scene is a named tuple of arrays:
+- pt_offset:   offsets of polygon points in `pts`, shape `(num_polygons + 1, )`
+- pts:         contiguous array of polygon points, shape `(num_points, 3)`
+- tri_offset:  offsets of polygon triangles in `tri`, shape `(num_polygons + 1, )`
+- tri:         contiguous array of triangles, shape `(num_faces, 3)`,
+               the indices are local, i.e. relative to the points of a given polygon
+- plane:       plane coefficients (a, b, c, d) of each polygon, shape `(num_polygons, 4)`
+- vn:          unit normal vector of each polygon, shape `(num_polygons, 3)`
+- bbox:        bounding box (min, max) of each polygon, shape `(num_polygons, 2, 3)`
+- edges:       edge vectors `pts[i + 1] - pts[i]` (the last edge closes the polygon),
+               shape `(num_points, 3)`, i.e. edges share the offsets with points
+- edge_sq_len: squared lengths of the edges, shape `(num_points, )`
+
+Points and triangles of the polygon `pn` are:
+`pts[pt_offset[pn]:pt_offset[pn + 1]]` and `tri[tri_offset[pn]:tri_offset[pn + 1]]`.
+The slices are views, so accessing a polygon does not copy any data.
+
+All geometric properties which do not change during a simulation are calculated once,
+so that the innermost loops of the ray tracer do not repeat
+cross products and min/max reductions for each ray and step.
+"""
+from typing import NamedTuple
+
+import numpy as np
+from numba import njit
+
+from building3d.config import GEOM_ATOL
+from building3d.geom.polygon.plane import plane_coefficients
+from building3d.geom.triangles import is_point_inside_triangles
+from building3d.geom.types import FLOAT
+from building3d.geom.types import INT
+from building3d.geom.types import FloatDataType
+from building3d.geom.types import IndexType
+from building3d.geom.types import PointType
+from building3d.geom.types import VectorType
+from building3d.geom.vectors import normal
+
+
+class Scene(NamedTuple):
+    pt_offset: IndexType
+    pts: PointType
+    tri_offset: IndexType
+    tri: IndexType
+    plane: FloatDataType
+    vn: VectorType
+    bbox: PointType
+    edges: VectorType
+    edge_sq_len: FloatDataType
+
+
+@njit
+def make_scene(
+    points: PointType,
+    faces: IndexType,
+    polygons: IndexType,
+    num_polys: int,
+) -> Scene:
+    """Makes a compiled scene from the array format (see `to_array_format()`).
+
+    The points of each polygon are kept in the same order as in the array format,
+    so that the normal vectors are the same as in the `Polygon` instances.
+
+    Args:
+        points: array of points, shape `(num_points, 3)`
+        faces: array mapping points to faces, shape `(num_faces, 3)`
+        polygons: array mapping faces to polygons, shape `(num_faces, )`
+        num_polys: number of polygons
+
+    Returns:
+        Scene
+    """
+    num_faces = faces.shape[0]
+
+    # Count faces of each polygon and sort faces by polygon
+    tri_offset = np.zeros(num_polys + 1, dtype=INT)
+    for fi in range(num_faces):
+        tri_offset[polygons[fi] + 1] += 1
+    tri_offset = np.cumsum(tri_offset).astype(INT)
+    face_order = np.argsort(polygons, kind="mergesort")
+
+    # Count points of each polygon
+    pt_offset = np.zeros(num_polys + 1, dtype=INT)
+    for pn in range(num_polys):
+        poly_faces = faces[face_order[tri_offset[pn]:tri_offset[pn + 1]]]
+        pt_offset[pn + 1] = pt_offset[pn] + np.unique(poly_faces).size
+
+    # Fill the arrays
+    num_pts = pt_offset[-1]
+    pts = np.zeros((num_pts, 3), dtype=FLOAT)
+    tri = np.zeros((num_faces, 3), dtype=INT)
+    plane = np.zeros((num_polys, 4), dtype=FLOAT)
+    vn = np.zeros((num_polys, 3), dtype=FLOAT)
+    bbox = np.zeros((num_polys, 2, 3), dtype=FLOAT)
+    edges = np.zeros((num_pts, 3), dtype=FLOAT)
+    edge_sq_len = np.zeros(num_pts, dtype=FLOAT)
+
+    for pn in range(num_polys):
+        poly_faces = faces[face_order[tri_offset[pn]:tri_offset[pn + 1]]]
+        pt_index = np.unique(poly_faces)
+
+        poly_pts = pts[pt_offset[pn]:pt_offset[pn + 1]]
+        for i in range(pt_index.size):
+            poly_pts[i] = points[pt_index[i]]
+
+        # Map global point indices to the local ones
+        for i in range(poly_faces.shape[0]):
+            for j in range(3):
+                tri[tri_offset[pn] + i, j] = np.searchsorted(pt_index, poly_faces[i, j])
+
+        a, b, c, d = plane_coefficients(poly_pts)
+        plane[pn, 0] = a
+        plane[pn, 1] = b
+        plane[pn, 2] = c
+        plane[pn, 3] = d
+        vn[pn] = normal(poly_pts[-1], poly_pts[0], poly_pts[1])
+
+        for k in range(3):
+            bbox[pn, 0, k] = poly_pts[:, k].min()
+            bbox[pn, 1, k] = poly_pts[:, k].max()
+
+        num_poly_pts = poly_pts.shape[0]
+        for i in range(num_poly_pts):
+            ei = pt_offset[pn] + i
+            edges[ei] = poly_pts[(i + 1) % num_poly_pts] - poly_pts[i]
+            edge_sq_len[ei] = np.dot(edges[ei], edges[ei])
+
+    return Scene(pt_offset, pts, tri_offset, tri, plane, vn, bbox, edges, edge_sq_len)
+
+
+@njit
+def get_scene_polygon(scene: Scene, pn: int) -> tuple[PointType, IndexType]:
+    """Returns points and triangles (views) of the polygon `pn`."""
+    return (
+        scene.pts[scene.pt_offset[pn]:scene.pt_offset[pn + 1]],
+        scene.tri[scene.tri_offset[pn]:scene.tri_offset[pn + 1]],
+    )
+
+
+@njit
+def get_num_polygons(scene: Scene) -> int:
+    """Returns the number of polygons in the scene."""
+    return scene.pt_offset.size - 1
+
+
+@njit
+def signed_distance_to_plane(ptest: PointType, scene: Scene, pn: int) -> float:
+    """Returns the signed distance from the point to the plane of the polygon `pn`.
+
+    Positive distance means that the point is in front of the polygon.
+    """
+    a, b, c, d = scene.plane[pn]
+    return a * ptest[0] + b * ptest[1] + c * ptest[2] + d
+
+
+@njit
+def is_point_inside_scene_triangles(
+    ptest: PointType,
+    scene: Scene,
+    pn: int,
+    atol: float = GEOM_ATOL,
+) -> bool:
+    """Checks whether a point laying on the polygon's plane is inside any of its triangles.
+
+    Points closer than `atol` to the edges of a triangle are assumed to be inside.
+    The point is not tested for coplanarity with the polygon.
+    """
+    pts, tri = get_scene_polygon(scene, pn)
+    return is_point_inside_triangles(ptest, pts, tri, scene.vn[pn], atol)
+
+
+@njit
+def is_point_inside_scene_polygon(
+    ptest: PointType,
+    scene: Scene,
+    pn: int,
+    atol: float = GEOM_ATOL,
+) -> bool:
+    """Checks whether a point lies on the surface of the polygon `pn`.
+
+    Equivalent to `is_point_inside()` (with the boundary included), but uses
+    the cached bounding box, plane and normal vector of the polygon.
+    """
+    bbox = scene.bbox[pn]
+    for k in range(3):
+        if ptest[k] < bbox[0, k] - atol or ptest[k] > bbox[1, k] + atol:
+            return False
+
+    if np.abs(signed_distance_to_plane(ptest, scene, pn)) >= atol:
+        return False
+
+    return is_point_inside_scene_triangles(ptest, scene, pn, atol)
+
+
+@njit
+def distance_point_to_scene_polygon(ptest: PointType, scene: Scene, pn: int) -> float:
+    """Return distance of point to the polygon `pn`.
+
+    Equivalent to `distance_point_to_polygon()`, but uses the cached plane and edge data.
+    For points not laying inside the orthogonal projection, the distance is calculated
+    as the distance to the closest edge.
+    """
+    dist = signed_distance_to_plane(ptest, scene, pn)
+    vn = scene.vn[pn]
+    proj = ptest - dist * vn
+
+    if is_point_inside_scene_triangles(proj, scene, pn):
+        return np.abs(dist)
+
+    # Return distance to the closest edge
+    min_sq_dist = np.inf
+    for ei in range(scene.pt_offset[pn], scene.pt_offset[pn + 1]):
+        pt1 = scene.pts[ei]
+        edge = scene.edges[ei]
+        vx = ptest[0] - pt1[0]
+        vy = ptest[1] - pt1[1]
+        vz = ptest[2] - pt1[2]
+        t = (vx * edge[0] + vy * edge[1] + vz * edge[2]) / scene.edge_sq_len[ei]
+        if t < 0.0:
+            t = 0.0
+        elif t > 1.0:
+            t = 1.0
+        dx = vx - t * edge[0]
+        dy = vy - t * edge[1]
+        dz = vz - t * edge[2]
+        sq_dist = dx * dx + dy * dy + dz * dz
+        if sq_dist < min_sq_dist:
+            min_sq_dist = sq_dist
+
+    return float(np.sqrt(min_sq_dist))
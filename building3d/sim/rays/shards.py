@@ -0,0 +1,209 @@
+"""Running a simulation in independent shards of rays.
+
+Rays don't interact with each other, so a simulation can be split into shards,
+each with a part of the rays. Every shard is a separate `Simulation` with its own seed
+`(seed, shard)` and its own buffer directory (`shard_<n>` inside the buffer directory).
+The results don't depend on where and in which order the shards are run:
+- in one process (`run_shards(..., num_workers=1)`),
+- in a process pool (`run_shards()`),
+- or as separate commands, e.g. on many machines sharing a file system:
+
+    python -m building3d.sim.rays.shards config.pkl --shard 0 --num-shards 8
+    ...
+    python -m building3d.sim.rays.shards config.pkl --shard 7 --num-shards 8
+    python -m building3d.sim.rays.shards config.pkl --merge --num-shards 8
+
+  where `config.pkl` is a pickled `SimulationConfig` (including the building).
+
+The absorber hits of all shards are summed into one hit buffer by `merge_shards()`,
+which can be converted to an impulse response with `impulse_response()`.
+Since the seeds and the summation order are fixed, re-running a sharded simulation
+gives bit-identical hits.
+"""
+import argparse
+import copy
+import logging
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+from building3d.geom.types import FLOAT
+from building3d.geom.types import FloatDataType
+
+from .simulation import Simulation
+from .simulation_config import SimulationConfig
+
+logger = logging.getLogger(__name__)
+
+
+def get_shard_rays(num_rays: int, shard: int, num_shards: int) -> int:
+    """Returns the number of rays in a shard (the first `num_rays % num_shards` get one more)."""
+    if not 0 <= shard < num_shards:
+        raise ValueError(f"Shard {shard} out of range (num_shards={num_shards})")
+    return num_rays // num_shards + int(shard < num_rays % num_shards)
+
+
+def get_shard_dir(buffer_dir: str, shard: int) -> str:
+    """Returns the buffer directory of a shard."""
+    return os.path.join(buffer_dir, f"shard_{shard}")
+
+
+def get_shard_config(sim_cfg: SimulationConfig, shard: int, num_shards: int) -> SimulationConfig:
+    """Returns the simulation configuration of a shard.
+
+    The shard gets its part of the rays, its own buffer directory and the seed `(seed, shard)`.
+    The building and the remaining parameters are shared with `sim_cfg`.
+
+    Raises:
+        ValueError: if the seed is not set or if there are more shards than rays
+    """
+    seed = sim_cfg.rays["seed"]
+    if seed is None:
+        raise ValueError("A seed is needed to run the shards reproducibly (sim_cfg.rays['seed'])")
+    if num_shards > sim_cfg.rays["num_rays"]:
+        raise ValueError(f"More shards ({num_shards}) than rays ({sim_cfg.rays['num_rays']})")
+
+    shard_cfg = copy.copy(sim_cfg)
+    shard_cfg.rays = dict(sim_cfg.rays)
+    shard_cfg.paths = dict(sim_cfg.paths)
+
+    seed = list(seed) if np.iterable(seed) else [seed]
+    shard_cfg.rays["seed"] = seed + [shard]
+    shard_cfg.rays["num_rays"] = get_shard_rays(sim_cfg.rays["num_rays"], shard, num_shards)
+    shard_cfg.paths["buffer_dir"] = get_shard_dir(sim_cfg.paths["buffer_dir"], shard)
+
+    return shard_cfg
+
+
+def run_shard(
+    sim_cfg: SimulationConfig,
+    shard: int,
+    num_shards: int,
+    resume: bool = False,
+) -> str:
+    """Runs the simulation of one shard and saves its buffers.
+
+    Args:
+        sim_cfg: configuration of the whole simulation (including the building)
+        shard: shard number
+        num_shards: total number of shards
+        resume: if True, the shard continues from its last checkpoint (see `Simulation`)
+
+    Returns:
+        buffer directory of the shard
+    """
+    shard_cfg = get_shard_config(sim_cfg, shard, num_shards)
+    logger.info(f"Running shard {shard}/{num_shards} ({shard_cfg.rays['num_rays']} rays)")
+
+    sim = Simulation(shard_cfg.building, shard_cfg, resume=resume)
+    sim.run()
+
+    return shard_cfg.paths["buffer_dir"]
+
+
+def run_shards(
+    sim_cfg: SimulationConfig,
+    num_shards: int,
+    num_workers: int | None = None,
+    resume: bool = False,
+) -> FloatDataType:
+    """Runs all shards of the simulation and merges their absorber hits.
+
+    The shards are run in a pool of `num_workers` processes (default: number of CPUs).
+    The processes are spawned (not forked), because the threads of Numba
+    can't be safely forked. Note that each process compiles the JIT functions.
+    If `num_workers` is 1, the shards are run one by one in the current process.
+
+    Args:
+        sim_cfg: configuration of the whole simulation (including the building)
+        num_shards: number of shards
+        num_workers: number of processes
+        resume: if True, the shards continue from their last checkpoints
+            (finished shards are not simulated again)
+
+    Returns:
+        merged hit buffer, shaped (num_steps + 1, num_absorbers)
+    """
+    if num_workers == 1:
+        for shard in range(num_shards):
+            run_shard(sim_cfg, shard, num_shards, resume)
+    else:
+        with ProcessPoolExecutor(num_workers, mp_context=get_context("spawn")) as executor:
+            futures = [
+                executor.submit(run_shard, sim_cfg, shard, num_shards, resume)
+                for shard in range(num_shards)
+            ]
+            for future in futures:
+                future.result()
+
+    return merge_shards(sim_cfg, num_shards)
+
+
+def merge_shards(sim_cfg: SimulationConfig, num_shards: int) -> FloatDataType:
+    """Sums the absorber hits of all shards.
+
+    The hits are added in the order of shards, so the result doesn't depend
+    on how the shards were run. The merged buffer is also saved to the hits file
+    in the buffer directory (next to the shard directories).
+
+    Args:
+        sim_cfg: configuration of the whole simulation
+        num_shards: number of shards
+
+    Returns:
+        merged hit buffer, shaped (num_steps + 1, num_absorbers)
+
+    Raises:
+        RuntimeError: if the hits of any shard are missing or have a different shape
+    """
+    buffer_dir = sim_cfg.paths["buffer_dir"]
+    hits_file = sim_cfg.paths["hits_file"]
+
+    hit_buf = None
+    for shard in range(num_shards):
+        path = os.path.join(get_shard_dir(buffer_dir, shard), hits_file)
+        if not os.path.exists(path):
+            raise RuntimeError(f"Hits of shard {shard} not found: {path}")
+
+        shard_hits = np.load(path, mmap_mode="r")
+        if hit_buf is None:
+            hit_buf = np.zeros(shard_hits.shape, dtype=FLOAT)
+        elif shard_hits.shape != hit_buf.shape:
+            raise RuntimeError(
+                f"Hits of shard {shard} shaped {shard_hits.shape}, expected {hit_buf.shape}"
+            )
+        hit_buf += shard_hits
+
+    assert hit_buf is not None, "No shards to merge"
+    np.save(os.path.join(buffer_dir, hits_file), hit_buf)
+    logger.info(f"Merged hits of {num_shards} shards saved to {buffer_dir}")
+
+    return hit_buf
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Runs or merges shards of a simulation from the command line."""
+    parser = argparse.ArgumentParser(description="Run a shard of a ray simulation")
+    parser.add_argument("config", help="pickled SimulationConfig")
+    parser.add_argument("--num-shards", type=int, required=True, help="total number of shards")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--shard", type=int, help="shard to run")
+    group.add_argument("--merge", action="store_true", help="merge the hits of all shards")
+    parser.add_argument("--resume", action="store_true", help="continue from the last checkpoint")
+    args = parser.parse_args(argv)
+
+    with open(args.config, "rb") as f:
+        sim_cfg = pickle.load(f)
+
+    if args.merge:
+        merge_shards(sim_cfg, args.num_shards)
+    else:
+        run_shard(sim_cfg, args.shard, args.num_shards, args.resume)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -1,18 +1,34 @@
 import logging
 import os
+from typing import Sequence
 
 import numpy as np
 
 from building3d.geom.building import Building
 from building3d.geom.polygon import Polygon
 from building3d.geom.types import PointType, FloatDataType, FLOAT
+from building3d.geom.types import INT
+from building3d.geom.types import IndexType
 from building3d.io.arrayformat import to_array_format
-from building3d.io.arrayformat import get_polygon_points_and_faces
 
+from .bvh import BVH
+from .bvh import make_bvh
+from .checkpoint import Checkpoint
+from .checkpoint import get_config_hash
+from .checkpoint import load_checkpoint
+from .checkpoint import save_checkpoint
 from .dump_buffers import dump_buffers
+from .event_loop import event_loop
 from .find_transparent import find_transparent
+from .find_transparent import find_transparent_arrays
+from .scene import make_scene
 from .simulation_loop import simulation_loop
 from .simulation_config import SimulationConfig
+from .voxel_grid import VoxelGrid
+from .voxel_grid import average_polygons_per_cell
+from .voxel_grid import get_grid_nbytes
+from .voxel_grid import get_num_voxels
+from .voxel_grid import make_point_grid
 from .voxel_grid import make_voxel_grid
 
 logger = logging.getLogger(__name__)
@@ -22,18 +38,36 @@ class Simulation:
 
     def __init__(
         self,
-        building: Building,
+        building: Building | tuple,
         sim_cfg: SimulationConfig,
+        resume: bool = False,
     ):
+        """Prepares the simulation.
+
+        Args:
+            building: simulated building or its array format (see `to_array_format()`),
+                e.g. read directly from a mesh file with `read_stl_array_format()`
+            sim_cfg: simulation configuration
+            resume: if True, the simulation continues from the checkpoint in the buffer
+                directory (if there is one) and the buffers are extended.
+                Otherwise, the buffer directory must be empty.
+        """
         # REPRESENT GEOMETRY IN A NUMBA-FRIENDLY WAY ==========================
         # Convert building to the array format
-        logger.info("Converting the building to the array format")
-        points, faces, polygons, walls, _, _ = to_array_format(building)
+        if isinstance(building, Building):
+            logger.info("Converting the building to the array format")
+            points, faces, polygons, walls, solids, zones = to_array_format(building)
+        else:
+            points, faces, polygons, walls, solids, zones = building
         self.points = points
         self.faces = faces
         self.polygons = polygons
         self.walls = walls
 
+        # Compile the scene (flat arrays with polygon points, triangles, planes, normals)
+        logger.info("Compiling the scene")
+        self.scene = make_scene(points, faces, polygons, len(walls))
+
         # READ CONFIGURATION ==================================================
         self.sim_cfg = sim_cfg
 
@@ -43,13 +77,22 @@ class Simulation:
         # Paths
         self.project_dir: str = sim_cfg.paths["project_dir"]
         self.buffer_dir: str = sim_cfg.paths["buffer_dir"]
+        self.checkpoint_path: str = os.path.join(
+            self.buffer_dir, sim_cfg.paths["checkpoint_file"]
+        )
+        self.resume = resume
 
         # Engine parameters
+        self.mode: str = sim_cfg.engine["mode"]
+        self.accel: str = sim_cfg.engine["accel"]
         self.num_steps: int = sim_cfg.engine["num_steps"]
         self.time_step: float = sim_cfg.engine["time_step"]
         self.batch_size: int = sim_cfg.engine["batch_size"]
         self.voxel_size: float = sim_cfg.engine["voxel_size"]
+        self.sparse_voxels: bool = sim_cfg.engine["sparse_voxels"]
         self.search_transparent: bool = sim_cfg.engine["search_transparent"]
+        self.record_every: int = sim_cfg.engine["record_every"]
+        self.checkpoint_every: int = sim_cfg.engine["checkpoint_every"]
 
         # Ray parameters
         self.num_rays: int = sim_cfg.rays["num_rays"]
@@ -57,6 +100,10 @@ class Simulation:
         self.source: PointType = np.array(sim_cfg.rays["source"], dtype=FLOAT)
         self.absorbers: PointType = np.array(sim_cfg.rays["absorbers"], dtype=FLOAT)
         self.absorber_radius: float = sim_cfg.rays["absorber_radius"]
+        self.seed: int | Sequence[int] | None = sim_cfg.rays["seed"]
+        self.record_rays: IndexType = self.get_record_rays(
+            sim_cfg.engine["record_rays"], self.num_rays
+        )
 
         # Surface parameters
         default_absorption = sim_cfg.surfaces["absorption"]["default"]
@@ -76,11 +123,28 @@ class Simulation:
         # FIND TRANSPARENT POLYGONS ===========================================
         self.trans_poly_nums = set([-1])  # JIT function can't get an empty set
         if self.search_transparent:
-            self.trans_poly_nums = self.get_transparent_polygon_numbers(building)
+            if isinstance(building, Building):
+                self.trans_poly_nums = self.get_transparent_polygon_numbers(building)
+            else:
+                logger.info("Finding transparent surfaces")
+                self.trans_poly_nums |= find_transparent_arrays(
+                    points, faces, polygons, walls, solids, zones
+                )
+
+        # Boolean mask used in the JIT-compiled code (cheaper to check than a set)
+        self.transparent = np.zeros(len(self.walls), dtype=np.bool_)
+        for pn in self.trans_poly_nums:
+            if pn >= 0:
+                self.transparent[pn] = True
 
         # Sanitizers ==========================================================
+        assert self.mode in ("step", "event"), f"Unknown engine mode: {self.mode}"
+        assert self.accel in ("voxel", "bvh"), f"Unknown acceleration structure: {self.accel}"
         assert self.num_steps >= self.batch_size, "num_steps can't smaller than batch_size"
         assert self.num_steps % self.batch_size == 0, "num_steps must be a multiple of batch_size"
+        assert (
+            self.batch_size % self.record_every == 0
+        ), "batch_size must be a multiple of record_every"
 
         # Prepare project directory ===========================================
         self.make_dirs()
@@ -90,21 +154,42 @@ class Simulation:
         if not os.path.exists(self.project_dir):
             os.makedirs(self.project_dir)
         # Create buffer (state) directory, but raise error if it exists and is not empty
-        # because that's a commmon source of errors when some states are overwritten
+        # because that's a commmon source of errors when some states are overwritten.
+        # A non-empty directory is fine if the simulation is resumed from its checkpoint.
         if os.path.exists(self.buffer_dir) and len(os.listdir(self.buffer_dir)) > 0:
-            raise RuntimeError(f"Buffer dir ({self.buffer_dir}) already exists and is non-empty!")
+            if not (self.resume and os.path.exists(self.checkpoint_path)):
+                raise RuntimeError(
+                    f"Buffer dir ({self.buffer_dir}) already exists and is non-empty!"
+                )
         else:
-            os.makedirs(self.buffer_dir)
+            os.makedirs(self.buffer_dir, exist_ok=True)
+
+    @staticmethod
+    def get_record_rays(record_rays: str | int, num_rays: int) -> IndexType:
+        """Returns indices of rays whose positions and energy are stored in the buffers.
+
+        Args:
+            record_rays: "all", "none" or the number of rays to sample
+            num_rays: total number of rays
+
+        Returns:
+            sorted array of ray indices
+        """
+        if record_rays == "all":
+            return np.arange(num_rays, dtype=INT)
+        elif record_rays == "none":
+            return np.zeros(0, dtype=INT)
+        elif isinstance(record_rays, int) and 0 <= record_rays <= num_rays:
+            # Initial directions are random, so evenly spaced indices are a random sample
+            return np.unique(np.linspace(0, num_rays - 1, record_rays).round().astype(INT))
+        else:
+            raise ValueError(f"Incorrect number of recorded rays: {record_rays}")
 
     @staticmethod
     def get_transparent_polygon_numbers(building):
         # Get transparent polygons
         logger.info("Finding transparent surfaces")
-        # TODO: Very slow if many polygons
-        # Complexity:
-        # - worst case scenario -> O(n^2),
-        # - best case scenario -> O(n),
-        # where n is the number of polygons.
+        # Complexity O(n log n), where n is the number of polygons (see `find_facing_polygons()`)
         trans_poly_paths = find_transparent(building)
 
         # Can't have an empty set because of Numba. Polygon -1 doesn't exist anyway.
@@ -117,26 +202,12 @@ class Simulation:
 
         return trans_poly_nums
 
-    def run(self):
-        logger.info("Starting the simulation")
-
-        # Get initial position of rays
-        position = np.zeros((self.num_rays, 3), dtype=FLOAT)
-        for i in range(self.num_rays):
-            position[i, :] = self.source
-
-        # Get initial velocity of rays
-        init_direction = np.random.rand(self.num_rays, 3) * 2.0 - 1.0
-        for i in range(self.num_rays):
-            init_direction[i] /= np.linalg.norm(init_direction[i])
-        velocity = init_direction * self.ray_speed
-
-        # Get initial energy and hits
-        energy = np.ones(self.num_rays, dtype=FLOAT)
-        num_absorbers = self.absorbers.shape[0]
-        hits = np.zeros(num_absorbers, dtype=FLOAT)
+    def make_grid(self) -> VoxelGrid:
+        """Makes a voxel grid used in the step mode to find nearby polygons.
 
-        # Make voxel grid
+        Each cell of the grid contains the polygons of its 27-cell neighborhood,
+        so that nearby polygons can be found with a single lookup.
+        """
         min_x = self.points[:, 0].min()
         min_y = self.points[:, 1].min()
         min_z = self.points[:, 2].min()
@@ -144,66 +215,194 @@ class Simulation:
         max_y = self.points[:, 1].max()
         max_z = self.points[:, 2].max()
 
-        poly_pts = []
-        poly_tri = []
-        num_polys = len(self.walls)
-        for pn in range(num_polys):
-            pts, tri = get_polygon_points_and_faces(self.points, self.faces, self.polygons, pn)
-            poly_pts.append(pts)
-            poly_tri.append(tri)
-
         grid = make_voxel_grid(
             min_xyz=(min_x, min_y, min_z),
             max_xyz=(max_x, max_y, max_z),
-            poly_pts=poly_pts,
+            scene=self.scene,
             step=self.voxel_size,
+            neighborhood=True,
+            sparse=self.sparse_voxels,
             verbose=self.verbose,
         )
+        nbytes = get_grid_nbytes(grid)
+        logger.info(
+            f"Voxel grid: {grid.shape} cells, "
+            f"{average_polygons_per_cell(grid):.2f} polygons per cell (incl. neighbors), "
+            f"{nbytes / 2**20:.1f} MiB ({nbytes / get_num_voxels(grid):.1f} bytes per cell)"
+        )
+        return grid
+
+    def make_buffers(self) -> tuple[PointType, FloatDataType, FloatDataType]:
+        """Allocates the buffers filled by the simulation loop in each batch.
+
+        Returns:
+            (pos_buf, enr_buf, hit_buf), shaped (num_records, len(record_rays), 3),
+            (num_records, len(record_rays)) and (batch_size + 1, num_absorbers),
+            where num_records = batch_size // record_every + 1
+        """
+        num_records = self.batch_size // self.record_every + 1
+        pos_buf = np.zeros((num_records, self.record_rays.size, 3), dtype=FLOAT)
+        enr_buf = np.zeros((num_records, self.record_rays.size), dtype=FLOAT)
+        hit_buf = np.zeros((self.batch_size + 1, self.absorbers.shape[0]), dtype=FLOAT)
+        return pos_buf, enr_buf, hit_buf
 
-        # Run simulation loop (JIT compiled) in batches
-        step = 0
+    def make_bvh(self) -> BVH:
+        """Makes a bounding volume hierarchy used to find the polygons hit by rays."""
+        bvh = make_bvh(self.scene)
+        logger.debug(f"BVH: {bvh.node_left.size} nodes, depth {bvh.max_depth}")
+        return bvh
+
+    def make_accel(self) -> tuple[VoxelGrid | None, BVH | None]:
+        """Makes the acceleration structure used to find the polygons near or hit by rays.
+
+        The event mode always uses the BVH, because the voxel grid only gives
+        the polygons near the ray position, not along the whole ray.
+
+        Returns:
+            tuple (grid, bvh), the structure which is not used is None
+        """
+        if self.accel == "voxel" and self.mode == "step":
+            logger.info("Making the voxel grid")
+            return self.make_grid(), None
+
+        if self.accel == "voxel":
+            logger.info("The voxel grid is not used in the event mode (voxel_size is ignored)")
+        logger.info("Making the BVH")
+        return None, self.make_bvh()
+
+    def get_config_hash(self) -> str:
+        """Returns a hash of the parameters and geometry, stored in the checkpoints."""
+        return get_config_hash(
+            self.sim_cfg,
+            (self.points, self.faces, self.polygons, self.surf_absorption, self.transparent),
+        )
+
+    def run(self):
+        logger.info("Starting the simulation")
+        config_hash = self.get_config_hash()
+        rng = np.random.default_rng(self.seed)
+
+        if self.resume and os.path.exists(self.checkpoint_path):
+            # Continue from the last checkpoint
+            checkpoint = load_checkpoint(self.checkpoint_path)
+            if checkpoint.config_hash != config_hash:
+                raise RuntimeError(
+                    f"Checkpoint {self.checkpoint_path} was saved with a different configuration"
+                )
+            logger.info(f"Resuming the simulation from step {checkpoint.step}")
+            step = checkpoint.step
+            position = checkpoint.position
+            velocity = checkpoint.velocity
+            energy = checkpoint.energy
+            hits = checkpoint.hits
+            rng.bit_generator.state = checkpoint.rng_state
+        else:
+            step = 0
+
+            # Get initial position of rays
+            position = np.zeros((self.num_rays, 3), dtype=FLOAT)
+            for i in range(self.num_rays):
+                position[i, :] = self.source
 
-        # Define buffers so that pyright doesn't complain that they may be unbound
+            # Get initial velocity of rays
+            init_direction = rng.uniform(-1.0, 1.0, size=(self.num_rays, 3))
+            for i in range(self.num_rays):
+                init_direction[i] /= np.linalg.norm(init_direction[i])
+            velocity = init_direction * self.ray_speed
+
+            # Get initial energy and hits
+            energy = np.ones(self.num_rays, dtype=FLOAT)
+            num_absorbers = self.absorbers.shape[0]
+            hits = np.zeros(num_absorbers, dtype=FLOAT)
+
+        # Make acceleration structure
+        grid, bvh = self.make_accel()
+
+        # Grid of absorbers, used to find the absorbers near each ray
+        absorber_grid = make_point_grid(self.absorbers.reshape(-1, 3), self.absorber_radius)
+
+        # Run simulation loop (JIT compiled) in batches
+        # The same state and buffer arrays are reused in all batches
         pos_buf = np.array([],  dtype=FLOAT)
         enr_buf = np.array([],  dtype=FLOAT)
         hit_buf = np.array([],  dtype=FLOAT)
+        if step < self.num_steps:
+            pos_buf, enr_buf, hit_buf = self.make_buffers()
 
         while step < self.num_steps:
-            pos_buf, enr_buf, hit_buf = simulation_loop(
-                init_step = step,
-                num_steps = self.batch_size,
-                num_rays = self.num_rays,
-                ray_speed = self.ray_speed,
-                time_step = self.time_step,
-                grid_step = self.voxel_size,
-                grid = grid,
-                position = position,
-                velocity = velocity,
-                energy = energy,
-                hits = hits,
-                absorbers = self.absorbers,
-                absorber_radius = self.absorber_radius,
-                points = self.points,
-                faces = self.faces,
-                polygons = self.polygons,
-                walls = self.walls,
-                transparent_polygons = self.trans_poly_nums,
-                surf_absorption = self.surf_absorption,
-                verbose = self.verbose,
-            )
+            if self.mode == "event":
+                position, velocity, energy, hits = event_loop(
+                    init_step = step,
+                    num_steps = self.batch_size,
+                    num_rays = self.num_rays,
+                    time_step = self.time_step,
+                    position = position,
+                    velocity = velocity,
+                    energy = energy,
+                    hits = hits,
+                    absorbers = self.absorbers,
+                    absorber_radius = self.absorber_radius,
+                    absorber_grid = absorber_grid,
+                    scene = self.scene,
+                    bvh = bvh,
+                    transparent = self.transparent,
+                    surf_absorption = self.surf_absorption,
+                    record_rays = self.record_rays,
+                    pos_buf = pos_buf,
+                    enr_buf = enr_buf,
+                    hit_buf = hit_buf,
+                    record_every = self.record_every,
+                    verbose = self.verbose,
+                )
+            else:
+                position, velocity, energy, hits = simulation_loop(
+                    init_step = step,
+                    num_steps = self.batch_size,
+                    num_rays = self.num_rays,
+                    ray_speed = self.ray_speed,
+                    time_step = self.time_step,
+                    grid = grid,
+                    bvh = bvh,
+                    position = position,
+                    velocity = velocity,
+                    energy = energy,
+                    hits = hits,
+                    absorbers = self.absorbers,
+                    absorber_radius = self.absorber_radius,
+                    absorber_grid = absorber_grid,
+                    scene = self.scene,
+                    transparent = self.transparent,
+                    surf_absorption = self.surf_absorption,
+                    record_rays = self.record_rays,
+                    pos_buf = pos_buf,
+                    enr_buf = enr_buf,
+                    hit_buf = hit_buf,
+                    record_every = self.record_every,
+                    verbose = self.verbose,
+                )
 
             # Dump buffers for the current batch
             dump_buffers(pos_buf, enr_buf, hit_buf, self.buffer_dir, self.sim_cfg, step)
             logger.debug(f"Buffers saved ({step}-{step+self.batch_size})")
 
-            # Update state
-            position = pos_buf[-1]
-            velocity = (pos_buf[-1] - pos_buf[-2]) / self.time_step
-            energy = enr_buf[-1]
-            hits = hit_buf[-1]
-
             # Increase step number
             step += self.batch_size
 
+            # Save checkpoint every `checkpoint_every` batches and after the last one
+            num_batches = step // self.batch_size
+            if self.checkpoint_every > 0 and (
+                num_batches % self.checkpoint_every == 0 or step >= self.num_steps
+            ):
+                checkpoint = Checkpoint(
+                    step=step,
+                    position=position,
+                    velocity=velocity,
+                    energy=energy,
+                    hits=hits,
+                    rng_state=rng.bit_generator.state,
+                    config_hash=config_hash,
+                )
+                save_checkpoint(self.checkpoint_path, checkpoint)
+
         logger.info("Simulation finished!")
         return pos_buf, enr_buf, hit_buf
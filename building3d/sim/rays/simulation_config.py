@@ -18,8 +18,13 @@ logger = logging.getLogger(__name__)
 
 class SimulationConfig:
 
-    def __init__(self, building: Building):
+    def __init__(self, building: Building | tuple):
+        """Initializes the configuration with default values.
 
+        Args:
+            building: simulated building or its array format (see `to_array_format()`).
+                Surface parameters of single polygons can be set only for a `Building`.
+        """
         self.building = building
 
         # Verbosity (turns on prints in the JIT-compiled code)
@@ -27,11 +32,20 @@ class SimulationConfig:
 
         # Simulation engine parameters
         self.engine = {
+            "mode": "step",       # "step" (fixed time step) or "event" (jump to next reflection)
+            # The event mode always uses "bvh", "voxel" applies only to the step mode
+            "accel": "voxel",     # "voxel" (uniform grid) or "bvh" (bounding volume hierarchy)
             "time_step": 2.5e-5,  # Max. freq. = 1 / (2 * dt) = 20 kHz
             "num_steps": 1000,    # Should be a multiple of batch_size
             "batch_size": 100,
             "voxel_size": 0.1,
+            "sparse_voxels": False,  # Store only voxels near polygons (large, mostly empty models)
             "search_transparent": True,
+            # Rays whose positions and energy are stored: "all", "none" (only absorber hits
+            # are stored, e.g. for impulse responses) or the number of sampled rays
+            "record_rays": "all",
+            "record_every": 1,    # Store positions and energy every N-th step
+            "checkpoint_every": 1,  # Save a checkpoint every N batches (0 = never)
         }
 
         # Ray configuration
@@ -41,6 +55,9 @@ class SimulationConfig:
             "source": (0.0, 0.0, 0.0),
             "absorbers": [],  # list of tuples, shape (num_absorbers, 3)
             "absorber_radius": 0.1,
+            # Seed of the initial ray directions (int, sequence of ints or None).
+            # With a fixed seed, re-running the simulation gives identical results.
+            "seed": None,
         }
 
         # Surface parameters
@@ -50,7 +67,8 @@ class SimulationConfig:
                 # To add custom values to each polygon use self.set_surface_param()
             },
         }
-        self.set_default_surface_paths(self.building)
+        if isinstance(self.building, Building):
+            self.set_default_surface_paths(self.building)
 
         # Visualization parameters (plots, movies)
         self.visualization = {
@@ -69,9 +87,12 @@ class SimulationConfig:
         self.paths = {
             "project_dir": "out",
             "buffer_dir": os.path.join("out", "states"),
-            "energy_file": "energy_<step>.npy",
-            "position_file": "position_<step>.npy",
-            "hits_file": "hits_<step>.npy",
+            # Buffer files, each with all steps of a given quantity (see `dump_buffers()`)
+            "energy_file": "energy.npy",
+            "position_file": "position.npy",
+            "hits_file": "hits.npy",
+            # State saved after batches, used to resume the simulation (see `checkpoint.py`)
+            "checkpoint_file": "checkpoint.npz",
         }
 
     def set_default_surface_paths(self, building: Building):
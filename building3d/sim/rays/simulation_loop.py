@@ -3,18 +3,25 @@ from numba import njit
 
 from numba import prange
 
-from building3d.geom.polygon.distance import distance_point_to_polygon
 from building3d.geom.types import FLOAT
+from building3d.geom.types import INT
+from building3d.geom.types import BoolDataType
 from building3d.geom.types import FloatDataType
 from building3d.geom.types import IndexType
 from building3d.geom.types import PointType
 from building3d.geom.types import VectorType
-from building3d.geom.vectors import normal
-from building3d.io.arrayformat import get_polygon_points_and_faces
 
+from .absorbers import collect_hits
+from .absorbers import find_absorber
+from .absorbers import make_chunk_hits
+from .bvh import BVH
+from .bvh import bvh_first_hit
 from .find_nearby_polygons import find_nearby_polygons
 from .find_target import find_target_surface
 from .jit_print import jit_print
+from .scene import Scene
+from .scene import distance_point_to_scene_polygon
+from .voxel_grid import VoxelGrid
 
 
 @njit(parallel=True)
@@ -24,77 +31,90 @@ def simulation_loop(
     num_rays: int,
     ray_speed: float,
     time_step: float,
-    grid_step: float,
-    grid: dict[tuple[int, int, int], IndexType],
+    grid: VoxelGrid | None,
+    bvh: BVH | None,
     position: PointType,
     velocity: VectorType,
     energy: FloatDataType,
     hits: FloatDataType,
     absorbers: PointType,
     absorber_radius: float,
-    points: PointType,
-    faces: IndexType,
-    polygons: IndexType,
-    walls: IndexType,
-    transparent_polygons: set[int],
+    absorber_grid: VoxelGrid,
+    scene: Scene,
+    transparent: BoolDataType,
     surf_absorption: FloatDataType,
+    record_rays: IndexType,
+    pos_buf: PointType,
+    enr_buf: FloatDataType,
+    hit_buf: FloatDataType,
+    record_every: int = 1,
     verbose: bool = True,
     eps: float = 1e-6,
-) -> tuple[PointType, FloatDataType, FloatDataType]:
+) -> tuple[PointType, VectorType, FloatDataType, FloatDataType]:
     """Performs a simulation loop for ray tracing in a building environment.
 
     This function is compiled to machine code with Numba for improved performance. It simulates
     the movement of rays through a building, handling reflections, absorptions, and hits on absorbers.
 
+    The ray state (position, velocity, energy, hits) is updated in-place and the buffers
+    are filled in-place, so the same arrays can be reused in all batches
+    (see `Simulation.make_buffers()`).
+
     Args:
         init_step (int): Initial step number, used only for printing the progress
         num_steps (int): Number of simulation steps to perform.
         num_rays (int): Number of rays to simulate.
         ray_speed (float): Speed of rays in m/s.
         time_step (float): Simulation time step in seconds.
-        grid_step (float): Voxel grid step size.
+        grid (VoxelGrid | None): Voxel grid, preferably with 27-cell neighborhoods
+                                 (see `make_voxel_grid()`). Must be None if `bvh` is given.
+        bvh (BVH | None): Bounding volume hierarchy of the scene (see `make_bvh()`).
+                          Must be None if `grid` is given.
         source (PointType): Starting point for all rays.
         position (PointType): Current position of all rays.
         velocity (VectorType): Current velocity of all rays.
+        energy (FloatDataType): Current energy of all rays.
+        hits (FloatDataType): Current absorber hits.
         absorbers (PointType): Array of absorber positions.
         absorber_radius (float): Size of absorbers.
-        points (PointType): Array of all points in the building geometry.
-        faces (IndexType): Array of face indices for the building geometry.
-        polygons (IndexType): Array of polygon indices for the building geometry.
-        walls (IndexType): Array of wall indices for the building geometry.
-        transparent_polygons (set[int]): Set of indices for transparent polygons.
+        absorber_grid (VoxelGrid): Grid of absorbers (see `make_point_grid()`),
+                                   used to find nearby absorbers if there are many.
+        scene (Scene): Compiled scene with the building polygons (see `make_scene()`).
+        transparent (BoolDataType): Boolean mask of transparent polygons,
+                                    shape (num_polygons, ).
         surf_absorption (FloatDataType): Absorption coefficients for each polygon,
                                          shape (len(polygons), ).
+        record_rays (IndexType): Indices of rays whose positions and energy are stored
+                                 in the buffers. If empty, only absorber hits are stored
+                                 and the memory use doesn't depend on the number of steps.
+        pos_buf (PointType): Output buffer of recorded ray positions,
+                             shaped (num_steps // record_every + 1, len(record_rays), 3).
+        enr_buf (FloatDataType): Output buffer of recorded ray energy,
+                                 shaped (num_steps // record_every + 1, len(record_rays)).
+        hit_buf (FloatDataType): Output buffer of absorber hits,
+                                 shaped (num_steps + 1, num_absorbers).
+        record_every (int): Positions and energy are stored every `record_every` steps.
+                            `num_steps` must be its multiple.
         verbose (bool): Prints progress if True
         eps (float): Small number used in comparison operations.
 
     Returns:
-        tuple[PointType, FloatDataType, FloatDataType]: A tuple containing:
-            - pos_buf: buffer of ray positions, shaped (num_steps + 1, num_rays, 3)
-            - enr_buf: buffer of ray energy, shaped (num_steps + 1, num_rays)
-            - hit_buf: buffer of ray absorber hits, shaped (num_steps + 1, num_rays)
+        tuple[PointType, VectorType, FloatDataType, FloatDataType]: Final state of the rays
+            (position, velocity, energy, hits), i.e. the updated input arrays.
+            The velocity includes the reflections from the last step.
     """
     jit_print(verbose, "Preparing for the simulation loop")
-    if (len(transparent_polygons) > 1) and (-1 in transparent_polygons):
-        transparent_polygons.remove(-1)
 
     # Absorber size as a squared radius (to avoid calculating sqrt for each ray and step)
     absorber_sq_radius = absorber_radius ** 2
 
     # Assume refleciton distance
-    delta_pos = velocity * time_step
     just_in_case_margin = 1.01
     reflection_dist = ray_speed * time_step * just_in_case_margin
 
-    # Get polygon points and faces
-    jit_print(verbose, "Collecting polygon points and faces from the array format")
-    poly_pts = []
-    poly_tri = []
-    num_polys = len(walls)
-    for pn in range(num_polys):
-        pts, tri = get_polygon_points_and_faces(points, faces, polygons, pn)
-        poly_pts.append(pts)
-        poly_tri.append(tri)
+    # Polygon points and normal vectors
+    points = scene.pts
+    poly_vn = scene.vn
 
     # Get bounding box
     min_x = points[:, 0].min()
@@ -104,28 +124,17 @@ def simulation_loop(
     max_y = points[:, 1].max()
     max_z = points[:, 2].max()
 
-    # Cyclic buffers
-    buffer_size = num_steps + 1  # One more to keep the initial state
-    pos_buf = np.zeros((buffer_size, num_rays, 3), dtype=FLOAT)
-    enr_buf = np.ones((buffer_size, num_rays), dtype=FLOAT)
-    hit_buf = np.zeros((buffer_size, len(absorbers)), dtype=FLOAT)
-
     # Fill buffers with initial values
-    pos_buf[0, :, :] = position
-    enr_buf[0, :] = energy
+    # (buffers have one more step to keep the initial state)
+    record_state(pos_buf, enr_buf, 0, position, energy, record_rays)
     hit_buf[0, :] = hits
 
-    # Distance to each absorber
-    jit_print(verbose, "Calculating initial distance to each absorber")
-    num_absorbers = absorbers.shape[0]
-    absorber_sq_dist = np.zeros((num_absorbers, num_rays))
-    for sn in range(num_absorbers):
-        absorber_sq_dist[sn, :] = np.sum((position - absorbers[sn]) ** 2, axis=1)
-
-    # Target surfaces
-    # If the index of the target is -1, it means that the target surface is unknown.
-    # Target surface may be unknown when it is far away, because we only look at nearby polygons.
-    target_surfs = np.full(num_rays, -1, dtype=np.int32)
+    # Absorber hit by each ray in the current step and the absorbed energy.
+    # Hits can't be added to the shared `hits` array inside prange (race condition),
+    # so they are summed after the parallel section by `collect_hits()`.
+    absorbed_by = np.full(num_rays, -1, dtype=INT)
+    absorbed_energy = np.zeros(num_rays, dtype=FLOAT)
+    chunk_hits = make_chunk_hits(num_rays, hits.size)
 
     # Move rays
     jit_print(verbose, "Entering the simulation loop")
@@ -135,22 +144,19 @@ def simulation_loop(
         # Reset hits for each absorber
         hits[:] = 0.0
 
-        # Check absorbers
-        # This probably shouldn't be inside prange, because of the hits array
-        for rn in range(num_rays):
-            if energy[rn] <= eps:
-                continue
-            for sn in range(num_absorbers):
-                absorber_sq_dist[sn, rn] = np.sum((position[rn] - absorbers[sn]) ** 2)
-                if absorber_sq_dist[sn, rn] < absorber_sq_radius:
-                    hits[sn] += energy[rn]  # This line shouldn't be inside prange
-                    energy[rn] = 0.0
-
         for rn in prange(num_rays):
             # If energy is null, the ray should not move
             if energy[rn] <= eps:
                 continue
 
+            # Check absorbers
+            an = find_absorber(position[rn], absorbers, absorber_sq_radius, absorber_grid)
+            if an >= 0:
+                absorbed_by[rn] = an
+                absorbed_energy[rn] = energy[rn]
+                energy[rn] = 0.0
+                continue
+
             # If the ray somehow left the building - set its energy to 0
             if energy[rn] > 0 and (
                 position[rn][0] < min_x - eps
@@ -162,88 +168,124 @@ def simulation_loop(
             ):
                 energy[rn] = 0.0
 
-            # Check near polygons
-            x = int(np.floor(position[rn][0] / grid_step))
-            y = int(np.floor(position[rn][1] / grid_step))
-            z = int(np.floor(position[rn][2] / grid_step))
-
-            # Get a set of nearby polygon indices to check the ray distance to next wall
-            polygons_to_check = find_nearby_polygons(x, y, z, grid)
-
-            target_surfs[rn] = find_target_surface(
+            # Find the target surface and calculate the distance to it
+            # If the index of the target is -1, it means that the target surface is unknown.
+            # Target surface may be unknown when it is far away,
+            # because we only look at nearby polygons.
+            target, dist = find_target_and_distance(
                 position[rn],
                 velocity[rn],
-                poly_pts,
-                poly_tri,
-                transparent_polygons,
-                polygons_to_check,
-                atol=1e-3,
+                scene,
+                transparent,
+                grid,
+                bvh,
             )
-            # If the next surface is known, calculate the distance to it.
-            # If not, assume infinity.
-            if target_surfs[rn] >= 0:
-                pts = poly_pts[target_surfs[rn]]
-                tri = poly_tri[target_surfs[rn]]
-                vn = normal(pts[-1], pts[0], pts[1])
-                dist = distance_point_to_polygon(position[rn], pts, tri, vn)
-            else:
-                vn = np.zeros(3, dtype=FLOAT)
-                dist = np.inf
-
-            while target_surfs[rn] >= 0 and dist < reflection_dist and energy[rn] > eps:
+
+            while target >= 0 and dist < reflection_dist and energy[rn] > eps:
                 # Reflect from the target polygon
-                energy[rn] -= surf_absorption[target_surfs[rn]]
+                energy[rn] -= surf_absorption[target]
                 if energy[rn] <= eps:
                     energy[rn] = 0.0
                     break
 
                 # Assert statement does not work with prange...
                 # assert np.linalg.norm(vn) > 0, "Normal vector cannot have zero length"
+                vn = poly_vn[target]
                 dot = np.dot(vn, velocity[rn])
                 velocity[rn] = velocity[rn] - 2 * dot * vn
-                delta_pos[rn] = velocity[rn] * time_step
 
-                # Get a set of nearby polygon indices to check if the ray
-                # is not going to move outside the building in the next step (after reflection).
+                # Check if the ray is not going to move outside the building
+                # in the next step (after reflection).
                 # Need to find the target surface and calculate distance from it.
-                polygons_to_check = find_nearby_polygons(x, y, z, grid)
-
-                target_surfs[rn] = find_target_surface(
+                target, dist = find_target_and_distance(
                     position[rn],
                     velocity[rn],
-                    poly_pts,
-                    poly_tri,
-                    transparent_polygons,
-                    polygons_to_check,
-                    atol=1e-3,
+                    scene,
+                    transparent,
+                    grid,
+                    bvh,
                 )
-                # If the next surface is known, calculate the distance to it.
-                # If not, assume infinity.
-                # TODO: These lines are repeated and could be turned into a function.
-                if target_surfs[rn] >= 0:
-                    pts = poly_pts[target_surfs[rn]]
-                    tri = poly_tri[target_surfs[rn]]
-                    vn = normal(pts[-1], pts[0], pts[1])
-                    dist = distance_point_to_polygon(position[rn], pts, tri, vn)
-                else:
-                    vn = np.zeros(3, dtype=FLOAT)
-                    dist = np.inf
 
             if energy[rn] > eps and dist > reflection_dist:
-                position[rn] += delta_pos[rn]
-            else:
-                continue
+                # Move the ray (element by element to avoid temporary arrays)
+                for k in range(3):
+                    position[rn, k] += velocity[rn, k] * time_step
+
+        # Sum the absorbed energy per absorber
+        collect_hits(absorbed_by, absorbed_energy, hits, chunk_hits)
 
         # Add state to the buffers
-        pos_buf[i+1, :, :] = position
-        enr_buf[i+1, :] = energy
+        if (i + 1) % record_every == 0:
+            record_state(pos_buf, enr_buf, (i + 1) // record_every, position, energy, record_rays)
         hit_buf[i+1, :] = hits
 
     jit_print(verbose, "Exiting the simulation loop")
 
-    # Shapes:
-    # pos_buf: (num_steps + 1, num_rays, 3)
-    # enr_buf: (num_steps + 1, num_rays)
-    # enr_buf: (num_steps + 1, num_rays)
-    # First shape is 1 larger than num_steps to include the initial state.
-    return pos_buf, enr_buf, hit_buf
+    return position, velocity, energy, hits
+
+
+@njit
+def record_state(
+    pos_buf: PointType,
+    enr_buf: FloatDataType,
+    record: int,
+    position: PointType,
+    energy: FloatDataType,
+    record_rays: IndexType,
+) -> None:
+    """Copies position and energy of the recorded rays to the buffers at index `record`."""
+    for j in range(record_rays.size):
+        rn = record_rays[j]
+        pos_buf[record, j, :] = position[rn]
+        enr_buf[record, j] = energy[rn]
+
+
+@njit
+def find_target_and_distance(
+    pos: PointType,
+    velocity: VectorType,
+    scene: Scene,
+    transparent: BoolDataType,
+    grid: VoxelGrid | None,
+    bvh: BVH | None,
+) -> tuple[int, float]:
+    """Finds the target surface of a ray and the distance to it.
+
+    Exactly one of `grid` and `bvh` should be given.
+    If it is the BVH, the first polygon along the ray is the target.
+    If it is the voxel grid, only the polygons from the neighborhood of the ray are checked.
+
+    Returns:
+        tuple (target polygon index, distance from the ray to the polygon).
+        If the target is unknown, the index is -1 and the distance is infinity.
+    """
+    # The checks below are resolved at compile time if grid or bvh is None,
+    # so each branch is compiled only if the corresponding structure exists
+    target = -1
+    if bvh is not None:
+        target, _ = bvh_first_hit(bvh, pos, velocity, transparent)
+    if grid is not None:
+        x = int(np.floor(pos[0] / grid.step))
+        y = int(np.floor(pos[1] / grid.step))
+        z = int(np.floor(pos[2] / grid.step))
+
+        # Get nearby polygon indices to check the ray distance to next wall
+        polygons_to_check = find_nearby_polygons(x, y, z, grid)
+
+        target = find_target_surface(
+            pos,
+            velocity,
+            scene,
+            transparent,
+            polygons_to_check,
+            atol=1e-3,
+        )
+
+    # If the next surface is known, calculate the distance to it.
+    # If not, assume infinity.
+    if target >= 0:
+        dist = distance_point_to_scene_polygon(pos, scene, target)
+    else:
+        dist = np.inf
+
+    return target, dist
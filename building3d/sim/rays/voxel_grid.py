@@ -1,111 +1,743 @@
+"""Voxel grid used to find polygons close to a ray.
+
+The grid is a named tuple in a CSR-like format:
+- origin:       integer coordinates of the first cell, shape `(3, )`
+- shape:        number of cells along x, y, z, shape `(3, )`
+- step:         cell size
+- neighborhood: if True, each cell stores polygons of itself and its 26 neighbors
+- sparse:       if True, only the cells listed in `cell_keys` are stored
+- cell_offset:  offsets of cell polygons in `cell_polys`, shape `(num_cells + 1, )`
+- cell_polys:   contiguous array of polygon indices
+- cell_keys:    sorted Morton codes of the stored cells (sparse grids only, otherwise empty)
+
+Integer cell coordinates are global, i.e. the point `(x, y, z)` belongs to the cell
+`(floor(x / step), floor(y / step), floor(z / step))`, regardless of the grid origin.
+
+A dense grid stores all cells of the bounding box, so that looking up a cell
+is pure integer arithmetic. A sparse grid stores only non-empty cells
+(or, with neighborhoods, the cells next to polygons), which saves memory
+in large, mostly empty buildings (e.g. multi-wing or campus models).
+Its cells are found by binary search of the Morton code, which interleaves
+the bits of the cell coordinates, so that nearby cells are stored close to each other.
+Both lookups return a view of `cell_polys`.
+
+The grid is built in parallel. Each polygon is rasterized into its own slice
+of a flat array of cell references, and the slices are merged into the CSR layout
+by a counting sort. Only NumPy arrays are shared between threads
+(lists and dicts inside `prange` were causing "double free or corruption", issue #73).
+"""
+from typing import NamedTuple
+
 import numpy as np
 from numba import njit
+from numba import get_num_threads
+from numba import prange
+from numpy.typing import NDArray
 
+from building3d.geom.types import FLOAT
+from building3d.geom.types import FloatDataType
 from building3d.geom.types import INT
 from building3d.geom.types import IndexType
 from building3d.geom.types import PointType
 
 from .jit_print import jit_print
+from .scene import Scene
+from .scene import get_num_polygons
 
 
-@njit
+# Morton codes use 21 bits per axis (63 bits in total)
+MAX_SPARSE_SHAPE = 2 ** 21
+
+
+class VoxelGrid(NamedTuple):
+    origin: IndexType
+    shape: IndexType
+    step: float
+    neighborhood: bool
+    sparse: bool
+    cell_offset: IndexType
+    cell_polys: IndexType
+    cell_keys: NDArray[np.int64]
+
+
+@njit(parallel=True)
 def make_voxel_grid(
     min_xyz: tuple[float, float, float],
     max_xyz: tuple[float, float, float],
-    poly_pts: list[PointType],
+    scene: Scene,
     step: float = 1.0,
     eps: float = 1e-4,
+    exact: bool = True,
+    neighborhood: bool = False,
+    sparse: bool = False,
     verbose: bool = True,
-) -> dict[tuple[int, int, int], IndexType]:
+) -> VoxelGrid:
     """Create a voxel grid for faster collision detection.
 
     This function divides the space defined by min_xyz and max_xyz into a grid of cubes,
     and associates each polygon with the grid cells it intersects or is contained within.
+    By default, the triangles of each polygon are tested against the cells
+    (separating axis test), so that large sloped polygons are not added to the cells
+    which are only crossed by their bounding boxes.
 
     Args:
         min_xyz (tuple[float, float, float]): Minimum coordinates (x, y, z) of the bounding box.
         max_xyz (tuple[float, float, float]): Maximum coordinates (x, y, z) of the bounding box.
-        poly_pts (list[PointType]): List of points for each polygon.
+        scene (Scene): Compiled scene with the polygons (see `make_scene()`).
         step (float, optional): Size of each grid cell. Defaults to 1.0.
         eps (float, optional): Small number used in comparison operations.
+        exact (bool, optional): If True, polygons are added only to the cells intersected
+            by their triangles. If False, they are added to all cells overlapping
+            with their bounding boxes. Defaults to True.
+        neighborhood (bool, optional): If True, each cell contains also the polygons
+            of the adjacent cells (see `make_neighborhood_grid()`). Defaults to False.
+        sparse (bool, optional): If True, only the non-empty cells are stored
+            (with `neighborhood=True` also the cells adjacent to them). Defaults to False.
         verbose (bool, optional): Prints progress if True
 
     Returns:
-        dict[tuple[int, int, int], IndexType]: A dictionary where keys are grid
-        cell coordinates and values are sets of polygon indices that intersect
+        VoxelGrid: grid with indices of polygons that intersect
         with or are contained within each cell
+
+    Raises:
+        ValueError: if some polygons are outside the grid or if the sparse grid
+            has more than `MAX_SPARSE_SHAPE` cells along any axis
     """
-    min_x, min_y, min_z = min_xyz
-    max_x, max_y, max_z = max_xyz
+    # The range is extended with one cell to accommodate models
+    # with negative and positive coordinates
+    origin = np.zeros(3, dtype=INT)
+    shape = np.zeros(3, dtype=INT)
+    for k in range(3):
+        lo = int(np.floor((min_xyz[k] - eps) / step))
+        hi = int(np.floor((max_xyz[k] + eps) / step)) + 1
+        origin[k] = lo
+        shape[k] = hi - lo + 1
 
-    min_x -= eps
-    min_y -= eps
-    min_z -= eps
-    max_x += eps
-    max_y += eps
-    max_z += eps
+    num_voxels = np.int64(shape[0]) * shape[1] * shape[2]
+    num_polys = get_num_polygons(scene)
+    jit_print(verbose, "Total number of voxels:", num_voxels)
 
-    grid = {}
+    if sparse and shape.max() > MAX_SPARSE_SHAPE:
+        raise ValueError("Too many cells along one axis of the sparse voxel grid")
 
-    # The range is extended with "+step" to accommodate models
-    # with negative and positive coordinates
-    x_range = np.arange(min_x, max_x + step + eps, step)
-    y_range = np.arange(min_y, max_y + step + eps, step)
-    z_range = np.arange(min_z, max_z + step + eps, step)
-
-    keys = []
-    for x in x_range:
-        for y in y_range:
-            for z in z_range:
-                keys.append(
-                    (
-                        int(np.floor(x / step)),
-                        int(np.floor(y / step)),
-                        int(np.floor(z / step)),
-                    )
-                )
-
-    max_polygons_per_cell = len(poly_pts)  # Worst case: all polygons in one cell
-    added_polygons = np.zeros(len(poly_pts), dtype=np.bool_)
-
-    # TODO: https://github.com/krzysztofarendt/building3d/issues/73
-    #       Cannot use numba.prange() due to error "double free or corruption (!prev)"
-    #       I don't know what causes this error. It happens only fromt time to time.
-    #       Anyway, this function is now pretty fast, so it is not needed.
-    jit_print(verbose, "Total number of voxels:", len(keys))
-    for ki in range(len(keys)):
-        if ki % 100 == 0:
-            jit_print(verbose, "Current voxel:", ki, "/", len(keys))
-        key = keys[ki]
-        polynums = np.full(max_polygons_per_cell, -1, dtype=INT)
-        counter = 0
-        for pn, pts in enumerate(poly_pts):
-            min_xyz_cube = (key[0] * step, key[1] * step, key[2] * step)
-            max_xyz_cube = (
-                min_xyz_cube[0] + step,
-                min_xyz_cube[1] + step,
-                min_xyz_cube[2] + step,
-            )
-            outside = False
-            for xyz in range(3):
-                # Check if it is possible for this triangle to cross the polygon
-                if (pts[:, xyz] < min_xyz_cube[xyz]).all():
-                    outside = True
-                    break
-                if (pts[:, xyz] > max_xyz_cube[xyz]).all():
-                    outside = True
-                    break
-            if outside:
-                continue
-            else:
-                # Previously I had here is_polygon_crossing_cube() but it was redundant
-                polynums[counter] = pn
-                counter += 1
-                added_polygons[pn] = True
-        grid[key] = polynums[:counter]  # Only keep the valid polygon numbers
+    # Cell references of each polygon are stored in `candidates`, one slice per polygon,
+    # sized for the candidate cells of the polygon. Then they are compacted to `poly_cells`.
+    # Polygons are independent, so both passes are parallel and write to disjoint slices.
+    max_offset = np.zeros(num_polys + 1, dtype=np.int64)
+    for pn in range(num_polys):
+        max_offset[pn + 1] = max_offset[pn] + max_polygon_cells(scene, pn, origin, shape, step)
+    candidates = np.zeros(max_offset[-1], dtype=np.int64)
+
+    num_poly_cells = np.zeros(num_polys, dtype=np.int64)
+    num_bbox_cells = np.zeros(num_polys, dtype=np.int64)
+    for pn in prange(num_polys):
+        num_cells, num_bbox = fill_polygon_cells(
+            scene,
+            pn,
+            origin,
+            shape,
+            step,
+            exact,
+            sparse,
+            eps,
+            candidates[max_offset[pn]:max_offset[pn + 1]],
+        )
+        num_poly_cells[pn] = num_cells
+        num_bbox_cells[pn] = num_bbox
 
-    if not np.all(added_polygons):
+    if not np.all(num_poly_cells > 0):
         raise ValueError("Not all polygons added to the voxel grid")
 
-    jit_print(verbose, "Voxels created")
+    poly_offset = np.zeros(num_polys + 1, dtype=np.int64)
+    poly_offset[1:] = np.cumsum(num_poly_cells)
+    poly_cells = np.zeros(poly_offset[-1], dtype=np.int64)
+    for pn in prange(num_polys):
+        start = max_offset[pn]
+        end = start + num_poly_cells[pn]
+        poly_cells[poly_offset[pn]:poly_offset[pn + 1]] = candidates[start:end]
+
+    grid = make_csr_grid(origin, shape, step, sparse, poly_offset, poly_cells)
+    num_bbox_refs = num_bbox_cells.sum()
+
+    jit_print(
+        verbose,
+        "Average number of polygons per voxel:",
+        num_bbox_refs / num_voxels,
+        "(bounding boxes),",
+        grid.cell_polys.size / num_voxels,
+        "(exact)" if exact else "(bounding boxes)",
+    )
+
+    if neighborhood:
+        grid = make_neighborhood_grid(grid, num_polys)
+
+    nbytes = get_grid_nbytes(grid)
+    jit_print(
+        verbose,
+        "Voxels created:",
+        grid.cell_offset.size - 1,
+        "stored cells,",
+        nbytes,
+        "bytes,",
+        nbytes / num_voxels,
+        "bytes per voxel",
+    )
+
     return grid
+
+
+@njit
+def make_csr_grid(
+    origin: IndexType,
+    shape: IndexType,
+    step: float,
+    sparse: bool,
+    item_offset: NDArray[np.int64],
+    item_cells: NDArray[np.int64],
+) -> VoxelGrid:
+    """Makes a grid from the cell keys of each item (e.g. polygon).
+
+    The keys of the item `n` are `item_cells[item_offset[n]:item_offset[n + 1]]`.
+    They are flat cell indices (dense grid) or Morton codes (sparse grid).
+    The references are merged into the CSR layout with a counting sort by cell,
+    so the items in each cell stay sorted by index.
+    """
+    num_items = item_offset.size - 1
+
+    # In the sparse grid, Morton codes are replaced with the indices of the stored cells
+    if sparse:
+        cell_keys = np.unique(item_cells)
+        item_cells = np.searchsorted(cell_keys, item_cells)
+        num_cells = cell_keys.size
+    else:
+        cell_keys = np.zeros(0, dtype=np.int64)
+        num_cells = np.int64(shape[0]) * shape[1] * shape[2]
+
+    cell_count = np.zeros(num_cells, dtype=INT)
+    for ci in item_cells:
+        cell_count[ci] += 1
+
+    cell_offset = np.zeros(num_cells + 1, dtype=INT)
+    cell_offset[1:] = np.cumsum(cell_count)
+    cell_polys = np.zeros(cell_offset[-1], dtype=INT)
+
+    cell_count[:] = 0
+    for n in range(num_items):
+        for ci in item_cells[item_offset[n]:item_offset[n + 1]]:
+            cell_polys[cell_offset[ci] + cell_count[ci]] = n
+            cell_count[ci] += 1
+
+    return VoxelGrid(origin, shape, step, False, sparse, cell_offset, cell_polys, cell_keys)
+
+
+@njit
+def make_point_grid(points: PointType, radius: float) -> VoxelGrid:
+    """Makes a sparse grid of points (e.g. absorbers) with cell size `2 * radius`.
+
+    Each point is added to the cells overlapping with the bounding box
+    of the sphere with the given radius (usually 8 cells).
+    So, a point `p` within `radius` from any point `pt` in the grid is
+    in one of the cells returned by `get_cell_polygons()` for `floor(p / step)`.
+
+    Args:
+        points: array of points, shape (num_points, 3)
+        radius: sphere radius, must be positive
+
+    Returns:
+        sparse VoxelGrid with point indices in its cells
+    """
+    if radius <= 0:
+        raise ValueError("Radius must be positive")
+
+    step = 2.0 * radius
+    num_points = points.shape[0]
+
+    origin = np.zeros(3, dtype=INT)
+    shape = np.ones(3, dtype=INT)
+    if num_points > 0:
+        for k in range(3):
+            lo = int(np.floor((points[:, k].min() - radius) / step))
+            hi = int(np.floor((points[:, k].max() + radius) / step))
+            origin[k] = lo
+            shape[k] = hi - lo + 1
+
+    if shape.max() > MAX_SPARSE_SHAPE:
+        raise ValueError("Too many cells along one axis of the point grid")
+
+    point_offset = np.zeros(num_points + 1, dtype=np.int64)
+    point_cells = np.zeros(27 * num_points, dtype=np.int64)  # 3 cells per axis due to rounding
+    counter = 0
+    for n in range(num_points):
+        cell_lo = np.floor((points[n] - radius) / step).astype(np.int64) - origin
+        cell_hi = np.floor((points[n] + radius) / step).astype(np.int64) - origin
+        for i in range(cell_lo[0], cell_hi[0] + 1):
+            for j in range(cell_lo[1], cell_hi[1] + 1):
+                for k in range(cell_lo[2], cell_hi[2] + 1):
+                    point_cells[counter] = morton_encode(i, j, k)
+                    counter += 1
+        point_offset[n + 1] = counter
+
+    return make_csr_grid(origin, shape, step, True, point_offset, point_cells[:counter])
+
+
+@njit
+def polygon_cell_range(
+    scene: Scene,
+    pn: int,
+    origin: IndexType,
+    shape: IndexType,
+    step: float,
+) -> tuple[IndexType, IndexType]:
+    """Returns the range of candidate cells of the polygon `pn` (inclusive, relative to origin).
+
+    The range covers the polygon bounding box with one cell margin
+    to be robust against rounding.
+    """
+    bbox = scene.bbox[pn]
+    lo = np.zeros(3, dtype=INT)
+    hi = np.zeros(3, dtype=INT)
+    for k in range(3):
+        lo[k] = max(int(np.floor(bbox[0, k] / step)) - 1 - origin[k], 0)
+        hi[k] = min(int(np.floor(bbox[1, k] / step)) + 1 - origin[k], shape[k] - 1)
+    return lo, hi
+
+
+@njit
+def max_polygon_cells(
+    scene: Scene,
+    pn: int,
+    origin: IndexType,
+    shape: IndexType,
+    step: float,
+) -> int:
+    """Returns the number of candidate cells of the polygon `pn` (see `polygon_cell_range()`)."""
+    lo, hi = polygon_cell_range(scene, pn, origin, shape, step)
+    max_cells = 1
+    for k in range(3):
+        max_cells *= max(hi[k] - lo[k] + 1, 0)
+    return max_cells
+
+
+@njit
+def polygon_cells(
+    scene: Scene,
+    pn: int,
+    origin: IndexType,
+    shape: IndexType,
+    step: float,
+    exact: bool = True,
+    sparse: bool = False,
+    eps: float = 1e-4,
+) -> tuple[NDArray[np.int64], int]:
+    """Returns keys of the grid cells intersected by the polygon `pn`.
+
+    The keys are flat cell indices (dense grid) or Morton codes (sparse grid).
+
+    Cells touching the polygon (sharing a face, an edge or a vertex) are included.
+
+    Args:
+        scene: compiled scene
+        pn: polygon index
+        origin: integer coordinates of the first grid cell
+        shape: number of cells along x, y, z
+        step: cell size
+        exact: if False, all cells overlapping with the polygon bounding box are returned
+        sparse: if True, Morton codes are returned instead of flat indices
+        eps: cells are enlarged by this margin in the triangle-cell intersection test
+
+    Returns:
+        tuple (cell keys, number of cells overlapping with the polygon bounding box)
+    """
+    cells = np.zeros(max_polygon_cells(scene, pn, origin, shape, step), dtype=np.int64)
+    num_cells, num_bbox_cells = fill_polygon_cells(
+        scene, pn, origin, shape, step, exact, sparse, eps, cells
+    )
+    return cells[:num_cells], num_bbox_cells
+
+
+@njit
+def fill_polygon_cells(
+    scene: Scene,
+    pn: int,
+    origin: IndexType,
+    shape: IndexType,
+    step: float,
+    exact: bool,
+    sparse: bool,
+    eps: float,
+    cells: NDArray[np.int64],
+) -> tuple[int, int]:
+    """Writes keys of the grid cells intersected by the polygon `pn` to `cells`.
+
+    Same as `polygon_cells()`, but the keys are written to the beginning of a given array,
+    which must have at least `max_polygon_cells()` elements.
+
+    Returns:
+        tuple (number of cell keys, number of cells overlapping with the polygon bounding box)
+    """
+    bbox = scene.bbox[pn]
+    pts = scene.pts[scene.pt_offset[pn]:scene.pt_offset[pn + 1]]
+    tri = scene.tri[scene.tri_offset[pn]:scene.tri_offset[pn + 1]]
+    lo, hi = polygon_cell_range(scene, pn, origin, shape, step)
+
+    half = 0.5 * step + eps
+    center = np.zeros(3, dtype=FLOAT)
+
+    counter = 0
+    num_bbox_cells = 0
+    for i in range(lo[0], hi[0] + 1):
+        if not overlaps_cell(bbox, 0, origin[0] + i, step):
+            continue
+        for j in range(lo[1], hi[1] + 1):
+            if not overlaps_cell(bbox, 1, origin[1] + j, step):
+                continue
+            for k in range(lo[2], hi[2] + 1):
+                if not overlaps_cell(bbox, 2, origin[2] + k, step):
+                    continue
+                num_bbox_cells += 1
+
+                if exact:
+                    center[0] = (origin[0] + i + 0.5) * step
+                    center[1] = (origin[1] + j + 0.5) * step
+                    center[2] = (origin[2] + k + 0.5) * step
+                    crossing = False
+                    for ti in range(tri.shape[0]):
+                        if is_triangle_crossing_box(
+                            pts[tri[ti, 0]], pts[tri[ti, 1]], pts[tri[ti, 2]], center, half
+                        ):
+                            crossing = True
+                            break
+                    if not crossing:
+                        continue
+
+                if sparse:
+                    cells[counter] = morton_encode(i, j, k)
+                else:
+                    cells[counter] = (i * shape[1] + j) * shape[2] + k
+                counter += 1
+
+    return counter, num_bbox_cells
+
+
+@njit
+def overlaps_cell(bbox: FloatDataType, axis: int, cell: int, step: float) -> bool:
+    """Checks if a bounding box overlaps with a cell along a given axis (boundary included)."""
+    return not (bbox[1, axis] < cell * step or bbox[0, axis] > cell * step + step)
+
+
+@njit
+def is_triangle_crossing_box(
+    pt1: PointType,
+    pt2: PointType,
+    pt3: PointType,
+    center: PointType,
+    half: float,
+) -> bool:
+    """Checks if a triangle intersects an axis-aligned cube (boundary included).
+
+    Uses the separating axis theorem (Akenine-Moller). The tested axes are:
+    the 3 cube face normals, the triangle normal, and the 9 cross products
+    of the triangle edges with the cube edges.
+
+    Args:
+        pt1, pt2, pt3: triangle vertices
+        center: cube center
+        half: half of the cube size
+
+    Returns:
+        True if the triangle and the cube intersect or touch
+    """
+    # Move the cube to the origin
+    v0x = pt1[0] - center[0]
+    v0y = pt1[1] - center[1]
+    v0z = pt1[2] - center[2]
+    v1x = pt2[0] - center[0]
+    v1y = pt2[1] - center[1]
+    v1z = pt2[2] - center[2]
+    v2x = pt3[0] - center[0]
+    v2y = pt3[1] - center[1]
+    v2z = pt3[2] - center[2]
+
+    # Cube face normals (i.e. bounding box test)
+    if min(v0x, v1x, v2x) > half or max(v0x, v1x, v2x) < -half:
+        return False
+    if min(v0y, v1y, v2y) > half or max(v0y, v1y, v2y) < -half:
+        return False
+    if min(v0z, v1z, v2z) > half or max(v0z, v1z, v2z) < -half:
+        return False
+
+    # Triangle edges
+    e0x = v1x - v0x
+    e0y = v1y - v0y
+    e0z = v1z - v0z
+    e1x = v2x - v1x
+    e1y = v2y - v1y
+    e1z = v2z - v1z
+    e2x = v0x - v2x
+    e2y = v0y - v2y
+    e2z = v0z - v2z
+
+    # Triangle normal
+    nx = e0y * e1z - e0z * e1y
+    ny = e0z * e1x - e0x * e1z
+    nz = e0x * e1y - e0y * e1x
+    d = nx * v0x + ny * v0y + nz * v0z
+    r = half * (abs(nx) + abs(ny) + abs(nz))
+    if abs(d) > r:
+        return False
+
+    # Cross products of triangle edges with cube edges (x, y, z)
+    edges = ((e0x, e0y, e0z), (e1x, e1y, e1z), (e2x, e2y, e2z))
+    for ex, ey, ez in edges:
+        # Axis: x cross e = (0, -ez, ey)
+        p0 = -ez * v0y + ey * v0z
+        p1 = -ez * v1y + ey * v1z
+        p2 = -ez * v2y + ey * v2z
+        r = half * (abs(ez) + abs(ey))
+        if min(p0, p1, p2) > r or max(p0, p1, p2) < -r:
+            return False
+
+        # Axis: y cross e = (ez, 0, -ex)
+        p0 = ez * v0x - ex * v0z
+        p1 = ez * v1x - ex * v1z
+        p2 = ez * v2x - ex * v2z
+        r = half * (abs(ez) + abs(ex))
+        if min(p0, p1, p2) > r or max(p0, p1, p2) < -r:
+            return False
+
+        # Axis: z cross e = (-ey, ex, 0)
+        p0 = -ey * v0x + ex * v0y
+        p1 = -ey * v1x + ex * v1y
+        p2 = -ey * v2x + ex * v2y
+        r = half * (abs(ey) + abs(ex))
+        if min(p0, p1, p2) > r or max(p0, p1, p2) < -r:
+            return False
+
+    return True
+
+
+@njit
+def morton_encode(i: int, j: int, k: int) -> int:
+    """Interleaves the bits of the cell coordinates (21 bits each) into a Morton code."""
+    return spread_bits(i) | (spread_bits(j) << 1) | (spread_bits(k) << 2)
+
+
+@njit
+def morton_decode(key: int) -> tuple[int, int, int]:
+    """Returns the cell coordinates encoded in a Morton code."""
+    return compact_bits(key), compact_bits(key >> 1), compact_bits(key >> 2)
+
+
+@njit
+def spread_bits(x: int) -> int:
+    """Inserts two zero bits after each of the 21 lowest bits of x."""
+    x = np.int64(x) & 0x1FFFFF
+    x = (x | (x << 32)) & 0x1F00000000FFFF
+    x = (x | (x << 16)) & 0x1F0000FF0000FF
+    x = (x | (x << 8)) & 0x100F00F00F00F00F
+    x = (x | (x << 4)) & 0x10C30C30C30C30C3
+    x = (x | (x << 2)) & 0x1249249249249249
+    return x
+
+
+@njit
+def compact_bits(x: int) -> int:
+    """Reverses `spread_bits()`, i.e. keeps every third bit of x."""
+    x = np.int64(x) & 0x1249249249249249
+    x = (x ^ (x >> 2)) & 0x10C30C30C30C30C3
+    x = (x ^ (x >> 4)) & 0x100F00F00F00F00F
+    x = (x ^ (x >> 8)) & 0x1F0000FF0000FF
+    x = (x ^ (x >> 16)) & 0x1F00000000FFFF
+    x = (x ^ (x >> 32)) & 0x1FFFFF
+    return x
+
+
+@njit
+def average_polygons_per_cell(grid: VoxelGrid) -> float:
+    """Returns the average number of polygons in a grid cell (empty cells included)."""
+    return grid.cell_polys.size / get_num_voxels(grid)
+
+
+@njit
+def get_num_voxels(grid: VoxelGrid) -> int:
+    """Returns the number of cells in the grid bounding box (stored or not)."""
+    return np.int64(grid.shape[0]) * grid.shape[1] * grid.shape[2]
+
+
+@njit
+def get_grid_nbytes(grid: VoxelGrid) -> int:
+    """Returns the memory used by the grid arrays in bytes."""
+    return (
+        grid.origin.nbytes
+        + grid.shape.nbytes
+        + grid.cell_offset.nbytes
+        + grid.cell_polys.nbytes
+        + grid.cell_keys.nbytes
+    )
+
+
+@njit(parallel=True)
+def make_neighborhood_grid(grid: VoxelGrid, num_polys: int) -> VoxelGrid:
+    """Makes a grid in which each cell stores unique polygons of its 27-cell neighborhood.
+
+    The neighborhood grid is larger than the original one,
+    but it lets the ray tracer find all nearby polygons with a single lookup.
+    If the grid is sparse, the neighborhood grid stores also the empty cells
+    adjacent to the non-empty ones.
+
+    Args:
+        grid: voxel grid with polygons in each cell
+        num_polys: number of polygons in the scene
+
+    Returns:
+        VoxelGrid with `neighborhood=True`
+    """
+    if grid.sparse:
+        cell_keys = dilate_cell_keys(grid)
+        num_cells = cell_keys.size
+    else:
+        cell_keys = grid.cell_keys
+        num_cells = grid.cell_offset.size - 1
+
+    # Cells are split into contiguous chunks processed in parallel.
+    # Each chunk has its own array with the cell which has most recently
+    # collected a given polygon (used to skip duplicates).
+    num_chunks = min(get_num_threads(), max(num_cells, 1))
+    chunk_size = (num_cells + num_chunks - 1) // num_chunks
+
+    # Count polygons in each neighborhood
+    cell_offset = np.zeros(num_cells + 1, dtype=INT)
+    for ch in prange(num_chunks):
+        last_seen = np.full(num_polys, -1, dtype=INT)
+        no_output = np.zeros(0, dtype=INT)
+        for ci in range(ch * chunk_size, min((ch + 1) * chunk_size, num_cells)):
+            i, j, k = get_cell_coords(grid.sparse, grid.shape, cell_keys, ci)
+            cell_offset[ci + 1] = collect_neighborhood(
+                grid, i, j, k, ci, last_seen, no_output, -1
+            )
+    cell_offset = np.cumsum(cell_offset).astype(INT)
+
+    # Fill the cells
+    cell_polys = np.zeros(cell_offset[-1], dtype=INT)
+    for ch in prange(num_chunks):
+        last_seen = np.full(num_polys, -1, dtype=INT)
+        for ci in range(ch * chunk_size, min((ch + 1) * chunk_size, num_cells)):
+            i, j, k = get_cell_coords(grid.sparse, grid.shape, cell_keys, ci)
+            collect_neighborhood(grid, i, j, k, ci, last_seen, cell_polys, cell_offset[ci])
+
+    return VoxelGrid(
+        grid.origin, grid.shape, grid.step, True, grid.sparse, cell_offset, cell_polys, cell_keys
+    )
+
+
+@njit(parallel=True)
+def dilate_cell_keys(grid: VoxelGrid) -> NDArray[np.int64]:
+    """Returns sorted Morton codes of the stored cells of a sparse grid and their neighbors."""
+    nx, ny, nz = grid.shape
+    num_cells = grid.cell_keys.size
+    keys = np.full(27 * num_cells, -1, dtype=np.int64)
+    for ci in prange(num_cells):
+        i, j, k = morton_decode(grid.cell_keys[ci])
+        n = 27 * ci
+        for ni in range(max(i - 1, 0), min(i + 2, nx)):
+            for nj in range(max(j - 1, 0), min(j + 2, ny)):
+                for nk in range(max(k - 1, 0), min(k + 2, nz)):
+                    keys[n] = morton_encode(ni, nj, nk)
+                    n += 1
+    keys = np.unique(keys)
+    return keys[keys >= 0]
+
+
+@njit
+def get_cell_coords(
+    sparse: bool,
+    shape: IndexType,
+    cell_keys: NDArray[np.int64],
+    ci: int,
+) -> tuple[int, int, int]:
+    """Returns the coordinates of the cell `ci` relative to the grid origin."""
+    if sparse:
+        return morton_decode(cell_keys[ci])
+    nx, ny, nz = shape
+    return ci // (ny * nz), (ci // nz) % ny, ci % nz
+
+
+@njit
+def collect_neighborhood(
+    grid: VoxelGrid,
+    i: int,
+    j: int,
+    k: int,
+    stamp: int,
+    last_seen: IndexType,
+    output: IndexType,
+    start: int,
+) -> int:
+    """Collects unique polygons of the cell (i, j, k) and its neighbors.
+
+    Cell coordinates are relative to the grid origin.
+    Polygons are written to `output[start:]`, unless `start` is negative
+    (then they are only counted).
+    `stamp` must be different for each collected neighborhood,
+    it is written to `last_seen` to skip duplicates.
+
+    Returns:
+        number of unique polygons in the neighborhood
+    """
+    nx, ny, nz = grid.shape
+    counter = 0
+    for ni in range(max(i - 1, 0), min(i + 2, nx)):
+        for nj in range(max(j - 1, 0), min(j + 2, ny)):
+            for nk in range(max(k - 1, 0), min(k + 2, nz)):
+                if grid.sparse:
+                    cj = search_cell_key(grid.cell_keys, morton_encode(ni, nj, nk))
+                    if cj < 0:
+                        continue
+                else:
+                    cj = (ni * ny + nj) * nz + nk
+                for pi in range(grid.cell_offset[cj], grid.cell_offset[cj + 1]):
+                    pn = grid.cell_polys[pi]
+                    if last_seen[pn] == stamp:
+                        continue
+                    last_seen[pn] = stamp
+                    if start >= 0:
+                        output[start + counter] = pn
+                    counter += 1
+    return counter
+
+
+@njit
+def get_local_cell_index(grid: VoxelGrid, i: int, j: int, k: int) -> int:
+    """Returns the index of the cell (i, j, k) relative to the grid origin.
+
+    Returns -1 if the cell is outside the grid or if it is not stored in the sparse grid.
+    """
+    if i < 0 or j < 0 or k < 0 or i >= grid.shape[0] or j >= grid.shape[1] or k >= grid.shape[2]:
+        return -1
+    if grid.sparse:
+        return search_cell_key(grid.cell_keys, morton_encode(i, j, k))
+    return (i * grid.shape[1] + j) * grid.shape[2] + k
+
+
+@njit
+def search_cell_key(cell_keys: NDArray[np.int64], key: int) -> int:
+    """Returns the index of `key` in the sorted array `cell_keys` or -1 if it is not there."""
+    ci = np.searchsorted(cell_keys, key)
+    if ci < cell_keys.size and cell_keys[ci] == key:
+        return ci
+    return -1
+
+
+@njit
+def get_cell_index(grid: VoxelGrid, x: int, y: int, z: int) -> int:
+    """Returns the index of the cell (x, y, z) or -1 if the cell is not in the grid."""
+    return get_local_cell_index(grid, x - grid.origin[0], y - grid.origin[1], z - grid.origin[2])
+
+
+@njit
+def get_cell_polygons(grid: VoxelGrid, x: int, y: int, z: int) -> IndexType:
+    """Returns polygons (view) of the cell (x, y, z). Cells outside the grid are empty."""
+    ci = get_cell_index(grid, x, y, z)
+    if ci < 0:
+        return grid.cell_polys[0:0]
+    return grid.cell_polys[grid.cell_offset[ci]:grid.cell_offset[ci + 1]]
@@ -5,7 +5,7 @@ from building3d.display.plot_objects import plot_objects
 from building3d.io.b3d import write_b3d
 from building3d.io.stl import read_stl
 from building3d.logger import init_logger
-from building3d.sim.rays.dump_buffers import read_buffers
+from building3d.sim.rays.dump_buffers import open_buffers
 from building3d.sim.rays.movie_from_buffer import make_movie_from_buffer
 from building3d.sim.rays.ray_buff_plotter import RayBuffPlotter
 from building3d.sim.rays.simulation import Simulation
@@ -30,8 +30,7 @@ if __name__ == "__main__":
     sim_cfg.rays["source"] = (0.0, 0.0, 8.0)
     sim_cfg.rays["absorbers"] = [[0.0, 0.0, 4.0]]
     sim_cfg.surfaces["absorption"]["default"] = 0.1
-    sim_cfg.engine["voxel_size"] = 0.25
-    sim_cfg.engine["search_transparent"] = False  # Because it is very slow for this model
+    sim_cfg.engine["accel"] = "bvh"  # Adapts to uneven polygon density, no voxel size tuning
     sim_cfg.visualization["ray_opacity"] = 0.1
     sim_cfg.visualization["ray_trail_opacity"] = 0.1
 
@@ -47,8 +46,8 @@ if __name__ == "__main__":
     b3d_file = os.path.join(project_dir, "building.b3d")
     write_b3d(b3d_file, building)
 
-    # Read buffers
-    pos_buf, enr_buf, hit_buf = read_buffers(sim_cfg.paths["buffer_dir"], sim_cfg)
+    # Open buffers (memory-mapped, read lazily by the plotter and the movie renderer)
+    pos_buf, enr_buf, hit_buf = open_buffers(sim_cfg.paths["buffer_dir"], sim_cfg)
 
     # Show plot
     rays = RayBuffPlotter(building, pos_buf, enr_buf)
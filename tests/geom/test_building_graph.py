@@ -3,11 +3,14 @@ import time
 import pytest
 
 from building3d.geom.building import Building
+from building3d.geom.building.graph import find_facing_polygons
 from building3d.geom.building.graph import graph_polygon
 from building3d.geom.building.graph import graph_solid
 from building3d.geom.building.graph import graph_wall
 from building3d.geom.building.graph import graph_zone
+from building3d.geom.polygon import Polygon
 from building3d.geom.solid.box import box
+from building3d.geom.wall import Wall
 from building3d.geom.zone import Zone
 
 
@@ -73,6 +76,14 @@ def test_graph_polygon(g_def, g_fac, g_ove, gz_all):
     assert gz_all["b/z0"] == ["b/z1"]
 
 
+def test_find_facing_polygons(bdg, g_fac):
+    pairs = find_facing_polygons(bdg)
+    assert pairs == [("b/z0/s0/wall_2/poly_2", "b/z0/s1/wall_0/poly_0")]
+
+    # Same pairs as in the graph based on all polygon pairs
+    assert set(pairs) == set((k, v) for k, vs in g_fac.items() for v in vs if k < v)
+
+
 def test_graph_wall_solid_zone(bdg, g_def):
     gw = graph_wall(bdg, g=g_def)
     assert len(list(gw.keys())) == len(
@@ -115,3 +126,45 @@ def test_graph_method_caching(bdg):
     assert "b/z0/s0" in gs
     assert "b/z0/s0/wall_0" in gw
     assert "b/z0/s0/wall_0/poly_0" in gp
+
+
+def as_sets(g):
+    return {k: set(v) for k, v in g.items()}
+
+
+def test_graph_update_on_edits():
+    s0 = box(1, 1, 1, (0, 0, 0), "s0")
+    s1 = box(1, 1, 1, (1, 0.5, 0), "s1")  # Partially facing s0
+    bdg = Building([Zone([s0, s1], "z0")], "b")
+
+    for params in [{}, {"overlapping": True}]:
+        # Polygons replaced by slicing (Wall.replace_polygon)
+        bdg.get_graph(new=True, level="polygon", **params)
+        bdg.stitch_solids()
+        num_polygons = len(bdg.get_polygon_paths())
+        assert num_polygons > 12
+        expected = as_sets(graph_polygon(bdg, **params))
+        assert as_sets(bdg.get_graph(level="polygon", **params)) == expected
+
+    # New solid (Zone.add_solid) and new zone (Building.add_zone)
+    bdg.zones["z0"].add_solid(box(1, 1, 1, (0, 0, 1), "s2"))
+    bdg.add_zone(Zone([box(1, 1, 1, (0, -1, 0), "s3")], "z1"))
+    g = bdg.get_graph(level="polygon", overlapping=True)
+    assert len(g) == num_polygons + 12
+    assert as_sets(g) == as_sets(graph_polygon(bdg, overlapping=True))
+
+    # Replaced wall (Solid.replace_wall)
+    s3 = bdg.get("b/z1/s3")
+    wall = s3.get("b/z1/s3/wall_2")
+    new_wall = Wall([Polygon(p.pts.copy(), name=p.name) for p in wall.children.values()], "new")
+    g_old = bdg.get_graph(level="polygon", overlapping=True)["b/z1/s3/wall_2/poly_2"]
+    assert len(g_old) > 0
+    s3.replace_wall("wall_2", new_wall)
+    g = bdg.get_graph(level="polygon", overlapping=True)
+    assert "b/z1/s3/wall_2/poly_2" not in g
+    assert g["b/z1/s3/new/poly_2"] == g_old
+    assert as_sets(g) == as_sets(graph_polygon(bdg, overlapping=True))
+
+    # Higher-level graphs are updated as well
+    expected = graph_solid(bdg, overlapping=True, g=graph_polygon(bdg, overlapping=True))
+    assert as_sets(bdg.get_graph(level="solid", overlapping=True)) == as_sets(expected)
@@ -1,6 +1,8 @@
 from building3d.display.plot_objects import plot_objects
 from building3d.geom.building import Building
+from building3d.geom.building.graph import graph_polygon
 from building3d.geom.solid.box import box
+from building3d.geom.solid.stitch import next_adjacent_polygons
 from building3d.geom.zone import Zone
 
 
@@ -31,5 +33,36 @@ def test_building_stitch_solids(show=False):
         plot_objects((building, ))
 
 
+def test_building_stitch_solids_floor_plan():
+    # Rooms in every second row are shifted, so each room has 2 neighbors above and below
+    solids = []
+    for j in range(4):
+        for i in range(3):
+            dx = 2.0 if j % 2 else 0.0
+            solids.append(box(4, 3, 3, (4 * i + dx, 3 * j, 0), f"r_{i}_{j}"))
+    building = Building([Zone(solids, "z")], "b")
+    building.stitch_solids()
+
+    # No polygons left to slice
+    for s1, s2 in [(s1, s2) for s1 in solids for s2 in solids if s1 is not s2]:
+        assert next_adjacent_polygons(s1, s2) is None
+
+    # The graph updated after stitching is the same as a new one
+    g = building.get_graph(level="polygon", facing=True, overlapping=True)
+    assert len(g) == len(building.get_polygon_paths())
+    g_new = graph_polygon(building, facing=True, overlapping=True)
+    assert {k: set(v) for k, v in g.items()} == {k: set(v) for k, v in g_new.items()}
+
+    gs = building.get_graph(level="solid", facing=True, overlapping=False)
+    assert set(gs["b/z/r_1_1"]) == {
+        "b/z/r_0_1",
+        "b/z/r_2_1",
+        "b/z/r_1_0",
+        "b/z/r_2_0",
+        "b/z/r_1_2",
+        "b/z/r_2_2",
+    }
+
+
 if __name__ == "__main__":
     test_building_stitch_solids(show=True)
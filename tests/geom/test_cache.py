@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from building3d.geom.building import Building
+from building3d.geom.cache import cache_info
+from building3d.geom.cache import reset_cache_info
+from building3d.geom.polygon import Polygon
+from building3d.geom.solid.box import box
+from building3d.geom.zone import Zone
+
+
+def test_cached_properties():
+    s0 = box(1, 1, 1, (0, 0, 0), "s0")
+    s1 = box(2, 1, 1, (1, 0, 0), "s1")
+    bdg = Building([Zone([s0, s1], "z")], "b")
+    reset_cache_info()
+
+    # The first call is a miss, the next ones are hits
+    assert np.isclose(bdg.volume(), 3.0)
+    assert cache_info("volume") == (0, 4)  # Building, zone and two solids
+    assert np.isclose(bdg.volume(), 3.0)
+    assert cache_info("volume") == (1, 4)
+
+    mesh = bdg.get_mesh()
+    assert bdg.get_mesh() is mesh
+    assert np.allclose(bdg.bbox(), [[0, 0, 0], [3, 1, 1]])
+    assert np.isclose(s1.area(), 10.0)
+    assert cache_info("bbox").misses == 1
+
+    # Adding a solid clears the caches of the zone and the building, but not of other solids
+    bdg.zones["z"].add_solid(box(1, 1, 1, (0, 0, 5), "s2"))
+    assert bdg.get_mesh() is not mesh
+    assert np.allclose(bdg.bbox(), [[0, 0, 0], [3, 1, 6]])
+    assert np.isclose(bdg.volume(), 4.0)
+    assert cache_info("volume") == (3, 7)  # Hits of s0 and s1
+
+    # Replacing a polygon clears the caches of its wall, solid, zone and building
+    wall = s1.walls["floor"]
+    assert wall.bbox()[0][2] == pytest.approx(0.0)
+    old_poly = list(wall.polygons.values())[0]
+    new_poly = Polygon(old_poly.pts + np.array([0.0, 0.0, -1.0]), name="new")
+    wall.replace_polygon(old_poly.name, new_poly)
+    assert wall.bbox()[0][2] == pytest.approx(-1.0)
+    assert s1.bbox()[0][2] == pytest.approx(-1.0)
+    assert bdg.bbox()[0][2] == pytest.approx(-1.0)
+    assert s0.bbox()[0][2] == pytest.approx(0.0)
+
+
+def test_cached_polygon_paths():
+    s0 = box(1, 1, 1, (0, 0, 0), "s0")
+    zone = Zone([s0], "z")
+    bdg = Building([zone], "b")
+    paths = s0.get_polygon_paths()
+    assert paths[0].startswith("b/z/s0/")
+    assert s0.get_polygon_paths() is paths
+    assert bdg.get_polygon_paths() == paths
+
+    # Paths are recomputed after the solid is moved to another building
+    Building([Zone([s0], "z1")], "b1")
+    assert s0.get_polygon_paths()[0].startswith("b1/z1/s0/")
@@ -0,0 +1,35 @@
+import numpy as np
+
+from building3d.geom.bboxes import are_bboxes_overlapping
+from building3d.geom.bboxes import find_overlapping_bboxes
+from building3d.geom.bboxes import sweep_overlapping_bboxes
+
+
+def test_find_overlapping_bboxes():
+    rng = np.random.default_rng(0)
+    num_boxes = 300
+    bbox_min = rng.uniform(0, 10, size=(num_boxes, 3))
+    bbox_max = bbox_min + rng.uniform(0, 1, size=(num_boxes, 3))
+    # Flat boxes (like polygons in the XY plane) and touching boxes
+    bbox_max[:50, 2] = bbox_min[:50, 2]
+    bbox_min[50:60] = bbox_max[60:70]
+
+    expected = []
+    for i in range(num_boxes):
+        for j in range(i + 1, num_boxes):
+            if are_bboxes_overlapping((bbox_min[i], bbox_max[i]), (bbox_min[j], bbox_max[j])):
+                expected.append((i, j))
+
+    # Pair by pair (few boxes) and sort and sweep (many boxes) give the same pairs
+    assert len(expected) > 0
+    pairs = find_overlapping_bboxes(bbox_min, bbox_max)
+    assert [tuple(p) for p in pairs] == expected
+    pairs = sweep_overlapping_bboxes(bbox_min, bbox_max)
+    assert [tuple(p) for p in pairs] == expected
+
+
+def test_find_overlapping_bboxes_none():
+    bbox_min = np.array([[0.0, 0.0, 0.0], [2.0, 0.0, 0.0]])
+    bbox_max = bbox_min + 1.0
+    assert find_overlapping_bboxes(bbox_min, bbox_max).shape == (0, 2)
+    assert sweep_overlapping_bboxes(bbox_min, bbox_max).shape == (0, 2)
@@ -0,0 +1,81 @@
+import numpy as np
+
+from building3d.geom.building import Building
+from building3d.geom.bboxes import find_overlapping_bboxes
+from building3d.geom.building.graph import check_polygon_pairs
+from building3d.geom.building.graph import check_polygon_pairs_parallel
+from building3d.geom.building.graph import graph_polygon
+from building3d.geom.building.graph import iter_polygons
+from building3d.geom.building.graph import stack_arrays
+from building3d.geom.building.graph import strip_graph
+from building3d.geom.building.graph_csr import get_edges
+from building3d.geom.building.graph_csr import get_index_maps
+from building3d.geom.building.graph_csr import get_node_paths
+from building3d.geom.building.graph_csr import graph_csr_to_dict
+from building3d.geom.building.graph_csr import make_graph_csr
+from building3d.geom.building.graph_csr import roll_up
+from building3d.geom.solid.box import box
+from building3d.geom.zone import Zone
+from building3d.io.arrayformat import to_array_format
+
+
+def test_make_graph_csr_and_roll_up():
+    # Duplicates and reversed pairs are merged
+    g = make_graph_csr(np.array([[0, 1], [1, 0], [3, 1], [2, 3], [0, 1]]), 5)
+    assert g.indptr.tolist() == [0, 1, 3, 4, 6, 6]
+    assert g.indices.tolist() == [1, 0, 3, 3, 1, 2]
+    assert get_edges(g).tolist() == [[0, 1], [1, 3], [2, 3]]
+
+    # Nodes 0, 1 -> group 0, nodes 2, 3 -> group 1, node 4 -> group 2
+    gg = roll_up(g, np.array([0, 0, 1, 1, 2]), 3)
+    assert graph_csr_to_dict(gg, ["a", "b", "c"]) == {"a": ["b"], "b": ["a"], "c": []}
+
+
+def test_building_graph_csr():
+    z0 = Zone([box(1, 1, 1, (0, 0, 0), "s0"), box(1, 1, 1, (0, 1, 0), "s1")], "z0")
+    z1 = Zone([box(1, 1, 1, (1, 0, 0), "s2")], "z1")
+    z2 = Zone([box(1, 1, 1, (5, 5, 5), "s3")], "z2")
+    bdg = Building([z0, z1, z2], "b")
+
+    # Numbering is the same as in the array format
+    _, _, _, walls, solids, zones = to_array_format(bdg)
+    index_maps = get_index_maps(bdg)
+    assert np.array_equal(index_maps[0], walls)
+    assert np.array_equal(index_maps[1], solids)
+    assert np.array_equal(index_maps[2], zones)
+
+    g = bdg.get_graph_csr(level="polygon")
+    assert g.indptr.shape[0] == len(bdg.get_polygon_paths()) + 1
+    assert get_node_paths(bdg, "polygon") == bdg.get_polygon_paths()
+
+    # Rolled up graphs are the same as the stripped dict graphs
+    gp = graph_polygon(bdg, facing=True, overlapping=False, touching=False)
+    for n, level in enumerate(["polygon", "wall", "solid", "zone"]):
+        expected = strip_graph(gp, n=n)
+        gd = bdg.get_graph(level=level)
+        assert list(gd.keys()) == get_node_paths(bdg, level)
+        assert {k: set(v) for k, v in gd.items()} == {k: set(v) for k, v in expected.items()}
+
+    assert bdg.get_graph(level="solid")["b/z0/s0"] == ["b/z0/s1", "b/z1/s2"]
+    assert bdg.get_graph(level="zone") == {"b/z0": ["b/z1"], "b/z1": ["b/z0"], "b/z2": []}
+
+
+def test_check_polygon_pairs_serial_and_parallel():
+    z0 = Zone([box(1, 1, 1, (0, 0, 0), "s0"), box(1, 1, 1, (0, 1, 0), "s1")], "z0")
+    z1 = Zone([box(1, 1, 1, (1, 0, 0.5), "s2")], "z1")
+    bdg = Building([z0, z1], "b")
+
+    polygons = list(iter_polygons(bdg))
+    bbox_min = np.array([poly.pts.min(axis=0) for poly in polygons])
+    bbox_max = np.array([poly.pts.max(axis=0) for poly in polygons])
+    pairs = find_overlapping_bboxes(bbox_min, bbox_max)
+    pts, pts_offset = stack_arrays([poly.pts for poly in polygons])
+    tri, tri_offset = stack_arrays([poly.tri for poly in polygons])
+    vn = np.array([poly.vn for poly in polygons])
+
+    # Few pairs are checked one by one, with the same result as in parallel
+    for facing, overlapping, touching in [(True, False, False), (False, True, True)]:
+        args = (pairs, pts, pts_offset, tri, tri_offset, vn, facing, overlapping, touching)
+        connected = check_polygon_pairs(*args)
+        assert connected.any() and not connected.all()
+        assert np.array_equal(connected, check_polygon_pairs_parallel(*args))
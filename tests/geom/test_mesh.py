@@ -0,0 +1,34 @@
+import numpy as np
+
+from building3d.geom.mesh import vstack_mesh
+from building3d.geom.solid.box import box
+from building3d.geom.types import FLOAT
+from building3d.geom.types import INT
+
+
+def test_vstack_mesh():
+    polys = [p for w in box(1, 1, 1).walls.values() for p in w.polygons.values()]
+    t_pts = tuple(p.pts for p in polys)
+    t_tri = tuple(p.tri for p in polys)
+
+    verts, faces = vstack_mesh(t_pts, t_tri)
+    assert verts.shape == (24, 3) and verts.dtype == FLOAT
+    assert faces.shape == (12, 3) and faces.dtype == INT
+    for i, p in enumerate(polys):
+        assert np.allclose(verts[faces[2 * i : 2 * i + 2]], p.pts[p.tri])
+
+    # Points shared by polygons are merged, the triangles stay the same
+    m_verts, m_faces = vstack_mesh(t_pts, t_tri, merge_points=True)
+    assert m_verts.shape == (8, 3)
+    assert np.allclose(m_verts[m_faces], verts[faces])
+    assert np.allclose(m_verts[0], verts[0])
+
+    # Many objects
+    rng = np.random.default_rng(0)
+    t_pts = tuple(rng.random((3, 3)) for _ in range(5000))
+    t_tri = tuple(np.array([[0, 1, 2]], dtype=INT) for _ in range(5000))
+    verts, faces = vstack_mesh(t_pts, t_tri)
+    assert np.array_equal(faces, np.arange(15000).reshape((-1, 3)))
+
+    verts, faces = vstack_mesh((), ())
+    assert verts.shape == (0, 3) and faces.shape == (0, 3)
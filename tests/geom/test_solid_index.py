@@ -0,0 +1,51 @@
+import numpy as np
+
+from building3d.geom.building import Building
+from building3d.geom.building.find_location import find_location
+from building3d.geom.building.find_location import find_locations
+from building3d.geom.building.graph_csr import get_node_paths
+from building3d.geom.building.solid_index import find_solids
+from building3d.geom.solid.box import box
+from building3d.geom.solid.floor_plan import floor_plan
+from building3d.geom.zone import Zone
+
+
+def test_find_solids():
+    # L-shaped (concave) solid, rotated solid and adjacent boxes
+    s0 = floor_plan([(0, 0), (2, 0), (2, 1), (1, 1), (1, 2), (0, 2)], 1.5, name="s0")
+    s1 = floor_plan([(0, 0), (1, 0), (1, 1), (0, 1)], 1.0, (3, 1, 0), rot_angle=0.5, name="s1")
+    s2 = box(1, 1, 1, (2, 0, 0), name="s2")
+    s3 = box(1, 1, 2, (0, 0, 1.5), name="s3")
+    bdg = Building([Zone([s0, s1], "z0"), Zone([s2, s3], "z1")], "b")
+
+    rng = np.random.default_rng(0)
+    points = rng.uniform((-0.5, -0.5, -0.5), (4.5, 3.0, 4.0), size=(1000, 3))
+    # Points at the boundaries (shared by s0 and s2, s0 and s3)
+    points[:3] = [[2.0, 0.5, 0.5], [0.5, 0.5, 1.5], [1.5, 1.0, 0.0]]
+
+    # The same solids are found as with `Solid.is_point_inside()` (the first one in order)
+    solids = [s0, s1, s2, s3]
+    expected = []
+    for pt in points:
+        found = [sn for sn, s in enumerate(solids) if s.is_point_inside(pt)]
+        expected.append(found[0] if found else -1)
+
+    index = bdg.get_solid_index()
+    result = find_solids(points, index)
+    assert result.tolist() == expected
+    assert result[:3].tolist() == [0, 0, 0]
+    assert (result == -1).sum() > 0
+    assert (result == 1).sum() > 0
+
+    solid_paths = get_node_paths(bdg, "solid")
+    assert bdg.get_solid_paths() == solid_paths
+    assert bdg.get_solid_numbers() == {path: sn for sn, path in enumerate(solid_paths)}
+    assert find_location(points[0], bdg, "b/z1/s2", "b/z0/s0") == "b/z1/s2"
+    assert find_location(points[0], bdg) == "b/z0/s0"
+
+    paths = find_locations(points, bdg)
+    assert paths == [get_node_paths(bdg, "solid")[sn] if sn >= 0 else None for sn in expected]
+
+    # The index is rebuilt after geometry changes
+    bdg.zones["z1"].add_solid(box(1, 1, 1, (10, 10, 10), name="s4"))
+    assert find_locations([[10.5, 10.5, 10.5]], bdg) == ["b/z1/s4"]
@@ -3,6 +3,9 @@ import numpy as np
 from building3d.geom.points import new_point
 from building3d.geom.polygon import Polygon
 from building3d.geom.solid import Solid
+from building3d.geom.solid.stitch import are_polygons_adjacent
+from building3d.geom.solid.stitch import get_walls_and_polygons
+from building3d.geom.solid.stitch import plane_hash_keys
 from building3d.geom.solid.stitch import stitch_solids
 from building3d.geom.types import FLOAT
 from building3d.geom.wall import Wall
@@ -75,10 +78,30 @@ def test_stitch_solids(show=False):
     assert s0.has_correct_interface(s5)
     assert s0.has_correct_interface(s6)
 
+    # No polygons left to slice (checking all pairs)
+    for sa, sb in [(s0, s1), (s0, s3), (s1, s2), (s1, s3), (s4, s0), (s0, s5), (s0, s6)]:
+        assert not any(
+            are_polygons_adjacent(p1, p2)
+            for _, p1 in get_walls_and_polygons(sa)
+            for _, p2 in get_walls_and_polygons(sb)
+        )
+
     if show:
         return s0, s1, s2, s3, s4, s5, s6
 
 
+def test_plane_hash_keys():
+    walls, floor, roof = get_walls(size=0.5, dx=0.25, dy=0.25, dz=1.0)
+    p = roof.children["roof"]
+    assert plane_hash_keys(p, both_sides=False) == plane_hash_keys(p.flip(), both_sides=False)
+    assert plane_hash_keys(p, both_sides=False) != plane_hash_keys(floor.children["floor"], False)
+
+    # Close to the boundary of a bucket
+    p = Polygon(p.pts + np.array([0.0, 0.0, 0.5e-4 - 1e-10]), name="p")
+    assert len(plane_hash_keys(roof.children["roof"], both_sides=True)) == 1
+    assert len(plane_hash_keys(p, both_sides=True)) == 2
+
+
 if __name__ == "__main__":
     from building3d.display.plot_objects import plot_objects
 
@@ -3,7 +3,12 @@ from tempfile import TemporaryDirectory
 
 import numpy as np
 
+from building3d.io.arrayformat import to_array_format
+from building3d.io.stl import read_ascii_stl_facets
+from building3d.io.stl import read_stl_array_format
+from building3d.io.stl import read_stl_facets
 from building3d.io.stl import read_stl, write_stl
+from building3d.geom.polygon import Polygon
 from building3d.geom.solid.box import box
 from building3d.geom.zone import Zone
 from building3d.geom.building import Building
@@ -57,3 +62,100 @@ def test_stl_two_solids():
 
         # However, both buildings should have same volume
         assert np.isclose(new_building.volume(), building.volume())
+
+
+def test_stl_binary():
+    solid_1 = box(1, 1, 1)
+    solid_2 = box(1, 2, 1, (1, 0, 0))
+    building = Building([Zone([solid_1, solid_2])])
+
+    with TemporaryDirectory() as tmpdir:
+        output_file = Path(tmpdir) / "building.stl"
+        write_stl(str(output_file), building, binary=True)
+        assert output_file.stat().st_size == 84 + 50 * 24
+
+        # The header doesn't look like an ASCII file, but it keeps the building name
+        with open(output_file, "rb") as f:
+            assert not f.read(80).startswith(b"solid")
+        assert read_stl_facets(str(output_file))[0][0] == building.name
+
+        # A binary file has only one solid
+        new_building = read_stl(str(output_file))
+        assert len(new_building.get_polygon_paths()) == 24
+        assert np.isclose(new_building.volume(), building.volume())
+
+
+def test_stl_ascii_parser():
+    # Zero normals, exponents, tabs and a degenerate facet
+    text = """solid test
+facet normal 0 0 0
+  outer loop
+    vertex 0 0 0
+    vertex 1.0e+00 0 0
+    vertex\t0 1E0 0
+  endloop
+endfacet
+facet normal 0 0 -1
+  outer loop
+    vertex 0 0 0
+    vertex 1 0 0
+    vertex 2 0 0
+  endloop
+endfacet
+endsolid test
+solid
+endsolid
+"""
+    solids = read_ascii_stl_facets(text)
+    assert [name for name, _, _ in solids] == ["test", ""]
+    name, vertices, normals = solids[0]
+    assert vertices.shape == (2, 3, 3)
+    assert np.allclose(vertices[0], [[0, 0, 0], [1, 0, 0], [0, 1, 0]])
+    assert np.allclose(normals[1], [0, 0, -1])
+    assert solids[1][1].shape == (0, 3, 3)
+
+    with TemporaryDirectory() as tmpdir:
+        output_file = Path(tmpdir) / "test.stl"
+        output_file.write_text(text)
+        bdg = read_stl(str(output_file))
+        # The degenerate facet and the empty solid are skipped
+        polys = [bdg.get(p) for p in bdg.get_polygon_paths()]
+        assert len(polys) == 1
+        assert np.allclose(polys[0].vn, [0, 0, 1])
+
+
+def test_polygon_from_triangles():
+    rng = np.random.default_rng(0)
+    vertices = rng.random((20, 3, 3))
+    # Tiny triangles (Heron's area in the centroid includes EPSILON)
+    vertices[10:] = vertices[10:, :1] + (vertices[10:] - vertices[10:, :1]) * 1e-3
+    polys = Polygon.from_triangles(vertices)
+
+    for pts, poly in zip(vertices, polys):
+        expected = Polygon(pts.copy())
+        assert np.array_equal(poly.pts, expected.pts)
+        assert np.array_equal(poly.tri, expected.tri)
+        assert np.allclose(poly.vn, expected.vn, rtol=1e-12, atol=1e-15)
+        assert np.isclose(poly.area, expected.area, rtol=1e-12, atol=1e-15)
+        assert np.allclose(poly.ctr, expected.ctr, rtol=1e-12, atol=1e-15)
+        assert np.allclose(
+            poly.plane_coefficients, expected.plane_coefficients, rtol=1e-12, atol=1e-15
+        )
+
+
+def test_stl_array_format():
+    solid_1 = box(1, 1, 1)
+    solid_2 = box(1, 2, 1, (1, 0, 0))
+    building = Building([Zone([solid_1, solid_2])])
+
+    with TemporaryDirectory() as tmpdir:
+        output_file = Path(tmpdir) / "building.stl"
+        write_stl(str(output_file), building)
+
+        # Same arrays as after reading the building and converting it
+        arrays = read_stl_array_format(str(output_file))
+        expected = to_array_format(read_stl(str(output_file)))
+        for arr, exp in zip(arrays, expected):
+            assert arr.dtype == exp.dtype
+            assert np.array_equal(arr, exp)
+        assert arrays[4].tolist() == [0, 1]  # One wall per solid
@@ -1,7 +1,7 @@
 import pytest
 import uuid
 
-from building3d.random import random_id, random_within, random_between
+from building3d.random import random_id, random_ids, random_within, random_between
 
 
 def test_random_id_default():
@@ -32,6 +32,17 @@ def test_random_id_invalid_size():
         random_id(33)
 
 
+def test_random_ids():
+    """Test random_ids() returns unique valid UUID strings."""
+    ids = random_ids(100)
+    assert len(set(ids)) == 100
+    for id in ids:
+        u = uuid.UUID(id)
+        assert u.version == 4
+        assert str(u) == id
+    assert random_ids(0) == []
+
+
 def test_random_within():
     """Test random_within() generates values in correct range."""
     # Test with default lim=1.0
@@ -0,0 +1,93 @@
+import numpy as np
+
+from building3d.geom.types import FLOAT
+from building3d.geom.types import INT
+from building3d.sim.rays.absorbers import MIN_ABSORBERS_FOR_GRID
+from building3d.sim.rays.absorbers import collect_hits
+from building3d.sim.rays.absorbers import find_absorber
+from building3d.sim.rays.absorbers import find_next_absorber
+from building3d.sim.rays.absorbers import make_chunk_hits
+from building3d.sim.rays.absorbers import time_to_sphere
+from building3d.sim.rays.voxel_grid import make_point_grid
+
+
+def test_find_absorber():
+    rng = np.random.default_rng(0)
+    radius = 0.3
+    num_absorbers = 4 * MIN_ABSORBERS_FOR_GRID
+    absorbers = rng.uniform(-2, 5, size=(num_absorbers, 3)).astype(FLOAT)
+    grid = make_point_grid(absorbers, radius)
+
+    # Only a few absorbers are used, so all of them are checked without the grid
+    few = absorbers[:MIN_ABSORBERS_FOR_GRID]
+    few_grid = make_point_grid(few, radius)
+
+    num_hits = 0
+    for pos in rng.uniform(-2.5, 5.5, size=(2000, 3)):
+        dist = np.linalg.norm(absorbers - pos, axis=1)
+        inside = np.where(dist < radius)[0]
+        expected = inside[0] if inside.size > 0 else -1
+        assert find_absorber(pos, absorbers, radius ** 2, grid) == expected
+        num_hits += expected >= 0
+
+        inside = np.where(dist[:MIN_ABSORBERS_FOR_GRID] < radius)[0]
+        expected = inside[0] if inside.size > 0 else -1
+        assert find_absorber(pos, few, radius ** 2, few_grid) == expected
+
+    assert num_hits > 0
+
+
+def test_collect_hits():
+    rng = np.random.default_rng(1)
+    num_rays = 1000
+    num_absorbers = 5
+    absorbed_by = rng.integers(-1, num_absorbers, size=num_rays).astype(INT)
+    absorbed_energy = rng.uniform(0, 1, size=num_rays)
+    hits = np.ones(num_absorbers, dtype=FLOAT)
+
+    expected = hits.copy()
+    for rn in range(num_rays):
+        if absorbed_by[rn] >= 0:
+            expected[absorbed_by[rn]] += absorbed_energy[rn]
+
+    # The accumulators are reset in each call, so they can be reused
+    chunk_hits = make_chunk_hits(num_rays, num_absorbers)
+    chunk_hits[:] = 1.0
+    collect_hits(absorbed_by, absorbed_energy, hits, chunk_hits)
+    assert np.allclose(hits, expected)
+    assert (absorbed_by == -1).all()
+
+    collect_hits(absorbed_by, absorbed_energy, hits, chunk_hits)
+    assert np.allclose(hits, expected)
+
+
+def test_find_next_absorber():
+    rng = np.random.default_rng(2)
+    radius = 0.3
+    num_absorbers = 4 * MIN_ABSORBERS_FOR_GRID
+    absorbers = rng.uniform(-2, 5, size=(num_absorbers, 3)).astype(FLOAT)
+    grid = make_point_grid(absorbers, radius)
+
+    # Absorbers found along the ray with the grid are the same as when checking all of them
+    num_hits = 0
+    for _ in range(2000):
+        pos = rng.uniform(-3, 6, size=3)
+        velocity = rng.normal(size=3) * 343.0
+        if rng.uniform() < 0.2:
+            # Ray parallel to the grid cells
+            velocity[rng.integers(3)] = 0.0
+        t_max = rng.choice([np.inf, rng.uniform(0, 0.02)])
+
+        t_all = np.array([time_to_sphere(pos, velocity, a, radius ** 2) for a in absorbers])
+        t_all[t_all > t_max] = np.inf
+        expected_an = int(np.argmin(t_all)) if np.isfinite(t_all.min()) else -1
+
+        t, an = find_next_absorber(pos, velocity, t_max, absorbers, radius ** 2, grid)
+        assert an == expected_an
+        if an >= 0:
+            assert np.isclose(t, t_all[an])
+            num_hits += 1
+        else:
+            assert t == np.inf
+
+    assert num_hits > 0
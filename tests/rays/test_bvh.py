@@ -0,0 +1,102 @@
+import numpy as np
+
+from building3d.geom.building import Building
+from building3d.geom.solid.box import box
+from building3d.geom.solid.floor_plan import floor_plan
+from building3d.geom.zone import Zone
+from building3d.geom.types import FLOAT
+from building3d.io.arrayformat import to_array_format
+from building3d.sim.rays.bvh import bvh_first_hit
+from building3d.sim.rays.bvh import make_bvh
+from building3d.sim.rays.find_target import find_next_hit
+from building3d.sim.rays.scene import make_scene
+
+
+def make_test_scene():
+    s0 = box(1, 1, 1, (0, 0, 0), "s0")
+    s1 = floor_plan(plan=[(1, 0), (2, 0), (2, 1), (3, 1), (3, 2), (1, 2)], height=1, name="s1")
+    s2 = box(0.3, 0.2, 0.1, (0.3, 0.4, 0.2), "s2")  # Small obstacle inside s0
+    building = Building([Zone([s0, s1, s2], "z")], "b")
+    points, faces, polygons, walls, _, _ = to_array_format(building)
+    return make_scene(points, faces, polygons, len(walls))
+
+
+def test_make_bvh():
+    scene = make_test_scene()
+    bvh = make_bvh(scene, leaf_size=2)
+    num_tri = scene.tri.shape[0]
+
+    # Each triangle is referenced by exactly one leaf
+    leaves = np.where(bvh.node_left < 0)[0]
+    referenced = np.zeros(num_tri, dtype=int)
+    for node in leaves:
+        referenced[bvh.node_start[node]:bvh.node_start[node] + bvh.node_count[node]] += 1
+    assert (referenced == 1).all()
+    assert len(leaves) > 1
+
+    # Children are contained in their parents
+    for node in np.where(bvh.node_left >= 0)[0]:
+        for child in (bvh.node_left[node], bvh.node_left[node] + 1):
+            assert (bvh.node_bbox[child, 0] >= bvh.node_bbox[node, 0]).all()
+            assert (bvh.node_bbox[child, 1] <= bvh.node_bbox[node, 1]).all()
+
+    # Triangles are contained in their leaves
+    for node in leaves:
+        for ti in range(bvh.node_start[node], bvh.node_start[node] + bvh.node_count[node]):
+            v0 = bvh.tri_v0[ti]
+            for vertex in (v0, v0 + bvh.tri_e1[ti], v0 + bvh.tri_e2[ti]):
+                assert (vertex >= bvh.node_bbox[node, 0] - 1e-12).all()
+                assert (vertex <= bvh.node_bbox[node, 1] + 1e-12).all()
+
+
+def test_bvh_first_hit():
+    scene = make_test_scene()
+    bvh = make_bvh(scene)
+    transparent = np.zeros(scene.vn.shape[0], dtype=np.bool_)
+
+    rng = np.random.default_rng(0)
+    num_hits = 0
+    for _ in range(300):
+        pos = rng.uniform((0.05, 0.05, 0.05), (0.95, 0.95, 0.95)).astype(FLOAT)
+        velocity = rng.uniform(-1, 1, 3).astype(FLOAT) * 343.0
+
+        exp_pn, exp_t = find_next_hit(pos, velocity, scene, transparent)
+        pn, t = bvh_first_hit(bvh, pos, velocity, transparent)
+        assert np.isclose(t, exp_t)
+        if pn >= 0:
+            num_hits += 1
+            # Adjacent solids have coincident polygons, any of them can be returned
+            assert np.allclose(np.abs(scene.plane[pn]), np.abs(scene.plane[exp_pn]))
+
+            # The polygon which has been hit can be skipped
+            pn_skip, t_skip = bvh_first_hit(bvh, pos, velocity, transparent, skip=pn)
+            exp_pn_skip, exp_t_skip = find_next_hit(pos, velocity, scene, transparent, skip=pn)
+            assert pn_skip != pn
+            assert np.isclose(t_skip, exp_t_skip)
+
+    assert num_hits > 250
+
+
+def test_bvh_transparent():
+    scene = make_test_scene()
+    bvh = make_bvh(scene)
+
+    pos = np.array([0.5, 0.5, 0.5], dtype=FLOAT)
+    velocity = np.array([0.0, 0.0, -1.0], dtype=FLOAT)
+
+    # The ray hits the top of the obstacle first
+    transparent = np.zeros(scene.vn.shape[0], dtype=np.bool_)
+    pn, t = bvh_first_hit(bvh, pos, velocity, transparent)
+    assert np.isclose(t, 0.2)
+
+    # If it's transparent, the ray hits the bottom of the obstacle
+    transparent[pn] = True
+    pn_bottom, t = bvh_first_hit(bvh, pos, velocity, transparent)
+    assert pn_bottom != pn
+    assert np.isclose(t, 0.3)
+
+    # If both are transparent, the ray hits the floor
+    transparent[pn_bottom] = True
+    pn_floor, t = bvh_first_hit(bvh, pos, velocity, transparent)
+    assert pn_floor not in (pn, pn_bottom)
+    assert np.isclose(t, 0.5)
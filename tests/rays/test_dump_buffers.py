@@ -1,9 +1,13 @@
 from tempfile import TemporaryDirectory
+import os
 
 import numpy as np
+import pytest
 
 from building3d.sim.rays.dump_buffers import dump_buffers
+from building3d.sim.rays.dump_buffers import open_buffers
 from building3d.sim.rays.dump_buffers import read_buffers
+from building3d.sim.rays.dump_buffers import write_steps
 from building3d.geom.building import Building
 from building3d.sim.rays.simulation_config import SimulationConfig
 
@@ -31,3 +35,88 @@ def test_dump_buffers():
         assert np.allclose(pos_buf, pos_buf2)
         assert np.allclose(enr_buf, enr_buf2)
         assert np.allclose(hit_buf, hit_buf2)
+
+
+def test_dump_buffers_in_batches():
+    with TemporaryDirectory() as tmpdir:
+        num_steps = 30
+        batch_size = 10
+        num_rays = 8
+        num_absorbers = 2
+
+        pos_buf = np.random.random((num_steps + 1, num_rays, 3))
+        enr_buf = np.random.random((num_steps + 1, num_rays))
+        hit_buf = np.random.random((num_steps + 1, num_absorbers))
+
+        dummy_bdg = Building()
+        sim_cfg = SimulationConfig(dummy_bdg)
+
+        # Batches share the last/first step, like in the simulation
+        for step in range(0, num_steps, batch_size):
+            batch = slice(step, step + batch_size + 1)
+            dump_buffers(pos_buf[batch], enr_buf[batch], hit_buf[batch], tmpdir, sim_cfg, step)
+
+        assert len(os.listdir(tmpdir)) == 3  # One file per quantity
+
+        pos_buf2, enr_buf2, hit_buf2 = read_buffers(tmpdir, sim_cfg)
+        assert np.allclose(pos_buf, pos_buf2)
+        assert np.allclose(enr_buf, enr_buf2)
+        assert np.allclose(hit_buf, hit_buf2)
+
+        # Files are valid .npy files
+        assert np.allclose(np.load(os.path.join(tmpdir, sim_cfg.paths["energy_file"])), enr_buf)
+
+        # Step range
+        pos_buf2, enr_buf2, hit_buf2 = read_buffers(tmpdir, sim_cfg, 12, 17)
+        assert np.allclose(pos_buf[12:17], pos_buf2)
+        assert np.allclose(enr_buf[12:17], enr_buf2)
+        assert np.allclose(hit_buf[12:17], hit_buf2)
+
+
+def test_open_buffers():
+    with TemporaryDirectory() as tmpdir:
+        num_steps = 20
+        num_rays = 10
+        num_absorbers = 3
+
+        pos_buf = np.random.random((num_steps, num_rays, 3))
+        enr_buf = np.random.random((num_steps, num_rays))
+        hit_buf = np.random.random((num_steps, num_absorbers))
+
+        dummy_bdg = Building()
+        sim_cfg = SimulationConfig(dummy_bdg)
+        dump_buffers(pos_buf, enr_buf, hit_buf, tmpdir, sim_cfg)
+
+        pos_mm, enr_mm, hit_mm = open_buffers(tmpdir, sim_cfg, 5, 15, rays=slice(2, 8))
+        assert isinstance(pos_mm, np.memmap)
+        assert isinstance(enr_mm, np.memmap)
+        assert isinstance(hit_mm, np.memmap)
+        assert not pos_mm.flags.writeable
+
+        assert np.allclose(pos_mm, pos_buf[5:15, 2:8])
+        assert np.allclose(enr_mm, enr_buf[5:15, 2:8])
+        assert np.allclose(hit_mm, hit_buf[5:15])
+
+        pos_buf2, _, _ = read_buffers(tmpdir, sim_cfg, rays=slice(None, None, 3))
+        assert not isinstance(pos_buf2, np.memmap)
+        assert np.allclose(pos_buf2, pos_buf[:, ::3])
+
+        del pos_mm, enr_mm, hit_mm  # Close files before removing the directory
+
+
+def test_write_steps_errors():
+    with TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "data.npy")
+        with pytest.raises(ValueError):
+            write_steps(path, np.zeros((4, 3)), init_step=1)  # New file must start at 0
+
+        write_steps(path, np.zeros((4, 3)))
+        with pytest.raises(ValueError):
+            write_steps(path, np.zeros((4, 3)), init_step=5)  # Gap after step 4
+        with pytest.raises(ValueError):
+            write_steps(path, np.zeros((4, 2)), init_step=4)  # Different shape
+        with pytest.raises(ValueError):
+            write_steps(path, np.zeros((4, 3), dtype=np.int32), init_step=4)  # Different type
+
+        write_steps(path, np.ones((4, 3)), init_step=4)
+        assert np.load(path).shape == (8, 3)
@@ -3,7 +3,10 @@ import pytest
 
 from building3d.geom.polygon import Polygon
 from building3d.geom.types import FLOAT
+from building3d.geom.types import INT
+from building3d.sim.rays.find_target import find_next_hit
 from building3d.sim.rays.find_target import find_target_surface
+from building3d.sim.rays.scene import make_scene
 
 
 
@@ -28,21 +31,59 @@ def test_find_target(x, y, ray_pos, ray_dir, expected_target):
     ], dtype=FLOAT)
     poly = Polygon(pts, name="poly")
     pts, tri = poly.get_mesh()
+    scene = make_scene(pts, tri, np.zeros(tri.shape[0], dtype=INT), 1)
 
     ray_pos = np.array(ray_pos, dtype=FLOAT)
     ray_dir = np.array(ray_dir, dtype=FLOAT)
 
-    # Can't have an empty set because of Numba. Polygon -1 doesn't exist anyway.
-    transparent = set([-1])
-    polygons_to_check = set([0])
+    transparent = np.zeros(1, dtype=np.bool_)
+    polygons_to_check = np.array([0], dtype=INT)
 
     target = find_target_surface(
         pos=ray_pos,
         direction=ray_dir,
-        poly_pts=[pts],
-        poly_tri=[tri],
-        transparent_polygons=transparent,
+        scene=scene,
+        transparent=transparent,
         polygons_to_check=polygons_to_check,
     )
 
     assert target == expected_target
+
+
+def test_find_next_hit():
+    floor = Polygon(
+        np.array([[0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0]], dtype=FLOAT), name="floor"
+    )
+    ceiling = Polygon(
+        np.array([[0, 0, 2], [0, 1, 2], [1, 1, 2], [1, 0, 2]], dtype=FLOAT), name="ceiling"
+    )
+    scene = make_scene(
+        np.vstack((floor.pts, ceiling.pts)),
+        np.vstack((floor.tri, ceiling.tri + floor.pts.shape[0])),
+        np.array([0, 0, 1, 1], dtype=INT),
+        2,
+    )
+    transparent = np.zeros(2, dtype=np.bool_)
+
+    pos = np.array([0.5, 0.5, 0.5], dtype=FLOAT)
+
+    # Going down at 2 m/s, so the floor is hit after 0.25 s
+    velocity = np.array([0.0, 0.0, -2.0], dtype=FLOAT)
+    target, t = find_next_hit(pos, velocity, scene, transparent)
+    assert target == 0
+    assert np.isclose(t, 0.25)
+
+    # Going up, the ceiling is hit after 0.75 s
+    target, t = find_next_hit(pos, -velocity, scene, transparent)
+    assert target == 1
+    assert np.isclose(t, 0.75)
+
+    # The ceiling is skipped
+    target, t = find_next_hit(pos, -velocity, scene, transparent, skip=1)
+    assert target == -1
+    assert t == np.inf
+
+    # Nothing in the direction of the ray
+    velocity = np.array([1.0, 0.0, 0.0], dtype=FLOAT)
+    target, t = find_next_hit(pos, velocity, scene, transparent)
+    assert target == -1
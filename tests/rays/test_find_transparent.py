@@ -1,4 +1,6 @@
+from building3d.io.arrayformat import to_array_format
 from building3d.sim.rays.find_transparent import find_transparent
+from building3d.sim.rays.find_transparent import find_transparent_arrays
 from building3d.geom.building import Building
 from building3d.geom.polygon import Polygon
 from building3d.geom.solid.box import box
@@ -26,3 +28,17 @@ def test_find_transparent():
     assert isinstance(poly1, Polygon)
     assert poly0.is_facing_polygon(poly1)
     assert poly1.is_facing_polygon(poly0)
+
+
+def test_find_transparent_arrays():
+    s0 = box(1.0, 1.0, 1.0, (0.0, 0.0, 0.0), name="s0")
+    s1 = box(1.0, 1.0, 1.0, (1.0, 0.0, 0.0), name="s1")
+    s2 = box(1.0, 1.0, 1.0, (0.0, 1.0, 0.0), name="s2")
+    s3 = box(1.0, 1.0, 1.0, (0.0, 2.0, 0.0), name="s3")
+    # s0-s1 and s0-s2 are transparent, s2-s3 are in different zones
+    building = Building([Zone([s0, s1, s2], name="z0"), Zone([s3], name="z1")], name="b")
+
+    arrays = to_array_format(building)
+    expected = {building.get(path).num for path in find_transparent(building)}
+    assert len(expected) == 4
+    assert find_transparent_arrays(*arrays) == expected
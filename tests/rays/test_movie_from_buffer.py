@@ -0,0 +1,20 @@
+import numpy as np
+
+from building3d.sim.rays.movie_from_buffer import position_buffer_to_lines
+
+
+def test_position_buffer_to_lines():
+    num_steps = 4
+    num_rays = 3
+    pos_buf = np.random.random((num_steps, num_rays, 3))
+
+    line_varr, line_index = position_buffer_to_lines(pos_buf)
+
+    assert line_varr.shape == (num_steps * num_rays, 3)
+    assert len(line_index) == num_rays * (num_steps + 1)
+
+    # Each line has all steps of a single ray
+    line_index = np.array(line_index).reshape(num_rays, num_steps + 1)
+    for rn in range(num_rays):
+        assert line_index[rn, 0] == num_steps
+        assert np.allclose(line_varr[line_index[rn, 1:]], pos_buf[:, rn, :])
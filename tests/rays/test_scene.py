@@ -0,0 +1,84 @@
+import numpy as np
+
+from building3d.geom.building import Building
+from building3d.geom.solid.box import box
+from building3d.geom.solid.floor_plan import floor_plan
+from building3d.geom.zone import Zone
+from building3d.geom.polygon.distance import distance_point_to_polygon
+from building3d.geom.polygon.ispointinside import is_point_inside
+from building3d.io.arrayformat import get_polygon_points_and_faces
+from building3d.io.arrayformat import to_array_format
+from building3d.sim.rays.scene import distance_point_to_scene_polygon
+from building3d.sim.rays.scene import get_num_polygons
+from building3d.sim.rays.scene import get_scene_polygon
+from building3d.sim.rays.scene import is_point_inside_scene_polygon
+from building3d.sim.rays.scene import make_scene
+
+
+def make_test_building() -> Building:
+    s0 = box(1, 1, 1, (0, 0, 0), "s0")
+    s1 = floor_plan(plan=[(1, 0), (2, 0), (2, 1), (3, 1), (3, 2), (1, 2)], height=1, name="s1")
+    return Building([Zone([s0, s1], "z")], "b")
+
+
+def test_make_scene():
+    building = make_test_building()
+    points, faces, polygons, walls, _, _ = to_array_format(building)
+
+    scene = make_scene(points, faces, polygons, len(walls))
+
+    assert get_num_polygons(scene) == len(walls)
+
+    for poly_path in building.get_polygon_paths():
+        poly = building.get(poly_path)
+        pn = poly.num
+
+        # Same points and triangles as in the original array format reconstruction
+        exp_pts, exp_tri = get_polygon_points_and_faces(points, faces, polygons, pn)
+        pts, tri = get_scene_polygon(scene, pn)
+        assert np.allclose(pts, exp_pts)
+        assert (tri == exp_tri).all()
+
+        # Same points, normals and planes as in the polygon instance
+        assert np.allclose(pts, poly.pts)
+        assert np.allclose(scene.vn[pn], poly.vn)
+        assert np.allclose(scene.plane[pn], poly.plane_coefficients)
+        assert np.allclose(scene.bbox[pn], poly.bbox())
+
+        # Edges close the polygon
+        assert np.allclose(scene.edges[scene.pt_offset[pn]:scene.pt_offset[pn + 1]].sum(axis=0), 0)
+        assert np.allclose(
+            scene.edge_sq_len[scene.pt_offset[pn]:scene.pt_offset[pn + 1]],
+            np.sum((np.roll(poly.pts, -1, axis=0) - poly.pts) ** 2, axis=1),
+        )
+
+
+def test_scene_kernels():
+    building = make_test_building()
+    points, faces, polygons, walls, _, _ = to_array_format(building)
+    scene = make_scene(points, faces, polygons, len(walls))
+
+    rng = np.random.default_rng(0)
+    test_pts = rng.uniform(-0.5, 3.5, size=(200, 3))
+
+    for poly_path in building.get_polygon_paths():
+        poly = building.get(poly_path)
+        pn = poly.num
+        pts, tri = get_scene_polygon(scene, pn)
+
+        # Points on the polygon's plane, both inside and outside of the polygon
+        for pt in test_pts:
+            pt_on_plane = pt - np.dot(pt - pts[0], poly.vn) * poly.vn
+            assert is_point_inside_scene_polygon(pt_on_plane, scene, pn, atol=1e-6) == \
+                is_point_inside(pt_on_plane, pts, tri, atol=1e-6)
+
+        # Points in front of and behind the polygon
+        for pt in test_pts:
+            assert np.isclose(
+                distance_point_to_scene_polygon(pt, scene, pn),
+                distance_point_to_polygon(pt, pts, tri, poly.vn),
+            )
+
+        # Vertices are at the boundary, so they are inside
+        for pt in pts:
+            assert is_point_inside_scene_polygon(pt, scene, pn)
@@ -0,0 +1,105 @@
+from tempfile import TemporaryDirectory
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from building3d.geom.building import Building
+from building3d.geom.solid.box import box
+from building3d.geom.zone import Zone
+from building3d.sim.rays.dump_buffers import read_buffers
+from building3d.sim.rays.shards import get_shard_config
+from building3d.sim.rays.shards import get_shard_dir
+from building3d.sim.rays.shards import get_shard_rays
+from building3d.sim.rays.shards import main
+from building3d.sim.rays.shards import run_shards
+from building3d.sim.rays.simulation_config import SimulationConfig
+
+
+def make_config(tempdir: str, subdir: str) -> SimulationConfig:
+    s0 = box(1, 1, 1, (0, 0, 0), "s0")
+    s1 = box(1, 1, 1, (1, 0, 0), "s1")
+    building = Building([Zone([s0, s1], "z")], "b")
+
+    sim_cfg = SimulationConfig(building)
+    sim_cfg.paths["project_dir"] = tempdir
+    sim_cfg.paths["buffer_dir"] = os.path.join(tempdir, subdir)
+    sim_cfg.engine["time_step"] = 1e-4
+    sim_cfg.engine["num_steps"] = 40
+    sim_cfg.engine["batch_size"] = 20
+    sim_cfg.engine["record_rays"] = "none"
+    sim_cfg.rays["num_rays"] = 101
+    sim_cfg.rays["source"] = (1.5, 0.5, 0.5)
+    sim_cfg.rays["absorbers"] = [(1.3, 0.3, 0.3), (0.5, 0.5, 0.5)]
+    sim_cfg.rays["seed"] = 123
+    return sim_cfg
+
+
+def test_get_shard_config():
+    assert [get_shard_rays(10, i, 4) for i in range(4)] == [3, 3, 2, 2]
+    with pytest.raises(ValueError):
+        get_shard_rays(10, 4, 4)
+
+    with TemporaryDirectory() as tempdir:
+        sim_cfg = make_config(tempdir, "states")
+        shard_cfg = get_shard_config(sim_cfg, 2, 3)
+        assert shard_cfg.rays["seed"] == [123, 2]
+        assert shard_cfg.rays["num_rays"] == 33
+        assert shard_cfg.paths["buffer_dir"] == get_shard_dir(sim_cfg.paths["buffer_dir"], 2)
+        assert shard_cfg.building is sim_cfg.building
+        assert sim_cfg.rays["num_rays"] == 101  # The original config is not modified
+
+        sim_cfg.rays["seed"] = None
+        with pytest.raises(ValueError):
+            get_shard_config(sim_cfg, 0, 3)
+
+
+def test_run_shards():
+    num_shards = 3
+
+    with TemporaryDirectory() as tempdir:
+        sim_cfg = make_config(tempdir, "run_0")
+        hit_buf = run_shards(sim_cfg, num_shards, num_workers=1)
+        assert hit_buf.shape == (41, 2)
+        assert hit_buf.sum() > 0
+
+        # Merged hits are the sum of the hits of all shards
+        shard_hits = [
+            read_buffers(get_shard_dir(sim_cfg.paths["buffer_dir"], shard), sim_cfg)[2]
+            for shard in range(num_shards)
+        ]
+        assert np.array_equal(hit_buf, shard_hits[0] + shard_hits[1] + shard_hits[2])
+        saved = np.load(os.path.join(sim_cfg.paths["buffer_dir"], sim_cfg.paths["hits_file"]))
+        assert np.array_equal(saved, hit_buf)
+
+        # Re-running gives bit-identical hits, also if the shards are run separately
+        sim_cfg = make_config(tempdir, "run_1")
+        config_file = os.path.join(tempdir, "config.pkl")
+        with open(config_file, "wb") as f:
+            pickle.dump(sim_cfg, f)
+        for shard in reversed(range(num_shards)):
+            main([config_file, "--shard", str(shard), "--num-shards", str(num_shards)])
+        main([config_file, "--merge", "--num-shards", str(num_shards)])
+        rerun_hits = np.load(os.path.join(sim_cfg.paths["buffer_dir"], sim_cfg.paths["hits_file"]))
+        assert np.array_equal(rerun_hits, hit_buf)
+
+        # Different seed gives different hits
+        sim_cfg = make_config(tempdir, "run_2")
+        sim_cfg.rays["seed"] = 124
+        other_hits = run_shards(sim_cfg, num_shards, num_workers=1)
+        assert not np.array_equal(other_hits, hit_buf)
+
+
+def test_run_shards_in_processes():
+    num_shards = 3
+
+    with TemporaryDirectory() as tempdir:
+        sim_cfg = make_config(tempdir, "serial")
+        serial_hits = run_shards(sim_cfg, num_shards, num_workers=1)
+
+        # The shards run in spawned processes give bit-identical hits
+        sim_cfg = make_config(tempdir, "pool")
+        pool_hits = run_shards(sim_cfg, num_shards, num_workers=2)
+        assert pool_hits.sum() > 0
+        assert np.array_equal(pool_hits, serial_hits)
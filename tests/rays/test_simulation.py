@@ -1,16 +1,25 @@
 from tempfile import TemporaryDirectory
 import os
 
+import numpy as np
+import pytest
+
 from building3d.geom.zone import Zone
 from building3d.geom.building import Building
 from building3d.geom.solid.box import box
 from building3d.geom.zone import Zone
 from building3d.geom.types import FLOAT
+from building3d.io.arrayformat import to_array_format
+from building3d.sim.rays.bvh import BVH
+from building3d.sim.rays.checkpoint import load_checkpoint
+from building3d.sim.rays.dump_buffers import read_buffers
 from building3d.sim.rays.simulation import Simulation
 from building3d.sim.rays.simulation_config import SimulationConfig
+from building3d.sim.rays.voxel_grid import VoxelGrid
 
 
-def test_ray_simulation(show=False):
+@pytest.mark.parametrize("accel", ["voxel", "bvh"])
+def test_ray_simulation(accel, show=False):
 
     with TemporaryDirectory() as tempdir:
         # Create building
@@ -32,6 +41,7 @@ def test_ray_simulation(show=False):
 
         sim_cfg.paths["project_dir"] = tempdir
         sim_cfg.paths["buffer_dir"] = os.path.join(tempdir, "states")
+        sim_cfg.engine["accel"] = accel
         sim_cfg.engine["time_step"] = time_step
         sim_cfg.engine["num_steps"] = num_steps
         sim_cfg.engine["batch_size"] = num_steps
@@ -78,5 +88,238 @@ def test_ray_simulation(show=False):
             assert in_s0 or in_s1 or in_s2
 
 
+@pytest.mark.parametrize("accel", ["voxel", "bvh"])
+def test_ray_simulation_event_mode(accel):
+
+    with TemporaryDirectory() as tempdir:
+        # Create building
+        s0 = box(1, 1, 1, (0, 0, 0), "s0")
+        s1 = box(1, 1, 1, (1, 0, 0), "s1")
+        s2 = box(1, 1, 1, (1, 1, 0), "s2")
+        zone = Zone([s0, s1, s2], "z")
+        building = Building([zone], "b")
+
+        # Simulation configuration
+        sim_cfg = SimulationConfig(building)
+
+        # Overwrite defaults
+        num_rays = 100
+        time_step = 1e-4
+        speed = 343.0
+        num_steps = 80
+
+        sim_cfg.paths["project_dir"] = tempdir
+        sim_cfg.paths["buffer_dir"] = os.path.join(tempdir, "states")
+        sim_cfg.engine["mode"] = "event"
+        sim_cfg.engine["accel"] = accel
+        sim_cfg.engine["time_step"] = time_step
+        sim_cfg.engine["num_steps"] = num_steps
+        sim_cfg.engine["batch_size"] = num_steps // 2
+        sim_cfg.rays["ray_speed"] = speed
+        sim_cfg.rays["num_rays"] = num_rays
+        sim_cfg.rays["source"] = (1.5, 1.5, 0.5)
+        sim_cfg.rays["absorbers"] = [
+            (0.0, 0.0, 0.0),
+            (0.1, 0.1, 0.6),
+            (1.3, 1.3, 0.3),  # Close to the source to assure some ray hits it
+        ]
+
+        # Run simulation
+        sim = Simulation(building, sim_cfg)
+        pos_buf, enr_buf, hit_buf = sim.run()
+
+        # Only the last batch is returned
+        assert pos_buf.shape[0] == num_steps // 2 + 1
+
+        # At least some ray should bounce off a surface
+        assert (enr_buf[-1, :] < 1).any()
+
+        # At least some ray should hit an absorber (in any of the batches)
+        _, _, all_hit_buf = read_buffers(sim_cfg.paths["buffer_dir"], sim_cfg)
+        assert all_hit_buf.sum() > 0
+
+        # Rays which haven't been absorbed should move with the constant speed,
+        # so they can't get further than speed * time_step between two steps
+        alive = enr_buf[-1, :] > 0
+        step_len = np.linalg.norm(pos_buf[1:, alive, :] - pos_buf[:-1, alive, :], axis=2)
+        assert (step_len <= speed * time_step + 1e-9).all()
+
+        # All remaining rays should be inside one of the three solids
+        # (rays which lost their energy stop exactly at the wall).
+        # Alive rays can also be exactly at the wall if they are just being reflected,
+        # so the point is checked with small offsets to avoid false negatives due to rounding.
+        curr_pos = pos_buf[-1, :, :].astype(FLOAT)
+        offsets = np.vstack((np.zeros(3), np.eye(3) * 1e-6, np.eye(3) * -1e-6))
+        for i in np.where(alive)[0]:
+            inside = False
+            for offset in offsets:
+                pt = curr_pos[i, :] + offset
+                if s0.is_point_inside(pt) or s1.is_point_inside(pt) or s2.is_point_inside(pt):
+                    inside = True
+                    break
+            assert inside
+
+
+@pytest.mark.parametrize("accel", ["voxel", "bvh"])
+def test_ray_simulation_accel(accel):
+    building = Building([Zone([box(1, 1, 1, (0, 0, 0), "s0")], "z")], "b")
+
+    with TemporaryDirectory() as tempdir:
+        sim_cfg = SimulationConfig(building)
+        sim_cfg.paths["project_dir"] = tempdir
+        sim_cfg.paths["buffer_dir"] = os.path.join(tempdir, "states")
+        sim_cfg.engine["accel"] = accel
+
+        # The step mode uses the chosen structure
+        grid, bvh = Simulation(building, sim_cfg).make_accel()
+        if accel == "voxel":
+            assert isinstance(grid, VoxelGrid) and bvh is None
+        else:
+            assert grid is None and isinstance(bvh, BVH)
+
+        # The event mode always uses the BVH, it never checks all polygons
+        sim_cfg.engine["mode"] = "event"
+        grid, bvh = Simulation(building, sim_cfg).make_accel()
+        assert grid is None and isinstance(bvh, BVH)
+
+
+@pytest.mark.parametrize("mode", ["step", "event"])
+def test_ray_simulation_receivers_only(mode):
+    s0 = box(1, 1, 1, (0, 0, 0), "s0")
+    s1 = box(1, 1, 1, (1, 0, 0), "s1")
+    zone = Zone([s0, s1], "z")
+    building = Building([zone], "b")
+
+    num_rays = 50
+    num_steps = 40
+    batch_size = 20
+
+    results = {}
+    for record_rays, record_every in (("all", 1), ("none", 1), (10, 5)):
+        with TemporaryDirectory() as tempdir:
+            sim_cfg = SimulationConfig(building)
+            sim_cfg.paths["project_dir"] = tempdir
+            sim_cfg.paths["buffer_dir"] = os.path.join(tempdir, "states")
+            sim_cfg.engine["mode"] = mode
+            sim_cfg.engine["time_step"] = 1e-4
+            sim_cfg.engine["num_steps"] = num_steps
+            sim_cfg.engine["batch_size"] = batch_size
+            sim_cfg.engine["record_rays"] = record_rays
+            sim_cfg.engine["record_every"] = record_every
+            sim_cfg.rays["num_rays"] = num_rays
+            sim_cfg.rays["source"] = (1.5, 0.5, 0.5)
+            sim_cfg.rays["absorbers"] = [(1.3, 0.3, 0.3), (0.5, 0.5, 0.5)]
+            sim_cfg.rays["seed"] = 1
+
+            sim = Simulation(building, sim_cfg)
+            sim.run()
+            results[record_rays] = read_buffers(sim_cfg.paths["buffer_dir"], sim_cfg)
+
+    pos_all, enr_all, hit_all = results["all"]
+    assert pos_all.shape == (num_steps + 1, num_rays, 3)
+    assert hit_all.sum() > 0
+
+    # Only hits are stored, but they are the same as in the full simulation
+    pos_none, enr_none, hit_none = results["none"]
+    assert pos_none.shape == (num_steps + 1, 0, 3)
+    assert enr_none.shape == (num_steps + 1, 0)
+    assert np.allclose(hit_none, hit_all)
+
+    # Sampled rays every 5 steps
+    pos_some, enr_some, hit_some = results[10]
+    rays = Simulation.get_record_rays(10, num_rays)
+    assert pos_some.shape == (num_steps // 5 + 1, 10, 3)
+    assert np.allclose(pos_some, pos_all[::5, rays])
+    assert np.allclose(enr_some, enr_all[::5, rays])
+    assert np.allclose(hit_some, hit_all)
+
+
+@pytest.mark.parametrize("mode", ["step", "event"])
+def test_ray_simulation_resume(mode):
+    s0 = box(1, 1, 1, (0, 0, 0), "s0")
+    s1 = box(1, 1, 1, (1, 0, 0), "s1")
+    zone = Zone([s0, s1], "z")
+    building = Building([zone], "b")
+
+    def make_config(buffer_dir, num_steps):
+        sim_cfg = SimulationConfig(building)
+        sim_cfg.paths["project_dir"] = tempdir
+        sim_cfg.paths["buffer_dir"] = buffer_dir
+        sim_cfg.engine["mode"] = mode
+        sim_cfg.engine["time_step"] = 1e-4
+        sim_cfg.engine["num_steps"] = num_steps
+        sim_cfg.engine["batch_size"] = 10
+        sim_cfg.rays["num_rays"] = 50
+        sim_cfg.rays["source"] = (1.5, 0.5, 0.5)
+        sim_cfg.rays["absorbers"] = [(1.3, 0.3, 0.3), (0.5, 0.5, 0.5)]
+        sim_cfg.rays["seed"] = 1
+        return sim_cfg
+
+    with TemporaryDirectory() as tempdir:
+        # Uninterrupted simulation
+        full_dir = os.path.join(tempdir, "full")
+        full_cfg = make_config(full_dir, 40)
+        Simulation(building, full_cfg).run()
+        pos_full, enr_full, hit_full = read_buffers(full_dir, full_cfg)
+
+        # Velocity of all rays is kept, also of those which stopped or reflected recently
+        checkpoint = load_checkpoint(os.path.join(full_dir, full_cfg.paths["checkpoint_file"]))
+        assert checkpoint.step == 40
+        assert np.allclose(np.linalg.norm(checkpoint.velocity, axis=1), 343.0)
+
+        # Simulation stopped after 2 batches and then resumed
+        part_dir = os.path.join(tempdir, "part")
+        Simulation(building, make_config(part_dir, 20)).run()
+
+        # The buffers can't be overwritten without resuming
+        with pytest.raises(RuntimeError):
+            Simulation(building, make_config(part_dir, 40))
+
+        # The simulation can't be resumed with different parameters
+        sim_cfg = make_config(part_dir, 40)
+        sim_cfg.rays["absorber_radius"] = 0.2
+        with pytest.raises(RuntimeError):
+            Simulation(building, sim_cfg, resume=True).run()
+
+        sim_cfg = make_config(part_dir, 40)
+        Simulation(building, sim_cfg, resume=True).run()
+        pos_part, enr_part, hit_part = read_buffers(part_dir, sim_cfg)
+
+        assert pos_part.shape == pos_full.shape
+        assert np.array_equal(pos_part, pos_full)
+        assert np.array_equal(enr_part, enr_full)
+        assert np.array_equal(hit_part, hit_full)
+
+
+def test_ray_simulation_array_format():
+    s0 = box(1, 1, 1, (0, 0, 0), "s0")
+    s1 = box(1, 1, 1, (1, 0, 0), "s1")
+    zone = Zone([s0, s1], "z")
+    building = Building([zone], "b")
+
+    results = []
+    for bdg in (building, to_array_format(building)):
+        with TemporaryDirectory() as tempdir:
+            sim_cfg = SimulationConfig(bdg)
+            sim_cfg.paths["project_dir"] = tempdir
+            sim_cfg.paths["buffer_dir"] = os.path.join(tempdir, "states")
+            sim_cfg.engine["time_step"] = 1e-4
+            sim_cfg.engine["num_steps"] = 40
+            sim_cfg.engine["batch_size"] = 20
+            sim_cfg.rays["num_rays"] = 50
+            sim_cfg.rays["source"] = (1.5, 0.5, 0.5)
+            sim_cfg.rays["absorbers"] = [(0.5, 0.5, 0.5)]
+            sim_cfg.rays["seed"] = 1
+
+            sim = Simulation(bdg, sim_cfg)
+            results.append(sim.run())
+            assert sim.transparent.sum() == 2
+
+    # The same results without the Building instance
+    for buf_bdg, buf_arr in zip(*results):
+        assert np.array_equal(buf_bdg, buf_arr)
+    assert (results[0][0][-1, :, 0] < 1).any()  # Rays pass through the transparent polygons
+
+
 if __name__ == "__main__":
-    test_ray_simulation(show=True)
+    test_ray_simulation(accel="voxel", show=True)
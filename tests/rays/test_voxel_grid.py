@@ -1,7 +1,28 @@
+import numpy as np
 import pytest
 
+from building3d.geom.mesh import vstack_mesh
 from building3d.geom.solid.box import box
+from building3d.geom.polygon import Polygon
+from building3d.geom.types import FLOAT
+from building3d.geom.types import INT
+from building3d.sim.rays.find_nearby_polygons import find_nearby_polygons
+from building3d.sim.rays.scene import make_scene
+from building3d.sim.rays.voxel_grid import average_polygons_per_cell
+from building3d.sim.rays.voxel_grid import get_cell_polygons
+from building3d.sim.rays.voxel_grid import get_grid_nbytes
+from building3d.sim.rays.voxel_grid import is_triangle_crossing_box
 from building3d.sim.rays.voxel_grid import make_voxel_grid
+from building3d.sim.rays.voxel_grid import morton_decode
+from building3d.sim.rays.voxel_grid import morton_encode
+
+
+def make_test_scene(polys):
+    pts, tri = vstack_mesh(tuple(p.pts for p in polys), tuple(p.tri for p in polys))
+    polygons = np.concatenate(
+        [np.full(p.tri.shape[0], i, dtype=INT) for i, p in enumerate(polys)]
+    )
+    return make_scene(pts, tri, polygons, len(polys))
 
 
 def test_voxel_grid_large_step():
@@ -20,16 +41,19 @@ def test_voxel_grid_large_step():
         ("ceiling", "ceiling"),
     ]
 
-    poly_pts = []
+    polys = []
 
     for wname, pname in wall_poly_names:
-        poly_pts.append(s0[wname][pname].pts)
-        poly_pts.append(s1[wname][pname].pts)
+        polys.append(s0[wname][pname])
+        polys.append(s1[wname][pname])
+
+    scene = make_test_scene(polys)
 
-    grid = make_voxel_grid(min_xyz, max_xyz, poly_pts, step)
+    grid = make_voxel_grid(min_xyz, max_xyz, scene, step)
 
-    assert len(grid[(0, 0, 0)]) == 12  # All polygons in this voxel
-    assert len(grid[(-1, 0, 0)]) == 5  # 1 front face + 4 perpendicular
+    assert len(get_cell_polygons(grid, 0, 0, 0)) == 12  # All polygons in this voxel
+    assert len(get_cell_polygons(grid, -1, 0, 0)) == 5  # 1 front face + 4 perpendicular
+    assert len(get_cell_polygons(grid, -10, 0, 0)) == 0  # Outside the grid
 
 
 def test_voxel_grid_small_step():
@@ -48,21 +72,18 @@ def test_voxel_grid_small_step():
         ("ceiling", "ceiling"),
     ]
 
-    poly_pts = []
+    polys = []
 
     for wname, pname in wall_poly_names:
-        poly_pts.append(s0[wname][pname].pts)
-        poly_pts.append(s1[wname][pname].pts)
+        polys.append(s0[wname][pname])
+        polys.append(s1[wname][pname])
 
-    grid = make_voxel_grid(min_xyz, max_xyz, poly_pts, step)
+    scene = make_test_scene(polys)
 
-    polygons = set()
-    empty_cells = 0
-    for val in grid.values():
-        for p in val:
-            polygons.add(p)
-        if len(val) == 0:
-            empty_cells += 1
+    grid = make_voxel_grid(min_xyz, max_xyz, scene, step)
+
+    polygons = set(grid.cell_polys)
+    empty_cells = np.sum(np.diff(grid.cell_offset) == 0)
 
     assert len(polygons) == 12  # All polygons in the grid
     assert empty_cells > 0  # Some cells should have no polygons
@@ -84,11 +105,153 @@ def test_voxel_grid_empty():
         ("ceiling", "ceiling"),
     ]
 
-    poly_pts = []
+    polys = []
 
     for wname, pname in wall_poly_names:
-        poly_pts.append(s0[wname][pname].pts)
-        poly_pts.append(s1[wname][pname].pts)
+        polys.append(s0[wname][pname])
+        polys.append(s1[wname][pname])
+
+    scene = make_test_scene(polys)
 
     with pytest.raises(ValueError):
-        _ = make_voxel_grid(min_xyz, max_xyz, poly_pts, step)
+        _ = make_voxel_grid(min_xyz, max_xyz, scene, step)
+
+
+def test_voxel_grid_neighborhood():
+    s0 = box(1, 1, 1, (0, 0, 0), name="s0")
+    s1 = box(1, 1, 1, (1, 0, 0), name="s1")
+    min_xyz = (0.0, 0.0, 0.0)
+    max_xyz = (2.0, 1.0, 1.0)
+    step = 0.3
+
+    polys = []
+    for solid in (s0, s1):
+        for wall in solid.children.values():
+            polys.extend(wall.children.values())
+
+    scene = make_test_scene(polys)
+
+    grid = make_voxel_grid(min_xyz, max_xyz, scene, step)
+    nb_grid = make_voxel_grid(min_xyz, max_xyz, scene, step, neighborhood=True)
+    assert not grid.neighborhood
+    assert nb_grid.neighborhood
+    assert (grid.shape == nb_grid.shape).all()
+
+    # Cells outside the grid are empty, so only the cells inside are compared
+    (x0, y0, z0), (nx, ny, nz) = grid.origin, grid.shape
+    for x in range(x0, x0 + nx):
+        for y in range(y0, y0 + ny):
+            for z in range(z0, z0 + nz):
+                expected = set()
+                for i in range(-1, 2):
+                    for j in range(-1, 2):
+                        for k in range(-1, 2):
+                            expected |= set(get_cell_polygons(grid, x + i, y + j, z + k))
+
+                nb_polys = get_cell_polygons(nb_grid, x, y, z)
+                assert len(nb_polys) == len(expected)  # No duplicates
+                assert set(nb_polys) == expected
+                assert set(find_nearby_polygons(x, y, z, grid)) == expected
+                assert set(find_nearby_polygons(x, y, z, nb_grid)) == expected
+
+
+def test_is_triangle_crossing_box():
+    center = np.array([0.5, 0.5, 0.5])
+    half = 0.5
+
+    # Triangle crossing the cube diagonally
+    pt1 = np.array([-1.0, -1.0, 0.5])
+    pt2 = np.array([2.0, -1.0, 0.5])
+    pt3 = np.array([0.5, 2.0, 0.5])
+    assert is_triangle_crossing_box(pt1, pt2, pt3, center, half)
+
+    # Triangle touching the cube face
+    up = np.array([0.0, 0.0, 0.5])
+    assert is_triangle_crossing_box(pt1 + up, pt2 + up, pt3 + up, center, half)
+
+    # Triangle above the cube
+    up = np.array([0.0, 0.0, 1.0])
+    assert not is_triangle_crossing_box(pt1 + up, pt2 + up, pt3 + up, center, half)
+
+    # Sloped triangle whose bounding box contains the cube, but which passes by its corner
+    pt1 = np.array([1.2, 0.0, 0.0])
+    pt2 = np.array([0.0, 1.2, 0.0])
+    pt3 = np.array([0.0, 0.0, 1.2])
+    assert is_triangle_crossing_box(pt1, pt2, pt3, center, half)
+    pt1 = np.array([3.2, 0.0, 0.0])
+    pt2 = np.array([0.0, 3.2, 0.0])
+    pt3 = np.array([0.0, 0.0, 3.2])
+    assert not is_triangle_crossing_box(pt1, pt2, pt3, center, half)
+
+
+def test_voxel_grid_exact_sloped_polygon():
+    # Sloped roof-like polygon
+    roof = Polygon(
+        np.array([[0, 0, 0], [3, 0, 3], [3, 2, 3], [0, 2, 0]], dtype=FLOAT),
+        name="roof",
+    )
+    scene = make_test_scene([roof])
+    min_xyz = (0.0, 0.0, 0.0)
+    max_xyz = (3.0, 2.0, 3.0)
+    step = 0.25
+
+    bbox_grid = make_voxel_grid(min_xyz, max_xyz, scene, step, exact=False)
+    exact_grid = make_voxel_grid(min_xyz, max_xyz, scene, step, exact=True)
+
+    # Fewer cells contain the polygon, but only those which are also in the bbox grid
+    assert average_polygons_per_cell(exact_grid) < 0.5 * average_polygons_per_cell(bbox_grid)
+    bbox_cells = np.diff(bbox_grid.cell_offset) > 0
+    exact_cells = np.diff(exact_grid.cell_offset) > 0
+    assert not (exact_cells & ~bbox_cells).any()
+
+    # Each point of the polygon is in a cell containing the polygon
+    rng = np.random.default_rng(0)
+    for u, v in rng.uniform(0, 1, size=(500, 2)):
+        pt = np.array([3 * u, 2 * v, 3 * u])
+        x, y, z = np.floor(pt / step).astype(int)
+        assert 0 in get_cell_polygons(exact_grid, x, y, z)
+
+
+def test_morton_code():
+    for i, j, k in [(0, 0, 0), (1, 2, 3), (7, 0, 5), (2**21 - 1, 12345, 2**20)]:
+        assert morton_decode(morton_encode(i, j, k)) == (i, j, k)
+    assert morton_encode(1, 0, 0) == 1
+    assert morton_encode(0, 1, 0) == 2
+    assert morton_encode(0, 0, 1) == 4
+    assert morton_encode(1, 1, 1) < morton_encode(2, 0, 0)
+
+
+@pytest.mark.parametrize("neighborhood", [False, True])
+def test_voxel_grid_sparse(neighborhood):
+    # Two rooms far from each other, the space between them is empty
+    s0 = box(1, 1, 1, (0, 0, 0), name="s0")
+    s1 = box(1, 1, 1, (5, 4, 2), name="s1")
+    polys = []
+    for solid in (s0, s1):
+        for wall in solid.children.values():
+            polys.extend(wall.children.values())
+
+    scene = make_test_scene(polys)
+    min_xyz = (0.0, 0.0, 0.0)
+    max_xyz = (6.0, 5.0, 3.0)
+    step = 0.25
+
+    dense = make_voxel_grid(min_xyz, max_xyz, scene, step, neighborhood=neighborhood)
+    sparse = make_voxel_grid(
+        min_xyz, max_xyz, scene, step, neighborhood=neighborhood, sparse=True
+    )
+    assert not dense.sparse
+    assert sparse.sparse
+    assert (sparse.cell_keys[1:] > sparse.cell_keys[:-1]).all()
+    assert sparse.cell_keys.size < 0.5 * (dense.cell_offset.size - 1)
+    assert get_grid_nbytes(sparse) < get_grid_nbytes(dense)
+    assert np.isclose(average_polygons_per_cell(sparse), average_polygons_per_cell(dense))
+
+    (x0, y0, z0), (nx, ny, nz) = dense.origin, dense.shape
+    for x in range(x0 - 1, x0 + nx + 1):
+        for y in range(y0 - 1, y0 + ny + 1):
+            for z in range(z0 - 1, z0 + nz + 1):
+                expected = get_cell_polygons(dense, x, y, z)
+                assert (get_cell_polygons(sparse, x, y, z) == expected).all()
+                if neighborhood:
+                    assert set(find_nearby_polygons(x, y, z, sparse)) == set(expected)